@@ -0,0 +1,79 @@
+from fastapi import HTTPException
+
+from app.core.config import REQUEST_MAX_BYTES, UPLOAD_MAX_BYTES
+
+UPLOAD_PATHS = ("/admin/product/add", "/admin/product/update",
+                "/admin/variant/codes", "/admin/catalog/import")
+TOO_LARGE_MESSAGE = "Слишком большой запрос"
+
+
+def body_limit(path: str) -> int:
+    if path in UPLOAD_PATHS:
+        return UPLOAD_MAX_BYTES + REQUEST_MAX_BYTES
+    return REQUEST_MAX_BYTES
+
+
+# Rejects oversized bodies with 413 while they are being read, before the
+# multipart parser spools them to disk. A declared Content-Length over the
+# limit is refused without reading anything.
+class BodyLimitMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = body_limit(scope["path"])
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > limit:
+                    await self._too_large(send)
+                    return
+        received = 0
+        response_started = False
+
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Re-raised by FastAPI's body parsing, so the exception
+                    # handlers turn it into a normal 413 response.
+                    raise HTTPException(
+                        status_code=413, detail=TOO_LARGE_MESSAGE
+                    )
+            return message
+
+        async def send_wrapper(message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except HTTPException as exc:
+            if exc.status_code != 413 or response_started:
+                raise
+            await self._too_large(send)
+
+    async def _too_large(self, send) -> None:
+        body = TOO_LARGE_MESSAGE.encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode("ascii")),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
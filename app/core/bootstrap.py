@@ -0,0 +1,32 @@
+from sqlalchemy import select
+
+from app.core.cache_bus import cache_bus
+from app.core.config import SHOP_TYPES
+from app.core.database import WriteSessionLocal, init_db
+from app.models import ShopSettings
+from app.services.points import ensure_opening_snapshots
+from app.services.search import ensure_search_indexes
+
+_bootstrapped = False
+
+
+def bootstrap_db() -> None:
+    global _bootstrapped
+    init_db()
+    with WriteSessionLocal() as db:
+        existing = set(db.execute(select(ShopSettings.shop_type)).scalars())
+        for shop_type in SHOP_TYPES:
+            if shop_type not in existing:
+                db.add(ShopSettings(shop_type=shop_type))
+        cache_bus.ensure_topics(db)
+        ensure_opening_snapshots(db)
+        ensure_search_indexes(db)
+        db.commit()
+    _bootstrapped = True
+
+
+def ensure_bootstrapped() -> None:
+    # Under gunicorn the master runs bootstrap_db() once before forking and
+    # the flag is inherited; a plain uvicorn process does it on startup.
+    if not _bootstrapped:
+        bootstrap_db()
@@ -0,0 +1,128 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import CACHE_BUS_POLL_SECONDS
+from app.core.database import SessionLocal, engine
+from app.models import CacheVersion
+
+logger = logging.getLogger("app.cache_bus")
+
+TOPICS = ("settings", "catalog")
+
+
+# Every topic has a version row in cache_versions; publishing bumps it inside
+# the writer's transaction. Workers notice the bump by polling the table
+# and then call the topic's subscribers.
+class CacheBus:
+    def __init__(self) -> None:
+        self._versions: dict[str, int] = {}
+        self._subscribers: dict[str, list[Callable[[], None]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, topic: str, callback: Callable[[], None]) -> None:
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def version(self, topic: str) -> int:
+        return self._versions.get(topic, 0)
+
+    def live_version(self, topic: str) -> Optional[int]:
+        # None when this process is not listening, so callers must not trust
+        # the version for caching.
+        if self._thread is None or not self._thread.is_alive():
+            return None
+        return self._versions.get(topic)
+
+    def version_for(self, db: Session, topic: str) -> Optional[int]:
+        # The version to cache data read through ``db`` under; call it
+        # before reading the data, so the data is at least that new. The
+        # bus follows the primary, so its version is safe for primary
+        # sessions. A replica may lag behind it, so there the version row
+        # is read from the replica itself.
+        if db.get_bind() is engine:
+            return self.live_version(topic)
+        return db.execute(
+            select(CacheVersion.version).where(CacheVersion.topic == topic)
+        ).scalar_one_or_none()
+
+    def ensure_topics(self, db: Session) -> None:
+        # Rows of retired topics are dropped.
+        db.execute(
+            delete(CacheVersion).where(CacheVersion.topic.not_in(TOPICS))
+        )
+        existing = set(db.execute(select(CacheVersion.topic)).scalars())
+        for topic in TOPICS:
+            if topic not in existing:
+                db.add(CacheVersion(topic=topic, version=0))
+
+    def publish(self, db: Session, *topics: str) -> None:
+        db.execute(
+            update(CacheVersion)
+            .where(CacheVersion.topic.in_(topics))
+            .values(
+                version=CacheVersion.version + 1,
+                updated_at=datetime.utcnow(),
+            )
+        )
+        # The publishing worker picks up its own change right after commit
+        # instead of waiting for the next poll.
+        event.listen(
+            db, "after_commit", self._refresh_after_commit, once=True
+        )
+
+    def _refresh_after_commit(self, session) -> None:
+        self._safe_refresh()
+
+    def refresh(self) -> list[str]:
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(CacheVersion.topic, CacheVersion.version)
+            ).all()
+        changed = []
+        with self._lock:
+            for topic, version in rows:
+                known = self._versions.get(topic)
+                self._versions[topic] = version
+                if known is not None and known != version:
+                    changed.append(topic)
+        for topic in changed:
+            for callback in self._subscribers.get(topic, ()):
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("cache bus subscriber for %s failed", topic)
+        return changed
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.refresh()
+        self._thread = threading.Thread(
+            target=self._poll_loop,
+            name="cache-bus",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _safe_refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("cache bus refresh failed")
+
+    def _poll_loop(self) -> None:
+        while not self._stop.wait(CACHE_BUS_POLL_SECONDS):
+            self._safe_refresh()
+
+
+cache_bus = CacheBus()
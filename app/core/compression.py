@@ -0,0 +1,198 @@
+import time
+import zlib
+from typing import Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.core.config import (COMPRESSION_BROTLI_QUALITY, COMPRESSION_ENABLED,
+                             COMPRESSION_GZIP_LEVEL, COMPRESSION_MIN_SIZE,
+                             COMPRESSION_TYPES)
+from app.core.metrics import record_compression
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# Bodies this large are compressed in a worker thread (zlib and brotli release
+# the GIL) so one big admin page does not stall the event loop.
+OFFLOAD_BYTES = 256 * 1024
+SKIP_STATUSES = {204, 206, 304}
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL) -> None:
+        # wbits=31 writes the gzip header and trailer.
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        # A sync flush after every streamed chunk lets the client decode what
+        # has been sent so far instead of waiting for zlib's window to fill.
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        )
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int = COMPRESSION_BROTLI_QUALITY) -> None:
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        output = self._compressor.process(data)
+        if final:
+            return output + self._compressor.finish()
+        return output + self._compressor.flush()
+
+
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS = {"br": BrotliEncoder, **ENCODERS}
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[name] = quality
+    best, best_quality = None, 0.0
+    # ENCODERS is ordered by preference, so ties go to brotli.
+    for name in ENCODERS:
+        quality = weights.get(name, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def is_compressible(status: int, headers: Headers) -> bool:
+    if status < 200 or status in SKIP_STATUSES:
+        return False
+    # Already encoded (precompressed files, proxied downloads) stays as is.
+    if "content-encoding" in headers:
+        return False
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return media_type in COMPRESSION_TYPES
+
+
+class CompressionResponder:
+    def __init__(self, send, encoding: Optional[str]) -> None:
+        self._send = send
+        self.encoding = encoding
+        self.start_message: Optional[dict] = None
+        self.encoder = None
+        self.decided = False
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.seconds = 0.0
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.decided:
+            self.decided = True
+            self._decide(body, more_body)
+            if self.encoder is None:
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+            if not more_body:
+                compressed = await self._compress(body, True)
+                headers = MutableHeaders(raw=self.start_message["headers"])
+                headers["content-length"] = str(len(compressed))
+                await self._send(self.start_message)
+                await self._send(
+                    {"type": "http.response.body", "body": compressed}
+                )
+                self._record()
+                return
+            await self._send(self.start_message)
+        if self.encoder is None:
+            await self._send(message)
+            return
+        await self._send(
+            {
+                "type": "http.response.body",
+                "body": await self._compress(body, not more_body),
+                "more_body": more_body,
+            }
+        )
+        if not more_body:
+            self._record()
+
+    def _decide(self, body: bytes, more_body: bool) -> None:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if not is_compressible(self.start_message["status"], headers):
+            return
+        if not more_body and len(body) < COMPRESSION_MIN_SIZE:
+            return
+        headers.add_vary_header("Accept-Encoding")
+        if self.encoding is None:
+            return
+        self.encoder = ENCODERS[self.encoding]()
+        headers["content-encoding"] = self.encoding
+        if "content-length" in headers:
+            del headers["content-length"]
+        # The compressed bytes differ from the ones the ETag was computed for,
+        # but they are semantically the same representation.
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["etag"] = f"W/{etag}"
+
+    async def _compress(self, body: bytes, final: bool) -> bytes:
+        started = time.perf_counter()
+        if len(body) >= OFFLOAD_BYTES:
+            output = await anyio.to_thread.run_sync(
+                self.encoder.compress, body, final
+            )
+        else:
+            output = self.encoder.compress(body, final)
+        self.seconds += time.perf_counter() - started
+        self.raw_bytes += len(body)
+        self.sent_bytes += len(output)
+        return output
+
+    def _record(self) -> None:
+        record_compression(
+            self.encoding, self.raw_bytes, self.sent_bytes, self.seconds
+        )
+
+
+class CompressionMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        # HEAD responses carry the identity Content-Length and no body.
+        if (
+            scope["type"] != "http"
+            or not COMPRESSION_ENABLED
+            or scope["method"] == "HEAD"
+        ):
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        responder = CompressionResponder(send, choose_encoding(accept_encoding))
+        await self.app(scope, receive, responder.send)
@@ -7,10 +7,112 @@ APP_TZ = os.getenv("APP_TZ", "Europe/Moscow")
 
 UPLOAD_DIR = Path("app/static/uploads")
 ALLOWED_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif"}
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+# Any other request body; upload routes get UPLOAD_MAX_BYTES on top of it.
+REQUEST_MAX_BYTES = int(os.getenv("REQUEST_MAX_BYTES", str(1024 * 1024)))
 
 TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN")
 TG_GROUP_CHAT_ID = os.getenv("TG_GROUP_CHAT_ID")
 
+ORDER_FEED_REFRESH_SECONDS = float(os.getenv("ORDER_FEED_REFRESH_SECONDS", "2"))
+ORDER_FEED_BUFFER_SIZE = int(os.getenv("ORDER_FEED_BUFFER_SIZE", "200"))
+# Every poll re-sends this many ids below the client's last one, so orders
+# that commit after a higher id and status changes still reach open tabs.
+ORDER_FEED_RESEND_IDS = int(os.getenv("ORDER_FEED_RESEND_IDS", "50"))
+
+WAITING_ROOM_DEFAULT_RATE = int(os.getenv("WAITING_ROOM_DEFAULT_RATE", "20"))
+WAITING_ROOM_BURST = int(os.getenv("WAITING_ROOM_BURST", "50"))
+WAITING_ROOM_REFRESH_SECONDS = int(
+    os.getenv("WAITING_ROOM_REFRESH_SECONDS", "5")
+)
+
+
+def _parse_load_limits(raw: str) -> dict[str, tuple[int, float]]:
+    limits = {}
+    for item in raw.split(","):
+        name, _, spec = item.strip().partition("=")
+        if not name or not spec:
+            continue
+        limit, _, timeout = spec.partition(":")
+        limits[name] = (int(limit), float(timeout or 0))
+    return limits
+
+
+# route_class=max_concurrent:queue_timeout_seconds, per worker process: with
+# WEB_CONCURRENCY=4 the server admits up to 4x these.
+LOAD_LIMITS = _parse_load_limits(
+    os.getenv(
+        "LOAD_LIMITS",
+        "checkout=24:5,browse=12:1,auth=4:3,admin=4:10",
+    )
+)
+LOAD_SHEDDING_ENABLED = os.getenv("LOAD_SHEDDING_ENABLED", "1") == "1"
+LOAD_SHED_RETRY_AFTER = int(os.getenv("LOAD_SHED_RETRY_AFTER", "2"))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Shared by all workers of one server; /metrics sums their snapshots.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "0") == "1"
+
+PROFILE_SQL = os.getenv("PROFILE_SQL", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH")
+
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH")
+TRAFFIC_RECORD_MAX_BODY = int(os.getenv("TRAFFIC_RECORD_MAX_BODY", "65536"))
+
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "1") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Negative values are KiB, as in PRAGMA cache_size.
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_WRITE_TIMEOUT = float(os.getenv("SQLITE_WRITE_TIMEOUT", "30"))
+
+# How long a browser keeps reading from the primary after it wrote something,
+# when a read replica is configured.
+READ_AFTER_WRITE_SECONDS = float(os.getenv("READ_AFTER_WRITE_SECONDS", "5"))
+
+CACHE_BUS_POLL_SECONDS = float(os.getenv("CACHE_BUS_POLL_SECONDS", "0.25"))
+
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "0") == "1"
+# Compiled template bytecode survives restarts here; empty disables it.
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "data/jinja_cache")
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "64"))
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# Only used when the brotli package is installed.
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_TYPES = tuple(
+    item.strip()
+    for item in os.getenv(
+        "COMPRESSION_TYPES",
+        "text/html,text/css,text/csv,text/plain,text/javascript,"
+        "application/javascript,application/json,image/svg+xml",
+    ).split(",")
+    if item.strip()
+)
+
+# Finished orders older than this move to orders_archive.
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "90"))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "500"))
+ORDER_ARCHIVE_PAUSE_SECONDS = float(
+    os.getenv("ORDER_ARCHIVE_PAUSE_SECONDS", "0.05")
+)
+
+# Rows per section in the /admin search results.
+ADMIN_SEARCH_LIMIT = int(os.getenv("ADMIN_SEARCH_LIMIT", "20"))
+
+# Orders per page on /orders and /api/orders.
+USER_ORDERS_PAGE_SIZE = int(os.getenv("USER_ORDERS_PAGE_SIZE", "20"))
+
+# How often each worker folds pending ledger credits into users.points;
+# 0 leaves it to checkouts and compact-ledger.
+POINTS_FOLD_SECONDS = float(os.getenv("POINTS_FOLD_SECONDS", "30"))
+
 SHOP_TYPES = ("regular", "premium")
 ORDER_STATUSES = ("new", "processing", "delivered", "cancelled")
 ORDER_STATUS_LABELS = {
@@ -19,3 +121,12 @@ ORDER_STATUS_LABELS = {
     "delivered": "Доставлен",
     "cancelled": "Отменён",
 }
+ORDER_ARCHIVE_STATUSES = ("delivered", "cancelled")
+# Statuses an order may move to from each status. Finished orders can only
+# be reopened, so a delivered order is never cancelled by a stray click.
+ORDER_STATUS_TRANSITIONS = {
+    "new": ("processing", "delivered", "cancelled"),
+    "processing": ("new", "delivered", "cancelled"),
+    "delivered": ("processing",),
+    "cancelled": ("processing",),
+}
@@ -1,11 +1,30 @@
 import os
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from starlette.requests import Request
+
+from app.core.config import (READ_AFTER_WRITE_SECONDS,
+                             SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE,
+                             SQLITE_MMAP_SIZE, SQLITE_TUNED,
+                             SQLITE_WRITE_TIMEOUT)
+from app.core.metrics import install_db_hooks, mark_handler_start
+from app.core.profiling import profiler
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/app.db")
-ALTER_TABLE = "ALTER TABLE users ADD COLUMN password_hash VARCHAR(255)"
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+ALTER_TABLE = "ALTER TABLE {table} ADD COLUMN {column} {ddl}"
+ADDED_COLUMNS = (
+    ("users", "password_hash", "VARCHAR(255)"),
+    ("shop_settings", "queue_enabled", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    ("shop_settings", "queue_rate", "INTEGER"),
+    ("product_variants", "code_pool", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    ("products", "external_key", "VARCHAR(100)"),
+    ("product_variants", "external_key", "VARCHAR(100)"),
+)
 
 
 class Base(DeclarativeBase):
@@ -23,16 +42,100 @@ def _ensure_sqlite_dir(database_url: str) -> None:
         dir_path.mkdir(parents=True, exist_ok=True)
 
 
-_connect_args = {
-    "check_same_thread": False
-} if DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(DATABASE_URL, connect_args=_connect_args)
-SessionLocal = sessionmaker(
-    bind=engine,
-    autoflush=False,
-    autocommit=False,
-    expire_on_commit=False,
+def _is_sqlite_file(database_url: str) -> bool:
+    # An in-memory database is private to its connection, so it cannot be
+    # split between several pools.
+    return database_url.startswith("sqlite") and (
+        ":memory:" not in database_url
+    ) and database_url.rstrip("/") != "sqlite:"
+
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+def _apply_sqlite_pragmas(dbapi_connection, sqlite_file: bool) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        if sqlite_file:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+    finally:
+        cursor.close()
+
+
+def _make_engine(database_url: str, **kwargs):
+    is_sqlite = database_url.startswith("sqlite")
+    new_engine = create_engine(
+        database_url,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        **kwargs,
+    )
+    install_db_hooks(new_engine)
+    profiler.install(new_engine)
+    if is_sqlite and SQLITE_TUNED:
+        sqlite_file = _is_sqlite_file(database_url)
+
+        @event.listens_for(new_engine, "connect")
+        def _tune_sqlite(dbapi_connection, connection_record) -> None:
+            _apply_sqlite_pragmas(dbapi_connection, sqlite_file)
+
+    return new_engine
+
+
+def _session_factory(bind):
+    return sessionmaker(
+        bind=bind,
+        autoflush=False,
+        autocommit=False,
+        expire_on_commit=False,
+    )
+
+
+engine = _make_engine(DATABASE_URL)
+SessionLocal = _session_factory(engine)
+
+if IS_SQLITE and SQLITE_TUNED and _is_sqlite_file(DATABASE_URL):
+    # SQLite allows one writer at a time. Instead of letting every pooled
+    # connection race for the lock (and fail with "database is locked"),
+    # write transactions queue for a single connection and take the lock
+    # up front with BEGIN IMMEDIATE; WAL keeps readers on the main pool
+    # unblocked meanwhile.
+    write_engine = _make_engine(
+        DATABASE_URL,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=SQLITE_WRITE_TIMEOUT,
+    )
+
+    @event.listens_for(write_engine, "connect")
+    def _disable_pysqlite_begin(dbapi_connection, connection_record) -> None:
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(write_engine, "begin")
+    def _begin_immediate(connection) -> None:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+else:
+    write_engine = engine
+WriteSessionLocal = _session_factory(write_engine)
+
+# Browse pages and admin reports may be served from a replica. Without one
+# configured, reads simply use the primary pool.
+read_engine = (
+    _make_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
 )
+ReadSessionLocal = _session_factory(read_engine)
+
+
+def dispose_engines(close: bool = True) -> None:
+    # After a fork the child must not reuse the parent's pooled sockets;
+    # close=False drops them without sending anything on the shared
+    # connections.
+    for pool_engine in {engine, write_engine, read_engine}:
+        pool_engine.dispose(close=close)
 
 
 def init_db() -> None:
@@ -40,36 +143,94 @@ def init_db() -> None:
     import app.models  # noqa: F401
 
     Base.metadata.create_all(bind=engine)
-    _ensure_password_column()
+    _ensure_added_columns()
+    _ensure_indexes()
+
+
+def _existing_columns(connection, table: str) -> set[str]:
+    if DATABASE_URL.startswith("sqlite"):
+        rows = connection.execute(
+            text(f"PRAGMA table_info({table})")
+        ).fetchall()
+        return {row[1] for row in rows}
+    rows = connection.execute(
+        text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name=:table"
+        ),
+        {"table": table},
+    ).fetchall()
+    return {row[0] for row in rows}
 
 
-def _ensure_password_column() -> None:
+def _ensure_added_columns() -> None:
     with engine.begin() as connection:
-        if DATABASE_URL.startswith("sqlite"):
-            rows = connection.execute(
-                text("PRAGMA table_info(users)")
-            ).fetchall()
-            columns = {row[1] for row in rows}
-            if "password_hash" not in columns:
+        columns_by_table: dict[str, set[str]] = {}
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in columns_by_table:
+                columns_by_table[table] = _existing_columns(connection, table)
+            if column not in columns_by_table[table]:
                 connection.execute(
-                    text(ALTER_TABLE)
-                )
-        else:
-            rows = connection.execute(
-                text(
-                    "SELECT column_name FROM information_schema.columns "
-                    "WHERE table_name='users' AND column_name='password_hash'"
-                )
-            ).fetchall()
-            if not rows:
-                connection.execute(
-                    text(ALTER_TABLE)
+                    text(ALTER_TABLE.format(
+                        table=table, column=column, ddl=ddl
+                    ))
                 )
 
 
+def _ensure_indexes() -> None:
+    # create_all() skips tables that already exist, so indexes added to a
+    # model later are created here.
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+
+
 def get_db():
+    mark_handler_start()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+@contextmanager
+def write_session(request: Request):
+    # For handlers that validate on a pooled session and only need the
+    # writer for the transaction itself.
+    db = WriteSessionLocal()
+    if read_engine is not engine:
+        # Read-your-writes: after a commit this browser reads from the
+        # primary until the replica has had time to catch up.
+        @event.listens_for(db, "after_commit")
+        def _stick_to_primary(session) -> None:
+            request.session["primary_until"] = (
+                time.time() + READ_AFTER_WRITE_SECONDS
+            )
+
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_write_db(request: Request):
+    mark_handler_start()
+    with write_session(request) as db:
+        yield db
+
+
+def read_session_factory(request: Request):
+    if request.session.get("primary_until", 0) > time.time():
+        return SessionLocal
+    return ReadSessionLocal
+
+
+def get_read_db(request: Request):
+    mark_handler_start()
+    db = read_session_factory(request)()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+from collections import deque
+from typing import Optional
+
+from app.core.config import (LOAD_LIMITS, LOAD_SHED_RETRY_AFTER,
+                             LOAD_SHEDDING_ENABLED)
+
+ROUTE_CLASS_PREFIXES = (
+    ("checkout", ("/api/redeem", "/api/checkout")),
+    ("admin", ("/admin",)),
+    ("auth", ("/login", "/register", "/logout")),
+)
+UNLIMITED_PREFIXES = ("/static/", "/metrics")
+# Browse traffic is shed as soon as checkout requests start queueing.
+YIELDS_TO = {"browse": "checkout"}
+OVERLOADED_MESSAGE = "Сервер перегружен. Попробуйте ещё раз через пару секунд."
+
+
+def classify_path(path: str) -> Optional[str]:
+    if path.startswith(UNLIMITED_PREFIXES):
+        return None
+    for route_class, prefixes in ROUTE_CLASS_PREFIXES:
+        for prefix in prefixes:
+            if path == prefix or path.startswith(prefix + "/"):
+                return route_class
+    return "browse"
+
+
+class RouteClassLimiter:
+    def __init__(self, name: str, limit: int, queue_timeout: float) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _admit(self) -> bool:
+        self.admitted += 1
+        return True
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return self._admit()
+        if self.queue_timeout <= 0:
+            self.shed += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+            return self._admit()
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return self._admit()
+            self.timed_out += 1
+            self.shed += 1
+            return False
+        except asyncio.CancelledError:
+            # The client went away after release() handed us the slot; pass
+            # it on or it leaks.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+
+    def release(self) -> None:
+        # Hand the slot straight to the oldest waiter so queued requests are
+        # not overtaken by new arrivals.
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def reject(self) -> None:
+        self.shed += 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+limiters = {
+    name: RouteClassLimiter(name, limit, queue_timeout)
+    for name, (limit, queue_timeout) in LOAD_LIMITS.items()
+}
+
+
+def load_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+class LoadSheddingMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not LOAD_SHEDDING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        route_class = classify_path(scope["path"])
+        limiter = limiters.get(route_class) if route_class else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        preferred = limiters.get(YIELDS_TO.get(route_class, ""))
+        if preferred is not None and preferred.waiting:
+            limiter.reject()
+            await self._overloaded(scope, send)
+            return
+        if not await limiter.acquire():
+            await self._overloaded(scope, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def _overloaded(self, scope, send) -> None:
+        if scope["path"].startswith("/api/"):
+            body = json.dumps(
+                {"ok": False, "message": OVERLOADED_MESSAGE,
+                 "code": "overloaded"},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            content_type = b"application/json"
+        else:
+            body = OVERLOADED_MESSAGE.encode("utf-8")
+            content_type = b"text/plain; charset=utf-8"
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", content_type),
+                    (b"content-length", str(len(body)).encode("ascii")),
+                    (b"retry-after", str(LOAD_SHED_RETRY_AFTER).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,412 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+from app.core.config import (METRICS_ENABLED, METRICS_FLUSH_SECONDS,
+                             METRICS_MULTIPROC_DIR, SERVER_TIMING_ENABLED)
+
+logger = logging.getLogger("app.metrics")
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_request_stats: ContextVar[Optional[dict]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple, Histogram] = {}
+        self._counters: dict[tuple, float] = {}
+        self._help: dict[str, tuple[str, str]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name: str, labels: tuple, value: float, buckets) -> None:
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, labels: tuple, value: float = 1) -> None:
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def state(self) -> dict:
+        # JSON-safe copy for WorkerSnapshots.
+        with self._lock:
+            return {
+                "histograms": [
+                    [name, labels, histogram.buckets, histogram.counts,
+                     histogram.total, histogram.count]
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self._counters.items()
+                ],
+            }
+
+    def merged(self, states) -> "Registry":
+        # A registry holding the sum of several workers' states.
+        merged = Registry()
+        merged._help = self._help
+        for state in states:
+            for name, labels, buckets, counts, total, count in state[
+                "histograms"
+            ]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                histogram = merged._histograms.get(key)
+                if histogram is None:
+                    histogram = merged._histograms[key] = Histogram(buckets)
+                histogram.counts = [
+                    mine + theirs
+                    for mine, theirs in zip(histogram.counts, counts)
+                ]
+                histogram.total += total
+                histogram.count += count
+            for name, labels, value in state["counters"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                merged._counters[key] = merged._counters.get(key, 0) + value
+        return merged
+
+    def render(self) -> list[str]:
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        described = set()
+
+        def header(name: str) -> None:
+            if name in described or name not in self._help:
+                return
+            kind, help_text = self._help[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+
+        for (name, labels), histogram in histograms:
+            header(name)
+            cumulative = 0
+            for bound, count in zip(
+                histogram.buckets + ("+Inf",), histogram.counts
+            ):
+                cumulative += count
+                bucket_labels = labels + (("le", str(bound)),)
+                lines.append(
+                    f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(
+                f"{name}_sum{format_labels(labels)} {histogram.total:.6f}"
+            )
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{name}{format_labels(labels)} {value:.15g}")
+        return lines
+
+
+def _escape_label(value) -> str:
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        f'{key}="{_escape_label(value)}"' for key, value in labels
+    ) + "}"
+
+
+registry = Registry()
+registry.describe(
+    "http_request_duration_seconds", "histogram", "Request latency by route."
+)
+registry.describe(
+    "http_request_db_queries", "histogram", "Database queries per request."
+)
+registry.describe(
+    "http_request_db_seconds", "histogram", "Database time per request."
+)
+registry.describe(
+    "http_request_threadpool_wait_seconds",
+    "histogram",
+    "Time from request arrival until its handler thread started.",
+)
+registry.describe(
+    "template_render_seconds", "histogram", "Jinja render time by template."
+)
+registry.describe(
+    "http_compression_input_bytes_total", "counter",
+    "Response bytes before compression, by encoding.",
+)
+registry.describe(
+    "http_compression_output_bytes_total", "counter",
+    "Response bytes sent after compression, by encoding.",
+)
+registry.describe(
+    "http_compression_seconds_total", "counter",
+    "CPU time spent compressing responses, by encoding.",
+)
+
+
+def current_stats() -> Optional[dict]:
+    return _request_stats.get()
+
+
+def mark_handler_start() -> None:
+    stats = _request_stats.get()
+    if stats is not None and stats["handler_started"] is None:
+        stats["handler_started"] = time.perf_counter()
+
+
+def record_template(name: str, seconds: float) -> None:
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["template_time"] += seconds
+    registry.observe(
+        "template_render_seconds", (("template", name),), seconds,
+        LATENCY_BUCKETS,
+    )
+
+
+def record_compression(encoding: str, raw_bytes: int, sent_bytes: int,
+                       seconds: float) -> None:
+    labels = (("encoding", encoding),)
+    registry.inc("http_compression_input_bytes_total", labels, raw_bytes)
+    registry.inc("http_compression_output_bytes_total", labels, sent_bytes)
+    registry.inc("http_compression_seconds_total", labels, seconds)
+
+
+def install_db_hooks(engine) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                               executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        stats = _request_stats.get()
+        started = getattr(context, "_query_started", None)
+        if stats is None or started is None:
+            return
+        stats["db_count"] += 1
+        stats["db_time"] += time.perf_counter() - started
+
+
+_route_paths: dict = {}
+
+
+def route_label(scope) -> str:
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        path = _route_paths.get(endpoint)
+        if path is None:
+            for route in getattr(scope.get("app"), "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = _route_paths[endpoint] = route.path
+                    break
+        if path is not None:
+            return path
+    if scope["path"].startswith("/static/"):
+        return "/static"
+    return "unmatched"
+
+
+def _server_timing(stats: dict, elapsed: float) -> bytes:
+    parts = [
+        f"db;dur={stats['db_time'] * 1000:.1f};desc=\"{stats['db_count']} queries\"",
+        f"tpl;dur={stats['template_time'] * 1000:.1f}",
+    ]
+    if stats["handler_started"] is not None:
+        wait = stats["handler_started"] - stats["started"]
+        parts.append(f"wait;dur={wait * 1000:.1f}")
+    parts.append(f"app;dur={elapsed * 1000:.1f}")
+    return ", ".join(parts).encode("ascii")
+
+
+class MetricsMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats = {
+            "started": time.perf_counter(),
+            "handler_started": None,
+            "db_count": 0,
+            "db_time": 0.0,
+            "template_time": 0.0,
+        }
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    elapsed = time.perf_counter() - stats["started"]
+                    headers = list(message.get("headers", []))
+                    headers.append(
+                        (b"server-timing", _server_timing(stats, elapsed))
+                    )
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            elapsed = time.perf_counter() - stats["started"]
+            route = route_label(scope)
+            labels = (
+                ("method", scope["method"]),
+                ("route", route),
+                ("status", str(status_code)),
+            )
+            registry.observe(
+                "http_request_duration_seconds", labels, elapsed,
+                LATENCY_BUCKETS,
+            )
+            route_labels = (("route", route),)
+            registry.observe(
+                "http_request_db_queries", route_labels, stats["db_count"],
+                QUERY_COUNT_BUCKETS,
+            )
+            registry.observe(
+                "http_request_db_seconds", route_labels, stats["db_time"],
+                LATENCY_BUCKETS,
+            )
+            if stats["handler_started"] is not None:
+                registry.observe(
+                    "http_request_threadpool_wait_seconds",
+                    route_labels,
+                    stats["handler_started"] - stats["started"],
+                    LATENCY_BUCKETS,
+                )
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WorkerSnapshots:
+    # Every gunicorn worker has its own registry and load counters, so a
+    # scrape of /metrics only sees the worker that happened to answer. With
+    # METRICS_MULTIPROC_DIR set, each worker dumps its state to <pid>.json
+    # there every METRICS_FLUSH_SECONDS (and on shutdown), and /metrics sums
+    # all files. Files of exited workers still count toward counters and
+    # histograms but not toward gauges.
+    def __init__(self, directory: Optional[str], interval: float) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.source: Optional[Callable[[], dict]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.source is not None
+
+    def write(self) -> None:
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as handle:
+            json.dump(self.source(), handle)
+        os.replace(path + ".tmp", path)
+
+    def read_all(self) -> list[tuple[bool, dict]]:
+        # (alive, state) for every worker that has written a snapshot.
+        states = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path, encoding="utf-8") as handle:
+                    state = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            pid = int(os.path.basename(path)[:-len(".json")])
+            alive = pid == os.getpid() or _pid_alive(pid)
+            states.append((alive, state))
+        return states
+
+    def clear(self) -> None:
+        # Called by the gunicorn master before forking, so a restart starts
+        # from zero.
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                os.remove(path)
+
+    def start(self, source: Callable[[], dict]) -> None:
+        self.source = source
+        if not self.enabled or (
+            self._thread is not None and self._thread.is_alive()
+        ):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="metrics-snapshots", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        try:
+            self.write()
+        except OSError:
+            logger.exception("writing the final metrics snapshot failed")
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                logger.exception("writing the metrics snapshot failed")
+
+
+worker_snapshots = WorkerSnapshots(METRICS_MULTIPROC_DIR,
+                                   METRICS_FLUSH_SECONDS)
@@ -0,0 +1,143 @@
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+from app.core.config import (N_PLUS_ONE_THRESHOLD, PROFILE_SQL,
+                             QUERY_LOG_PATH, SLOW_QUERY_MS)
+from app.core.metrics import route_label
+
+logger = logging.getLogger("app.sql")
+
+_current_profile: ContextVar[Optional[dict]] = ContextVar(
+    "query_profile", default=None
+)
+
+
+def _short(statement: str, limit: int = 300) -> str:
+    flat = " ".join(statement.split())
+    return flat if len(flat) <= limit else flat[:limit] + "..."
+
+
+class QueryProfiler:
+    def __init__(self) -> None:
+        self.enabled = PROFILE_SQL
+        self.slow_query_ms = SLOW_QUERY_MS
+        self.n_plus_one_threshold = N_PLUS_ONE_THRESHOLD
+        self.log_path = QUERY_LOG_PATH
+        self.listeners: list[Callable[[dict], None]] = []
+        self._write_lock = threading.Lock()
+
+    def install(self, engine) -> None:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before_cursor_execute(conn, cursor, statement, parameters,
+                                   context, executemany):
+            if self.enabled and context is not None:
+                context._profile_started = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            started = getattr(context, "_profile_started", None)
+            if not self.enabled or started is None:
+                return
+            self._record(statement, parameters, time.perf_counter() - started)
+
+    def _record(self, statement: str, parameters, seconds: float) -> None:
+        profile = _current_profile.get()
+        elapsed_ms = seconds * 1000
+        if profile is not None:
+            entry = profile["statements"].setdefault(statement, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed_ms
+        if elapsed_ms >= self.slow_query_ms:
+            where = (
+                f"{profile['method']} {profile['path']}"
+                if profile else "-"
+            )
+            logger.warning(
+                "slow query %.1fms [%s]: %s params=%r",
+                elapsed_ms, where, _short(statement), parameters,
+            )
+            if profile is not None:
+                profile["slow"].append(
+                    {"statement": _short(statement), "ms": round(elapsed_ms, 2)}
+                )
+
+    def begin(self, scope):
+        return _current_profile.set(
+            {
+                "method": scope["method"],
+                "path": scope["path"],
+                "started": time.perf_counter(),
+                "statements": {},
+                "slow": [],
+            }
+        )
+
+    def end(self, token, scope, status_code: int) -> dict:
+        profile = _current_profile.get()
+        _current_profile.reset(token)
+        statements = profile["statements"]
+        summary = {
+            "route": route_label(scope),
+            "method": profile["method"],
+            "path": profile["path"],
+            "status": status_code,
+            "duration_ms": round(
+                (time.perf_counter() - profile["started"]) * 1000, 2
+            ),
+            "queries": sum(count for count, _ in statements.values()),
+            "db_ms": round(sum(ms for _, ms in statements.values()), 2),
+            "n_plus_one": [
+                {"statement": _short(statement), "count": count,
+                 "ms": round(ms, 2)}
+                for statement, (count, ms) in statements.items()
+                if count >= self.n_plus_one_threshold
+            ],
+            "slow": profile["slow"],
+        }
+        for item in summary["n_plus_one"]:
+            logger.warning(
+                "possible N+1 on %s %s: %d x %s",
+                summary["method"], summary["route"], item["count"],
+                item["statement"],
+            )
+        if self.log_path:
+            line = json.dumps(summary, ensure_ascii=False)
+            with self._write_lock:
+                with open(self.log_path, "a", encoding="utf-8") as handle:
+                    handle.write(line + "\n")
+        for listener in self.listeners:
+            listener(summary)
+        return summary
+
+
+profiler = QueryProfiler()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        token = profiler.begin(scope)
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.end(token, scope, status_code)
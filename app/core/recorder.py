@@ -0,0 +1,196 @@
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from typing import Optional
+
+from app.core.config import (SESSION_SECRET, TRAFFIC_RECORD_MAX_BODY,
+                             TRAFFIC_RECORD_PATH)
+from app.core.metrics import route_label
+
+logger = logging.getLogger("app.recorder")
+
+# Enum-like fields that carry no personal data and are needed for replay.
+SAFE_FIELDS = {
+    "shop_type", "status", "active", "date_from", "date_to", "opens_at",
+    "closes_at",
+}
+
+# Numeric fields kept as numbers for replay, besides every "*_id". Any other
+# number is masked: an all-digit value may just as well be a PIN.
+NUMERIC_FIELDS = {"qty", "points", "position", "limit", "before"}
+
+_lines: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def _keeps_number(key: Optional[str]) -> bool:
+    if not key or key.startswith("password"):
+        return False
+    return key in NUMERIC_FIELDS or key.endswith("_id")
+
+
+def value_shape(value, key: Optional[str] = None):
+    # Ids and quantities are kept; every other value is reduced to its type
+    # and length so no usernames, passwords or free text reach the trace.
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return value if _keeps_number(key) else "<num>"
+    if isinstance(value, str):
+        if key in SAFE_FIELDS and len(value) <= 32:
+            return value
+        if value.isdigit() and len(value) < 12 and _keeps_number(key):
+            return int(value)
+        return f"<str:{len(value)}>"
+    if isinstance(value, list):
+        return [value_shape(item, key) for item in value[:50]]
+    if isinstance(value, dict):
+        return {
+            str(name): value_shape(item, str(name))
+            for name, item in value.items()
+        }
+    return f"<{type(value).__name__}>"
+
+
+def body_shape(content_type: str, body: bytes):
+    if not body:
+        return None
+    if content_type.startswith("application/json"):
+        try:
+            return value_shape(json.loads(body))
+        except ValueError:
+            return "<invalid-json>"
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        fields = urllib.parse.parse_qs(
+            body.decode("utf-8", errors="ignore"), keep_blank_values=True
+        )
+        return {
+            key: value_shape(values[0] if len(values) == 1 else values, key)
+            for key, values in fields.items()
+        }
+    return f"<{content_type.split(';')[0] or 'binary'}:{len(body)}>"
+
+
+def session_identity(session: dict) -> Optional[str]:
+    username = session.get("tg_username")
+    if username:
+        digest = hashlib.sha256(
+            f"{SESSION_SECRET}:{username}".encode("utf-8")
+        ).hexdigest()
+        return digest[:16]
+    if session.get("is_admin"):
+        return "admin"
+    return None
+
+
+def _write_lines() -> None:
+    # Runs on its own thread so the event loop never waits on the disk.
+    # Lines that queued up meanwhile go out in one append.
+    while True:
+        line = _lines.get()
+        batch = []
+        while line is not None:
+            batch.append(line)
+            try:
+                line = _lines.get_nowait()
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                with open(TRAFFIC_RECORD_PATH, "a", encoding="utf-8") as handle:
+                    handle.write("\n".join(batch) + "\n")
+            except OSError:
+                logger.exception("could not write %d trace lines", len(batch))
+        if line is None:
+            return
+
+
+def _stop_writer() -> None:
+    if _writer is not None:
+        _lines.put(None)
+        _writer.join(timeout=5)
+
+
+def record_line(line: str) -> None:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(
+                    target=_write_lines, name="traffic-recorder", daemon=True
+                )
+                _writer.start()
+                atexit.register(_stop_writer)
+    _lines.put(line)
+
+
+class TrafficRecorderMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not TRAFFIC_RECORD_PATH or (
+            scope["path"].startswith("/static/")
+        ):
+            await self.app(scope, receive, send)
+            return
+        started = time.time()
+        perf_started = time.perf_counter()
+        chunks: list[bytes] = []
+        captured = 0
+        status_code = 500
+
+        async def receive_wrapper():
+            nonlocal captured
+            message = await receive()
+            if message["type"] == "http.request" and (
+                captured < TRAFFIC_RECORD_MAX_BODY
+            ):
+                body = message.get("body", b"")
+                chunks.append(body[:TRAFFIC_RECORD_MAX_BODY - captured])
+                captured += len(body)
+            return message
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            headers = dict(scope.get("headers") or [])
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            query = urllib.parse.parse_qs(
+                scope.get("query_string", b"").decode("latin-1"),
+                keep_blank_values=True,
+            )
+            record = {
+                "ts": round(started, 4),
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route_label(scope),
+                "query": {
+                    key: value_shape(values[0], key)
+                    for key, values in query.items()
+                },
+                "content_type": content_type.split(";")[0],
+                "body": (
+                    body_shape(content_type, b"".join(chunks))
+                    if captured <= TRAFFIC_RECORD_MAX_BODY
+                    else f"<truncated:{captured}>"
+                ),
+                "identity": session_identity(scope.get("session") or {}),
+                "status": status_code,
+                "duration_ms": round(
+                    (time.perf_counter() - perf_started) * 1000, 2
+                ),
+            }
+            record_line(json.dumps(record, ensure_ascii=False))
@@ -1,3 +1,99 @@
+import os
+import time
+
 from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, nodes
+from jinja2.ext import Extension
+from jinja2.utils import LRUCache
+
+from app.core.config import (FRAGMENT_CACHE_SIZE, TEMPLATE_CACHE_DIR,
+                             TEMPLATES_AUTO_RELOAD)
+from app.core.metrics import record_template
+
+
+# {% cache key, ... %}...{% endcache %} keeps the rendered block in a
+# per-process LRU keyed by the tag's position plus the given values. A None
+# value renders the block uncached.
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment: Environment) -> None:
+        super().__init__(environment)
+        environment.extend(fragment_cache=LRUCache(FRAGMENT_CACHE_SIZE))
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [nodes.Const(f"{parser.name}:{lineno}")]
+        while parser.stream.current.type != "block_end":
+            key_parts.append(parser.parse_expression())
+            parser.stream.skip_if("comma")
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render_cached", [nodes.List(key_parts)]),
+            [],
+            [],
+            body,
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        if any(part is None for part in key_parts):
+            return caller()
+        key = tuple(key_parts)
+        cache = self.environment.fragment_cache
+        rendered = cache.get(key)
+        if rendered is None:
+            rendered = caller()
+            cache[key] = rendered
+        return rendered
+
+
+def variant_stock_key(products, code_stock: dict) -> int:
+    # Stock moves with every order without bumping the catalog version, so
+    # cached fragments that show it are also keyed by the current numbers.
+    return hash(
+        tuple(
+            (variant.id, variant.stock, code_stock.get(variant.id))
+            for product in products
+            for variant in product.variants
+        )
+    )
+
+
+def _bytecode_cache():
+    if not TEMPLATE_CACHE_DIR:
+        return None
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    except OSError:
+        return None
+    return FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+
+class TimedTemplates(Jinja2Templates):
+    def TemplateResponse(self, *args, **kwargs):
+        name = kwargs.get("name")
+        if name is None and args:
+            # Both (name, context) and (request, name, context) are accepted.
+            name = args[0] if isinstance(args[0], str) else args[1]
+        started = time.perf_counter()
+        response = super().TemplateResponse(*args, **kwargs)
+        record_template(name, time.perf_counter() - started)
+        return response
+
+
+def warm_templates() -> None:
+    # Compiles every template up front (from the bytecode cache when it is
+    # warm); under a preloading server the workers inherit the result.
+    for name in templates.env.list_templates(extensions=("html",)):
+        templates.env.get_template(name)
+
 
-templates = Jinja2Templates(directory="app/templates")
+templates = TimedTemplates(
+    env=Environment(
+        loader=FileSystemLoader("app/templates"),
+        autoescape=True,
+        auto_reload=TEMPLATES_AUTO_RELOAD,
+        bytecode_cache=_bytecode_cache(),
+        extensions=[FragmentCacheExtension],
+    )
+)
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime, timezone
 from zoneinfo import ZoneInfo
 
 from app.core.config import APP_TZ
@@ -10,3 +10,19 @@ def local_now() -> datetime:
     except Exception:
         return datetime.now()
     return datetime.now(tz).replace(tzinfo=None)
+
+
+def local_time(utc_value: datetime) -> datetime:
+    # Order timestamps are naive UTC; pages and reports show APP_TZ time.
+    try:
+        tz = ZoneInfo(APP_TZ)
+    except Exception:
+        return utc_value
+    return (
+        utc_value.replace(tzinfo=timezone.utc).astimezone(tz)
+        .replace(tzinfo=None)
+    )
+
+
+def local_day(utc_value: datetime) -> date:
+    return local_time(utc_value).date()
@@ -1,35 +1,62 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import select
 from starlette.middleware.sessions import SessionMiddleware
 
-from app.core.config import SESSION_SECRET, SHOP_TYPES
-from app.core.database import SessionLocal, init_db
-from app.models import ShopSettings
-from app.routers import admin, api, auth, shops
+from app.core.body_limit import BodyLimitMiddleware
+from app.core.bootstrap import ensure_bootstrapped
+from app.core.cache_bus import cache_bus
+from app.core.compression import CompressionMiddleware
+from app.core.config import METRICS_ENABLED, SESSION_SECRET
+from app.core.database import SessionLocal
+from app.core.load_shedding import LoadSheddingMiddleware
+from app.core.metrics import MetricsMiddleware, worker_snapshots
+from app.core.profiling import ProfilingMiddleware
+from app.core.recorder import TrafficRecorderMiddleware
+from app.routers import admin, api, auth, metrics, shops
+from app.services.points import points_folder
+from app.services.waiting_room import waiting_room
 
 app = FastAPI()
+# Added first so it runs inside the session middleware and sees the session.
+app.add_middleware(TrafficRecorderMiddleware)
 app.add_middleware(
     SessionMiddleware, secret_key=SESSION_SECRET, same_site="lax"
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(LoadSheddingMiddleware)
+app.add_middleware(BodyLimitMiddleware)
+# Outside the recorder and profiler so they see uncompressed bodies.
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 app.include_router(auth.router)
 app.include_router(shops.router)
 app.include_router(api.router)
 app.include_router(admin.router)
+if METRICS_ENABLED:
+    app.include_router(metrics.router)
+
+
+def reload_waiting_room() -> None:
+    with SessionLocal() as db:
+        waiting_room.load(db)
+
+
+cache_bus.subscribe("settings", reload_waiting_room)
 
 
 @app.on_event("startup")
 def on_startup() -> None:
-    init_db()
-    with SessionLocal() as db:
-        existing = {
-            row.shop_type for row in db.execute(
-                select(ShopSettings)
-            ).scalars().all()
-        }
-        for shop_type in SHOP_TYPES:
-            if shop_type not in existing:
-                db.add(ShopSettings(shop_type=shop_type))
-        db.commit()
+    ensure_bootstrapped()
+    reload_waiting_room()
+    cache_bus.start()
+    points_folder.start()
+    worker_snapshots.start(metrics.worker_state)
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    cache_bus.stop()
+    points_folder.stop()
+    worker_snapshots.stop()
@@ -0,0 +1,58 @@
+import argparse
+
+from app.core.bootstrap import bootstrap_db
+from app.core.config import ORDER_ARCHIVE_AFTER_DAYS, ORDER_ARCHIVE_BATCH_SIZE
+from app.core.database import init_db
+from app.services.archive import archive_orders
+from app.services.points import compact_ledger
+from app.services.sales import rebuild_sales
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init-db", help="create tables and seed settings")
+    archive = commands.add_parser(
+        "archive-orders", help="move old finished orders to orders_archive"
+    )
+    archive.add_argument("--older-than-days", type=int,
+                         default=ORDER_ARCHIVE_AFTER_DAYS)
+    archive.add_argument("--batch-size", type=int,
+                         default=ORDER_ARCHIVE_BATCH_SIZE)
+    archive.add_argument("--max-batches", type=int)
+    commands.add_parser(
+        "rebuild-sales",
+        help="recompute sales_daily from orders and orders_archive",
+    )
+    commands.add_parser(
+        "compact-ledger",
+        help="fold pending credits and advance points snapshots",
+    )
+    args = parser.parse_args()
+
+    if args.command == "init-db":
+        bootstrap_db()
+        print("database ready")
+    elif args.command == "archive-orders":
+        init_db()
+        moved = archive_orders(
+            older_than_days=args.older_than_days,
+            batch_size=args.batch_size,
+            max_batches=args.max_batches,
+        )
+        print(f"archived {moved} orders")
+    elif args.command == "rebuild-sales":
+        init_db()
+        print(f"sales_daily rebuilt: {rebuild_sales()} rows")
+    elif args.command == "compact-ledger":
+        init_db()
+        snapshots, drift = compact_ledger()
+        print(f"snapshots advanced for {snapshots} users")
+        for username, cached, expected in drift:
+            print(f"drift: {username} points={cached} ledger={expected}")
+        if drift:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 from app.models.allowlist import AllowlistEntry
-from app.models.order import Order
+from app.models.cache_version import CacheVersion
+from app.models.order import Order, OrderArchive
+from app.models.points import PointsLedger, PointsSnapshot
 from app.models.product import Product, ProductVariant
+from app.models.sales import SalesDaily
 from app.models.shop_settings import ShopSettings
 from app.models.user import User
+from app.models.variant_code import VariantCode
 
 __all__ = [
     "AllowlistEntry",
+    "CacheVersion",
     "Order",
+    "OrderArchive",
+    "PointsLedger",
+    "PointsSnapshot",
     "Product",
     "ProductVariant",
+    "SalesDaily",
     "ShopSettings",
     "User",
+    "VariantCode",
 ]
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.core.database import Base
@@ -8,6 +8,16 @@ from app.core.database import Base
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        # Order history pages seek on this; on Postgres the extra columns
+        # make it covering, so a page is read from the index alone.
+        Index(
+            "ix_orders_user_created_at", "tg_username", "created_at", "id",
+            postgresql_include=["product_variant_id", "points_spent",
+                                "status"],
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     tg_username: Mapped[str] = mapped_column(String(64), index=True)
@@ -19,3 +29,30 @@ class Order(Base):
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow
     )
+
+
+# Finished orders moved out of the hot table by the archiver; ids are kept.
+class OrderArchive(Base):
+    __tablename__ = "orders_archive"
+    __table_args__ = (
+        Index("ix_orders_archive_created_at", "created_at"),
+        Index(
+            "ix_orders_archive_user_created_at",
+            "tg_username", "created_at", "id",
+            postgresql_include=["product_variant_id", "points_spent",
+                                "status"],
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=False
+    )
+    tg_username: Mapped[str] = mapped_column(String(64))
+    # No foreign key, so archived orders do not block deleting a variant.
+    product_variant_id: Mapped[int] = mapped_column(Integer)
+    points_spent: Mapped[int] = mapped_column(Integer)
+    status: Mapped[str] = mapped_column(String(32))
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow
+    )
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from sqlalchemy import Boolean, DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.database import Base
+
+
+# Append-only history of every points change. Debits are written already
+# applied to users.points; credits are plain inserts that a later fold adds
+# to users.points and flags as applied.
+class PointsLedger(Base):
+    __tablename__ = "points_ledger"
+    __table_args__ = (
+        Index("ix_points_ledger_pending", "user_id", "applied"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    delta: Mapped[int] = mapped_column(Integer)
+    reason: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    # No foreign key: orders move to orders_archive.
+    order_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    applied: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow
+    )
+
+
+# Balance of a user over all ledger rows up to ledger_id; the full balance is
+# this plus the deltas after it.
+class PointsSnapshot(Base):
+    __tablename__ = "points_snapshots"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id"), primary_key=True
+    )
+    balance: Mapped[int] = mapped_column(Integer, default=0)
+    ledger_id: Mapped[int] = mapped_column(Integer, default=0)
+    taken_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow
+    )
@@ -1,6 +1,7 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import (Boolean, DateTime, ForeignKey, Index, Integer, String,
+                        Text)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.core.database import Base
@@ -8,6 +9,9 @@ from app.core.database import Base
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ux_products_external_key", "external_key", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     shop_type: Mapped[str] = mapped_column(String(16), index=True)
@@ -19,6 +23,11 @@ class Product(Base):
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow
     )
+    # Stable id from catalog import files; products made in the admin have
+    # none.
+    external_key: Mapped[str | None] = mapped_column(
+        String(100), nullable=True
+    )
 
     variants: Mapped[list["ProductVariant"]] = relationship(
         "ProductVariant",
@@ -30,6 +39,10 @@ class Product(Base):
 
 class ProductVariant(Base):
     __tablename__ = "product_variants"
+    __table_args__ = (
+        Index("ux_product_variants_external_key", "product_id",
+              "external_key", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     product_id: Mapped[int] = mapped_column(ForeignKey("products.id"))
@@ -38,6 +51,10 @@ class ProductVariant(Base):
     stock: Mapped[int | None] = mapped_column(Integer, nullable=True)
     active: Mapped[bool] = mapped_column(Boolean, default=True)
     position: Mapped[int] = mapped_column(Integer, default=0)
+    code_pool: Mapped[bool] = mapped_column(Boolean, default=False)
+    external_key: Mapped[str | None] = mapped_column(
+        String(100), nullable=True
+    )
 
     product: Mapped[Product] = relationship(
         "Product", back_populates="variants"
@@ -0,0 +1,27 @@
+from datetime import date
+
+from sqlalchemy import Date, Index, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.database import Base
+
+
+# Orders and points per local day, variant and status, kept up to date in the
+# same transaction as every order insert and status change. Product and shop
+# are copied in so the numbers survive catalog edits.
+class SalesDaily(Base):
+    __tablename__ = "sales_daily"
+    __table_args__ = (
+        Index("ix_sales_daily_product", "product_id"),
+        Index("ix_sales_daily_shop_day", "shop_type", "day"),
+    )
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    product_variant_id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=False
+    )
+    status: Mapped[str] = mapped_column(String(32), primary_key=True)
+    product_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    shop_type: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    orders: Mapped[int] = mapped_column(Integer, default=0)
+    points: Mapped[int] = mapped_column(Integer, default=0)
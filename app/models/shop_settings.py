@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, Integer, String
+from sqlalchemy import Boolean, DateTime, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.core.database import Base
@@ -13,3 +13,5 @@ class ShopSettings(Base):
     shop_type: Mapped[str] = mapped_column(String(16), unique=True)
     opens_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     closes_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    queue_enabled: Mapped[bool] = mapped_column(Boolean, default=False)
+    queue_rate: Mapped[int | None] = mapped_column(Integer, nullable=True)
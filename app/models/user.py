@@ -20,3 +20,11 @@ class User(Base):
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow
     )
+
+    # points is a cache of the ledger that lags behind credits not yet
+    # folded in; pages showing the balance fill this in.
+    pending_points = 0
+
+    @property
+    def balance(self) -> int:
+        return self.points + self.pending_points
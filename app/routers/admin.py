@@ -3,26 +3,54 @@ import io
 from datetime import datetime
 from typing import Optional
 
-from fastapi import (APIRouter, Depends, File, Form, HTTPException, Request,
-                     UploadFile)
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
-from sqlalchemy import delete, func, select
-from sqlalchemy.orm import Session
-
-from app.core.config import (ADMIN_PASSWORD, ORDER_STATUS_LABELS,
-                             ORDER_STATUSES, SHOP_TYPES)
-from app.core.database import get_db
-from app.core.templates import templates
-from app.models import (AllowlistEntry, Order, Product, ProductVariant,
-                        ShopSettings, User)
+from fastapi import (APIRouter, BackgroundTasks, Depends, File, Form,
+                     HTTPException, Request, UploadFile)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (HTMLResponse, JSONResponse, RedirectResponse,
+                               Response, StreamingResponse)
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+
+from app.core.cache_bus import cache_bus
+from app.core.config import (ADMIN_PASSWORD, ADMIN_SEARCH_LIMIT,
+                             ORDER_STATUS_LABELS, ORDER_STATUS_TRANSITIONS,
+                             ORDER_STATUSES, SHOP_TYPES, TG_BOT_TOKEN,
+                             TG_GROUP_CHAT_ID)
+from app.core.database import (get_read_db, get_write_db,
+                               read_session_factory)
+from app.core.load_shedding import load_stats
+from app.core.metrics import mark_handler_start
+from app.core.templates import templates, variant_stock_key
+from app.core.time import local_now
+from app.integrations.telegram import send_telegram_message
+from app.models import (AllowlistEntry, Order, PointsLedger, Product,
+                        ProductVariant, ShopSettings, User)
 from app.services.auth import normalize_tg_username, require_admin
-from app.services.orders import build_export_url, build_order_filters
+from app.services.catalog import (CatalogError, apply_catalog_import,
+                                  export_catalog_csv, export_catalog_json,
+                                  load_catalog, parse_catalog,
+                                  payload_expected_stock, plan_catalog_import,
+                                  plan_payload)
+from app.services.codes import add_codes, available_code_counts, parse_codes_raw
+from app.services.order_feed import order_feed
+from app.services.orders import (build_dashboard_url, build_export_url,
+                                 build_order_filters, build_orders_query,
+                                 change_order_status)
+from app.services.points import credit_points, pending_credits, set_points
 from app.services.products import parse_optional_int, parse_variants_raw
+from app.services.sales import sales_summary
+from app.services.search import admin_search
 from app.services.shops import get_shop_settings
-from app.services.uploads import delete_image_file, save_image_upload
+from app.services.uploads import (delete_image_file, image_shared,
+                                  save_image_upload)
+from app.services.waiting_room import waiting_room
 
 router = APIRouter()
 
+EXPORT_BATCH_ROWS = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+
 
 @router.get("/admin/login", response_class=HTMLResponse)
 def admin_login_page(request: Request) -> HTMLResponse:
@@ -54,7 +82,10 @@ def admin_dashboard(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     users_page: int = 1,
-    db: Session = Depends(get_db),
+    bulk_updated: Optional[int] = None,
+    bulk_skipped: Optional[int] = None,
+    hidden: Optional[str] = None,
+    db: Session = Depends(get_read_db),
 ) -> HTMLResponse:
     require_admin(request)
     users_page = max(1, users_page)
@@ -70,12 +101,24 @@ def admin_dashboard(
         shop_type: get_shop_settings(db, shop_type) for shop_type in SHOP_TYPES
     }
 
+    catalog_version = cache_bus.version_for(db, "catalog")
     products_by_shop = {shop_type: [] for shop_type in SHOP_TYPES}
     products = db.execute(
-        select(Product).order_by(Product.shop_type, Product.position)
+        select(Product)
+        .options(selectinload(Product.variants))
+        .order_by(Product.shop_type, Product.position)
     ).scalars().all()
     for product in products:
         products_by_shop[product.shop_type].append(product)
+    code_stock = available_code_counts(
+        db,
+        [
+            variant.id
+            for product in products
+            for variant in product.variants
+            if variant.code_pool
+        ],
+    )
 
     total_users = db.execute(select(func.count(User.id))).scalar_one()
     total_pages = max(1, (total_users + users_per_page - 1) // users_per_page)
@@ -87,32 +130,28 @@ def admin_dashboard(
         .offset((users_page - 1) * users_per_page)
         .limit(users_per_page)
     ).scalars().all()
-    filters, resolved_status, _, _ = build_order_filters(
-        status, date_from, date_to
-    )
-    orders_query = (
-        select(Order, ProductVariant, Product)
-        .join(
-            ProductVariant, Order.product_variant_id == ProductVariant.id,
-            isouter=True
-        )
-        .join(Product, ProductVariant.product_id == Product.id, isouter=True)
-        .order_by(Order.created_at.desc())
-        .limit(60)
+    pending = pending_credits(db, [user.id for user in users])
+    for user in users:
+        user.pending_points = pending.get(user.id, 0)
+    ledger = db.execute(
+        select(PointsLedger, User.tg_username)
+        .join(User, PointsLedger.user_id == User.id)
+        .order_by(PointsLedger.id.desc())
+        .limit(20)
+    ).all()
+    orders_query, filters, resolved_status = build_orders_query(
+        db, status, date_from, date_to, limit=60
     )
-    if filters:
-        orders_query = orders_query.where(*filters)
-    orders_raw = db.execute(orders_query).all()
-    orders = []
-    for order, variant, product in orders_raw:
-        orders.append(
-            {
-                "order": order,
-                "variant_label": variant.label if variant else "",
-                "product_title": product.title if product else "",
-                "shop_type": product.shop_type if product else "",
-            }
-        )
+    orders = [
+        {
+            "order": row,
+            "archived": row.archived,
+            "variant_label": row.variant_label or "",
+            "product_title": row.product_title or "",
+            "shop_type": row.shop_type or "",
+        }
+        for row in db.execute(orders_query)
+    ]
 
     return templates.TemplateResponse(
         "admin.html",
@@ -121,77 +160,116 @@ def admin_dashboard(
             "allowlist_by_shop": allowlist_by_shop,
             "settings_by_shop": settings_by_shop,
             "products_by_shop": products_by_shop,
+            "code_stock": code_stock,
+            "catalog_version": catalog_version,
+            "stock_key": variant_stock_key(products, code_stock),
             "users": users,
+            "ledger": ledger,
             "users_page": users_page,
             "users_pages_total": total_pages,
             "users_has_prev": users_page > 1,
             "users_has_next": users_page < total_pages,
             "orders": orders,
+            "sales": sales_summary(db),
             "order_statuses": ORDER_STATUSES,
             "order_status_labels": ORDER_STATUS_LABELS,
+            "order_transitions": ORDER_STATUS_TRANSITIONS,
+            "telegram_enabled": bool(TG_BOT_TOKEN and TG_GROUP_CHAT_ID),
+            "bulk_updated": bulk_updated,
+            "bulk_skipped": bulk_skipped,
+            "hidden": hidden,
             "status_filter": resolved_status or "",
             "date_from": date_from or "",
             "date_to": date_to or "",
             "export_url": build_export_url(
                 resolved_status, date_from, date_to
             ),
+            "orders_live": not filters,
+            "orders_last_id": max(
+                (item["order"].id for item in orders), default=0
+            ),
         },
     )
 
 
+@router.get("/admin/search", response_class=HTMLResponse)
+def admin_search_fragment(
+    request: Request,
+    q: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+) -> HTMLResponse:
+    require_admin(request)
+    results = admin_search(db, q, ADMIN_SEARCH_LIMIT)
+    pending = pending_credits(db, [user.id for user in results["users"]])
+    for user in results["users"]:
+        user.pending_points = pending.get(user.id, 0)
+    return templates.TemplateResponse(
+        "admin_search.html", {"request": request, **results}
+    )
+
+
+@router.get("/admin/orders/feed")
+def admin_orders_feed(request: Request, since_id: int = 0) -> JSONResponse:
+    require_admin(request)
+    rows, last_id, reset = order_feed.since(since_id)
+    return JSONResponse({"orders": rows, "last_id": last_id, "reset": reset})
+
+
 @router.get("/admin/orders/export")
 def admin_orders_export(
     request: Request,
     status: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    db: Session = Depends(get_db),
 ) -> StreamingResponse:
+    mark_handler_start()
     require_admin(request)
-    filters, _, _, _ = build_order_filters(status, date_from, date_to)
-    query = (
-        select(Order, ProductVariant, Product)
-        .join(
-            ProductVariant, Order.product_variant_id == ProductVariant.id,
-            isouter=True
-        )
-        .join(Product, ProductVariant.product_id == Product.id, isouter=True)
-        .order_by(Order.created_at.desc())
-    )
-    if filters:
-        query = query.where(*filters)
-    rows = db.execute(query).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(
-        [
-            "order_id",
-            "created_at",
-            "tg_username",
-            "shop_type",
-            "product_title",
-            "variant_label",
-            "points_spent",
-            "status",
-        ]
-    )
-    for order, variant, product in rows:
+    # The generator owns its session: request dependencies are torn down
+    # before a streaming body is sent.
+    session_factory = read_session_factory(request)
+
+    def csv_chunks():
+        output = io.StringIO()
+        writer = csv.writer(output)
         writer.writerow(
             [
-                order.id,
-                order.created_at.isoformat() if order.created_at else "",
-                order.tg_username,
-                product.shop_type if product else "",
-                product.title if product else "",
-                variant.label if variant else "",
-                order.points_spent,
-                ORDER_STATUS_LABELS.get(order.status, order.status),
+                "order_id",
+                "created_at",
+                "tg_username",
+                "shop_type",
+                "product_title",
+                "variant_label",
+                "points_spent",
+                "status",
             ]
         )
-    output.seek(0)
+        with session_factory() as db:
+            query, _, _ = build_orders_query(db, status, date_from, date_to)
+            result = db.execute(
+                query.execution_options(yield_per=EXPORT_BATCH_ROWS)
+            )
+            for row in result:
+                writer.writerow(
+                    [
+                        row.id,
+                        row.created_at.isoformat() if row.created_at else "",
+                        row.tg_username,
+                        row.shop_type or "",
+                        row.product_title or "",
+                        row.variant_label or "",
+                        row.points_spent,
+                        ORDER_STATUS_LABELS.get(row.status, row.status),
+                    ]
+                )
+                if output.tell() >= EXPORT_CHUNK_BYTES:
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate()
+        yield output.getvalue()
+
     filename = f"orders_{datetime.utcnow().strftime('%Y%m%d_%H%M')}.csv"
     headers = {"Content-Disposition": f"attachment; filename={filename}"}
-    return StreamingResponse(output, media_type="text/csv", headers=headers)
+    return StreamingResponse(csv_chunks(), media_type="text/csv", headers=headers)
 
 
 @router.post("/admin/allowlist/add")
@@ -199,7 +277,7 @@ def admin_allowlist_add(
     request: Request,
     shop_type: str = Form(...),
     tg_username: str = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     if shop_type not in SHOP_TYPES:
@@ -223,7 +301,7 @@ def admin_allowlist_add(
 def admin_allowlist_remove(
     request: Request,
     entry_id: int = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     entry = db.get(AllowlistEntry, entry_id)
@@ -237,7 +315,7 @@ def admin_allowlist_remove(
 def admin_allowlist_add_all(
     request: Request,
     shop_type: str = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     if shop_type not in SHOP_TYPES:
@@ -265,7 +343,7 @@ def admin_allowlist_add_all(
 def admin_allowlist_remove_all(
     request: Request,
     shop_type: str = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     if shop_type not in SHOP_TYPES:
@@ -282,7 +360,7 @@ def admin_points_set(
     request: Request,
     tg_username: str = Form(...),
     points: int = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     normalized = normalize_tg_username(tg_username)
@@ -292,10 +370,50 @@ def admin_points_set(
         select(User).where(User.tg_username == normalized)
     ).scalar_one_or_none()
     if not user:
-        user = User(tg_username=normalized, points=points)
+        user = User(tg_username=normalized, points=0)
         db.add(user)
-    else:
-        user.points = points
+        db.flush()
+    set_points(db, user, points, "admin: set")
+    db.commit()
+    return RedirectResponse("/admin", status_code=303)
+
+
+@router.post("/admin/points/credit")
+def admin_points_credit(
+    request: Request,
+    usernames_raw: str = Form(...),
+    amount: int = Form(...),
+    reason: str = Form(""),
+    db: Session = Depends(get_write_db),
+) -> RedirectResponse:
+    require_admin(request)
+    usernames = {
+        normalized
+        for normalized in (
+            normalize_tg_username(raw)
+            for raw in usernames_raw.replace(",", "\n").splitlines()
+        )
+        if normalized
+    }
+    # Credits only: pending rows are folded in without a balance check, so
+    # taking points away goes through /admin/points/set instead.
+    if not usernames or amount <= 0:
+        raise HTTPException(status_code=400)
+    existing = dict(
+        db.execute(
+            select(User.tg_username, User.id)
+            .where(User.tg_username.in_(usernames))
+        ).all()
+    )
+    for username in sorted(usernames - set(existing)):
+        user = User(tg_username=username, points=0)
+        db.add(user)
+        db.flush()
+        existing[username] = user.id
+    credit_points(
+        db, existing.values(), amount,
+        f"admin: {reason.strip()}"[:200] if reason.strip() else "admin: credit",
+    )
     db.commit()
     return RedirectResponse("/admin", status_code=303)
 
@@ -306,7 +424,9 @@ def admin_settings_set(
     shop_type: str = Form(...),
     opens_at: str = Form(""),
     closes_at: str = Form(""),
-    db: Session = Depends(get_db),
+    queue_enabled: Optional[str] = Form(None),
+    queue_rate: Optional[str] = Form(None),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     if shop_type not in SHOP_TYPES:
@@ -319,12 +439,111 @@ def admin_settings_set(
     settings.closes_at = datetime.fromisoformat(
         closes_at
     ) if closes_at else None
+    settings.queue_enabled = queue_enabled == "on"
+    settings.queue_rate = parse_optional_int(queue_rate)
+    cache_bus.publish(db, "settings")
     db.commit()
+    waiting_room.configure(settings)
     return RedirectResponse("/admin", status_code=303)
 
 
+@router.get("/admin/waiting-room")
+def admin_waiting_room_stats(request: Request) -> JSONResponse:
+    require_admin(request)
+    return JSONResponse(waiting_room.stats(local_now()))
+
+
+@router.get("/admin/load")
+def admin_load_stats(request: Request) -> JSONResponse:
+    require_admin(request)
+    return JSONResponse(load_stats())
+
+
+@router.get("/admin/catalog/export")
+def admin_catalog_export(
+    request: Request,
+    format: str = "json",
+    db: Session = Depends(get_read_db),
+) -> Response:
+    require_admin(request)
+    products = load_catalog(db)
+    stamp = local_now().strftime("%Y%m%d-%H%M")
+    if format == "csv":
+        body, media_type, ext = export_catalog_csv(products), "text/csv", "csv"
+    else:
+        body, media_type = export_catalog_json(products), "application/json"
+        ext = "json"
+    return Response(
+        body,
+        media_type=f"{media_type}; charset=utf-8",
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="catalog-{stamp}.{ext}"'
+            )
+        },
+    )
+
+
+@router.post("/admin/catalog/import", response_class=HTMLResponse)
+async def admin_catalog_import(
+    request: Request,
+    catalog_file: Optional[UploadFile] = File(None),
+    payload: Optional[str] = Form(None),
+    apply: Optional[str] = Form(None),
+    with_stock: Optional[str] = Form(None),
+    db: Session = Depends(get_write_db),
+) -> HTMLResponse:
+    require_admin(request)
+    # The preview page posts the parsed file back as payload to apply it.
+    if payload:
+        raw, filename = payload.encode("utf-8"), "catalog.json"
+    elif catalog_file and catalog_file.filename:
+        raw, filename = await catalog_file.read(), catalog_file.filename
+    else:
+        raise HTTPException(status_code=400, detail="Нет файла")
+    return await run_in_threadpool(
+        _import_catalog, request, db, raw, filename, bool(apply),
+        bool(with_stock),
+    )
+
+
+def _import_catalog(request: Request, db: Session, raw: bytes, filename: str,
+                    apply: bool, with_stock: bool) -> HTMLResponse:
+    try:
+        items = parse_catalog(raw, filename)
+        plan = plan_catalog_import(db, items, with_stock)
+        if apply:
+            apply_catalog_import(db, plan, payload_expected_stock(raw))
+            db.commit()
+    except CatalogError as exc:
+        db.rollback()
+        return templates.TemplateResponse(
+            "catalog_import.html",
+            {"request": request, "error": exc.message},
+            status_code=400,
+        )
+    except IntegrityError:
+        db.rollback()
+        return templates.TemplateResponse(
+            "catalog_import.html",
+            {"request": request,
+             "error": "Каталог изменился во время импорта, попробуйте ещё раз"},
+            status_code=409,
+        )
+    return templates.TemplateResponse(
+        "catalog_import.html",
+        {
+            "request": request,
+            "plan": plan,
+            "applied": apply,
+            "with_stock": with_stock,
+            "payload": None if apply else plan_payload(items, plan),
+        },
+    )
+
+
 @router.post("/admin/product/add")
-def admin_product_add(
+async def admin_product_add(
     request: Request,
     shop_type: str = Form(...),
     title: str = Form(...),
@@ -334,12 +553,12 @@ def admin_product_add(
     variants_raw: str = Form(""),
     position: int = Form(0),
     active: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     if shop_type not in SHOP_TYPES:
         raise HTTPException(status_code=400)
-    upload_url = save_image_upload(image_file)
+    upload_url = await save_image_upload(image_file)
     final_image_url = upload_url or (image_url.strip() if image_url else None)
     product = Product(
         shop_type=shop_type,
@@ -349,6 +568,11 @@ def admin_product_add(
         position=position,
         active=active == "on",
     )
+    await run_in_threadpool(_store_new_product, db, product, variants_raw)
+    return RedirectResponse("/admin", status_code=303)
+
+
+def _store_new_product(db: Session, product: Product, variants_raw: str) -> None:
     db.add(product)
     db.flush()
     for variant_data in parse_variants_raw(variants_raw):
@@ -361,12 +585,12 @@ def admin_product_add(
             active=True,
         )
         db.add(variant)
+    cache_bus.publish(db, "catalog")
     db.commit()
-    return RedirectResponse("/admin", status_code=303)
 
 
 @router.post("/admin/product/update")
-def admin_product_update(
+async def admin_product_update(
     request: Request,
     product_id: int = Form(...),
     title: str = Form(...),
@@ -375,50 +599,81 @@ def admin_product_update(
     image_file: Optional[UploadFile] = File(None),
     position: int = Form(0),
     active: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
-    product = db.get(Product, product_id)
-    if product:
-        upload_url = save_image_upload(image_file)
-        product.title = title.strip()
-        product.description = description.strip() or None
-        if upload_url:
-            product.image_url = upload_url
-        elif image_url is not None:
-            product.image_url = image_url.strip() or None
-        product.position = position
-        product.active = active == "on"
-        db.commit()
+    upload_url = await save_image_upload(image_file)
+    if not upload_url and image_url is not None:
+        upload_url = image_url.strip() or ""
+    await run_in_threadpool(
+        _update_product, db, product_id, title, description, upload_url,
+        position, active == "on",
+    )
     return RedirectResponse("/admin", status_code=303)
 
 
+def _update_product(db: Session, product_id: int, title: str,
+                    description: str, image_url: Optional[str],
+                    position: int, active: bool) -> None:
+    # image_url None keeps the current picture, "" clears it.
+    product = db.get(Product, product_id)
+    if not product:
+        return
+    product.title = title.strip()
+    product.description = description.strip() or None
+    if image_url is not None:
+        product.image_url = image_url or None
+    product.position = position
+    product.active = active
+    cache_bus.publish(db, "catalog")
+    db.commit()
+
+
 @router.post("/admin/product/photo/delete")
 def admin_product_photo_delete(
     request: Request,
     product_id: int = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     product = db.get(Product, product_id)
     if product and product.image_url:
-        delete_image_file(product.image_url)
+        # Uploads are named by content, so another product may use the file.
+        if not image_shared(db, product.image_url, product.id):
+            delete_image_file(product.image_url)
         product.image_url = None
+        cache_bus.publish(db, "catalog")
         db.commit()
     return RedirectResponse("/admin", status_code=303)
 
 
+def _delete_or_hide(db: Session, item) -> bool:
+    # Orders keep a foreign key to their variant, so anything already sold
+    # is deactivated instead. Returns False when it was only hidden.
+    model, item_id = type(item), item.id
+    try:
+        db.delete(item)
+        cache_bus.publish(db, "catalog")
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+    db.execute(update(model).where(model.id == item_id).values(active=False))
+    cache_bus.publish(db, "catalog")
+    db.commit()
+    return False
+
+
 @router.post("/admin/product/delete")
 def admin_product_delete(
     request: Request,
     product_id: int = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     product = db.get(Product, product_id)
-    if product:
-        db.delete(product)
-        db.commit()
+    if product and not _delete_or_hide(db, product):
+        return RedirectResponse("/admin?hidden=product", status_code=303)
     return RedirectResponse("/admin", status_code=303)
 
 
@@ -427,18 +682,79 @@ def admin_order_status(
     request: Request,
     order_id: int = Form(...),
     status: str = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     if status not in ORDER_STATUSES:
         raise HTTPException(status_code=400)
-    order = db.get(Order, order_id)
-    if order:
-        order.status = status
-        db.commit()
+    if not change_order_status(db, status, [Order.id == order_id]):
+        order = db.get(Order, order_id)
+        if order and order.status != status:
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    "Нельзя сменить статус "
+                    f"«{ORDER_STATUS_LABELS.get(order.status, order.status)}» "
+                    f"на «{ORDER_STATUS_LABELS[status]}»"
+                ),
+            )
+    db.commit()
     return RedirectResponse("/admin", status_code=303)
 
 
+@router.post("/admin/orders/status")
+def admin_orders_bulk_status(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    status: str = Form(...),
+    order_ids: list[int] = Form([]),
+    select_all: Optional[str] = Form(None),
+    filter_status: Optional[str] = Form(None),
+    date_from: Optional[str] = Form(None),
+    date_to: Optional[str] = Form(None),
+    notify: Optional[str] = Form(None),
+    db: Session = Depends(get_write_db),
+) -> RedirectResponse:
+    require_admin(request)
+    if status not in ORDER_STATUSES:
+        raise HTTPException(status_code=400)
+    if select_all:
+        # The same filter the dashboard list was rendered with, applied to
+        # the live table; archived orders are finished and stay as they are.
+        selection, _, _, _ = build_order_filters(
+            filter_status, date_from, date_to
+        )
+        requested = None
+    else:
+        selection = [Order.id.in_(set(order_ids))]
+        requested = len(set(order_ids))
+    changed = change_order_status(db, status, selection) if (
+        select_all or order_ids
+    ) else []
+    db.commit()
+
+    if changed and notify and TG_BOT_TOKEN and TG_GROUP_CHAT_ID:
+        shown = ", ".join(str(order_id) for order_id in changed[:50])
+        if len(changed) > 50:
+            shown += f" и ещё {len(changed) - 50}"
+        background_tasks.add_task(
+            send_telegram_message,
+            f"<b>Статус заказов: {ORDER_STATUS_LABELS[status]}</b>\n"
+            f"Заказов: {len(changed)}\n"
+            f"ID: {shown}",
+        )
+    return RedirectResponse(
+        build_dashboard_url(
+            filter_status, date_from, date_to,
+            bulk_updated=len(changed),
+            bulk_skipped=(
+                requested - len(changed) if requested is not None else None
+            ),
+        ),
+        status_code=303,
+    )
+
+
 @router.post("/admin/variant/add")
 def admin_variant_add(
     request: Request,
@@ -448,7 +764,7 @@ def admin_variant_add(
     stock: Optional[str] = Form(None),
     position: Optional[int] = Form(None),
     active: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     product = db.get(Product, product_id)
@@ -464,6 +780,7 @@ def admin_variant_add(
         active=active == "on",
     )
     db.add(variant)
+    cache_bus.publish(db, "catalog")
     db.commit()
     return RedirectResponse("/admin", status_code=303)
 
@@ -477,7 +794,7 @@ def admin_variant_update(
     stock: Optional[str] = Form(None),
     position: Optional[int] = Form(None),
     active: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     variant = db.get(ProductVariant, variant_id)
@@ -488,6 +805,7 @@ def admin_variant_update(
         if position is not None:
             variant.position = position
         variant.active = active == "on"
+        cache_bus.publish(db, "catalog")
         db.commit()
     return RedirectResponse("/admin", status_code=303)
 
@@ -496,11 +814,39 @@ def admin_variant_update(
 def admin_variant_delete(
     request: Request,
     variant_id: int = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     require_admin(request)
     variant = db.get(ProductVariant, variant_id)
-    if variant:
-        db.delete(variant)
-        db.commit()
+    if variant and not _delete_or_hide(db, variant):
+        return RedirectResponse("/admin?hidden=variant", status_code=303)
     return RedirectResponse("/admin", status_code=303)
+
+
+@router.post("/admin/variant/codes")
+async def admin_variant_codes(
+    request: Request,
+    variant_id: int = Form(...),
+    codes_raw: str = Form(""),
+    codes_file: Optional[UploadFile] = File(None),
+    db: Session = Depends(get_write_db),
+) -> RedirectResponse:
+    require_admin(request)
+    raw = codes_raw
+    if codes_file and codes_file.filename:
+        content = await codes_file.read()
+        raw = "\n".join([raw, content.decode("utf-8-sig", errors="ignore")])
+    codes = parse_codes_raw(raw)
+    await run_in_threadpool(_store_variant_codes, db, variant_id, codes)
+    return RedirectResponse("/admin", status_code=303)
+
+
+def _store_variant_codes(db: Session, variant_id: int, codes: list[str]) -> None:
+    variant = db.get(ProductVariant, variant_id)
+    if not variant:
+        raise HTTPException(status_code=404)
+    add_codes(db, variant.id, codes)
+    variant.code_pool = True
+    variant.stock = None
+    cache_bus.publish(db, "catalog")
+    db.commit()
@@ -3,29 +3,25 @@ from typing import Optional
 
 from fastapi import APIRouter, BackgroundTasks, Depends, Request
 from fastapi.responses import JSONResponse
-from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
-from app.core.config import SHOP_TYPES, TG_BOT_TOKEN, TG_GROUP_CHAT_ID
-from app.core.database import get_db
+from app.core.config import (SHOP_TYPES, TG_BOT_TOKEN, TG_GROUP_CHAT_ID,
+                             USER_ORDERS_PAGE_SIZE)
+from app.core.database import get_db, get_read_db, write_session
 from app.core.time import local_now
 from app.integrations.telegram import send_telegram_message
-from app.models import Order, ProductVariant, User
-from app.schemas.orders import RedeemRequest
+from app.schemas.orders import CheckoutRequest, RedeemRequest
 from app.services.auth import get_current_user
+from app.services.checkout import (RedeemError, load_cart_variants,
+                                   merge_cart_items, place_cart_order,
+                                   place_single_order)
+from app.services.orders import parse_order_cursor, user_orders_page
 from app.services.shops import get_shop_settings, has_access, is_shop_open
+from app.services.waiting_room import waiting_room
 
 router = APIRouter()
 
 
-class RedeemError(Exception):
-    def __init__(self, message: str, code: Optional[str] = None, status_code: int = 400) -> None:
-        super().__init__(message)
-        self.message = message
-        self.code = code
-        self.status_code = status_code
-
-
 def error_response(message: str, status_code: int = 400, code: Optional[str] = None) -> JSONResponse:
     payload = {"ok": False, "message": message}
     if code:
@@ -40,6 +36,17 @@ def redeem(
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ) -> JSONResponse:
+    if waiting_room.check_early(
+        request, payload.shop_type, local_now()
+    ) is not None:
+        return error_response(
+            "\u0412\u044b \u0432 \u043e\u0447\u0435\u0440\u0435\u0434\u0438",
+            status_code=503,
+            code="queue",
+        )
+    # Validation reads run on the primary pool, not a replica, since access
+    # and opening hours must be current; only the order itself takes the
+    # single writer connection.
     user = get_current_user(request, db)
     if not user:
         return error_response(
@@ -48,18 +55,23 @@ def redeem(
             code="unauthorized",
         )
 
-    variant = db.get(ProductVariant, payload.variant_id)
-    if not variant or not variant.active or not variant.product or not (
-        variant.product.active
-    ):
+    rows = load_cart_variants(db, [payload.variant_id])
+    variant, product = rows[0] if rows else (None, None)
+    if not variant or not variant.active or not product.active:
         return error_response(
             "\u041f\u043e\u0437\u0438\u0446\u0438\u044f \u043d\u0435\u0434\u043e\u0441\u0442\u0443\u043f\u043d\u0430",
             status_code=400,
         )
 
-    shop_type = variant.product.shop_type
+    shop_type = product.shop_type
     if shop_type not in SHOP_TYPES:
         return error_response("\u041d\u0435\u0432\u0435\u0440\u043d\u044b\u0439 \u043c\u0430\u0433\u0430\u0437\u0438\u043d")
+    if waiting_room.check(request, shop_type, local_now()) is not None:
+        return error_response(
+            "\u0412\u044b \u0432 \u043e\u0447\u0435\u0440\u0435\u0434\u0438",
+            status_code=503,
+            code="queue",
+        )
     if not has_access(db, user.tg_username, shop_type):
         return error_response(
             "\u041d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430",
@@ -70,97 +82,163 @@ def redeem(
     if not is_shop_open(settings, local_now()):
         return error_response("\u041c\u0430\u0433\u0430\u0437\u0438\u043d \u0437\u0430\u043a\u0440\u044b\u0442")
 
-    order_id = None
-    product_title = None
-    variant_label = None
-    points_cost = None
-
-    try:
-        variant = db.get(ProductVariant, payload.variant_id)
-        if not variant or not variant.active or not variant.product or not (
-            variant.product.active
-        ):
-            raise RedeemError("\u041f\u043e\u0437\u0438\u0446\u0438\u044f \u043d\u0435\u0434\u043e\u0441\u0442\u0443\u043f\u043d\u0430")
-
-        if variant.stock is not None and variant.stock <= 0:
-            raise RedeemError(
-                "\u0422\u043e\u0432\u0430\u0440 \u0437\u0430\u043a\u043e\u043d\u0447\u0438\u043b\u0441\u044f",
-                code="not-enough-tovar",
+    # The pooled connection goes back before the writer is taken.
+    db.close()
+    with write_session(request) as write_db:
+        try:
+            result = place_single_order(write_db, user, payload.variant_id)
+            write_db.commit()
+        except RedeemError as exc:
+            write_db.rollback()
+            return error_response(
+                exc.message,
+                status_code=exc.status_code,
+                code=exc.code,
             )
-
-        product_title = variant.product.title if variant.product else "Товар"
-        variant_label = variant.label
-        points_cost = variant.points_cost
-
-        points_result = db.execute(
-            update(User)
-            .where(User.id == user.id, User.points >= variant.points_cost)
-            .values(points=User.points - variant.points_cost)
-        )
-        if points_result.rowcount == 0:
-            raise RedeemError(
-                "\u041d\u0435\u0434\u043e\u0441\u0442\u0430\u0442\u043e\u0447\u043d\u043e \u0431\u0430\u043b\u043b\u043e\u0432",
-                code="not-enough-points",
+        except Exception:
+            write_db.rollback()
+            return JSONResponse(
+                {"ok": False, "message": "Ошибка сервера. Попробуйте позже."},
+                status_code=500,
             )
 
-        if variant.stock is not None:
-            stock_result = db.execute(
-                update(ProductVariant)
-                .where(
-                    ProductVariant.id == variant.id,
-                    ProductVariant.stock > 0
-                )
-                .values(stock=ProductVariant.stock - 1)
-            )
-            if stock_result.rowcount == 0:
-                raise RedeemError(
-                    "\u0422\u043e\u0432\u0430\u0440 \u0437\u0430\u043a\u043e\u043d\u0447\u0438\u043b\u0441\u044f",
-                    code="not-enough-tovar",
-                )
-
-        order = Order(
-            tg_username=user.tg_username,
-            product_variant_id=variant.id,
-            points_spent=variant.points_cost,
+    line = result.lines[0]
+    vouchers = result.vouchers
+    if TG_BOT_TOKEN and TG_GROUP_CHAT_ID:
+        shop_label = "Премиум" if shop_type == "premium" else "Обычный"
+        message = (
+            "<b>Новый заказ</b>\n"
+            f"Пользователь: {html.escape(user.tg_username)}\n"
+            f"Магазин: {shop_label}\n"
+            f"Товар: {html.escape(line.product_title)}\n"
+            f"Вариант: {html.escape(line.variant_label)}\n"
+            f"Списано: {line.points_cost} баллов\n"
+            f"ID заказа: {result.order_ids[0]}"
         )
-        db.add(order)
-        db.commit()
-        order_id = order.id
-    except RedeemError as exc:
-        db.rollback()
+        if vouchers:
+            message += "\nКод выдан автоматически"
+        background_tasks.add_task(send_telegram_message, message)
+
+    return JSONResponse(
+        {
+            "ok": True,
+            "message": "Заказ оформлен. Мы свяжемся с вами в Telegram.",
+            "points": result.points_left,
+            "order_ids": result.order_ids,
+            "vouchers": vouchers,
+            "code": "congrat",
+        }
+    )
+
+
+@router.post("/api/checkout")
+def checkout(
+    request: Request,
+    payload: CheckoutRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+) -> JSONResponse:
+    if waiting_room.check_early(
+        request, payload.shop_type, local_now()
+    ) is not None:
+        return error_response("Вы в очереди", status_code=503, code="queue")
+    user = get_current_user(request, db)
+    if not user:
         return error_response(
-            exc.message,
-            status_code=exc.status_code,
-            code=exc.code,
-        )
-    except Exception:
-        db.rollback()
-        return JSONResponse(
-            {"ok": False, "message": "Ошибка сервера. Попробуйте позже."},
-            status_code=500,
+            "Нужна авторизация", status_code=401, code="unauthorized"
         )
 
-    if order_id and TG_BOT_TOKEN and TG_GROUP_CHAT_ID:
+    quantities = merge_cart_items(payload.items)
+    rows = load_cart_variants(db, list(quantities))
+    if len(rows) != len(quantities) or any(
+        not variant.active or not product.active for variant, product in rows
+    ):
+        return error_response("Позиция недоступна")
+    shop_types = {product.shop_type for _, product in rows}
+    if len(shop_types) != 1:
+        return error_response("Товары из разных магазинов")
+    shop_type = shop_types.pop()
+    if shop_type not in SHOP_TYPES:
+        return error_response("Неверный магазин")
+    if waiting_room.check(request, shop_type, local_now()) is not None:
+        return error_response("Вы в очереди", status_code=503, code="queue")
+    if not has_access(db, user.tg_username, shop_type):
+        return error_response("Нет доступа", status_code=403)
+    settings = get_shop_settings(db, shop_type)
+    if not is_shop_open(settings, local_now()):
+        return error_response("Магазин закрыт")
+
+    db.close()
+    with write_session(request) as write_db:
+        try:
+            result = place_cart_order(write_db, user, quantities)
+            write_db.commit()
+        except RedeemError as exc:
+            write_db.rollback()
+            return error_response(
+                exc.message,
+                status_code=exc.status_code,
+                code=exc.code,
+            )
+        except Exception:
+            write_db.rollback()
+            return JSONResponse(
+                {"ok": False, "message": "Ошибка сервера. Попробуйте позже."},
+                status_code=500,
+            )
+
+    if TG_BOT_TOKEN and TG_GROUP_CHAT_ID:
         shop_label = "Премиум" if shop_type == "premium" else "Обычный"
+        items_text = "\n".join(
+            f"• {html.escape(line.product_title)} / "
+            f"{html.escape(line.variant_label)} × {line.qty}"
+            for line in result.lines
+        )
         message = (
-            "<b>Новый заказ</b>\n"
+            "<b>Новый заказ (корзина)</b>\n"
             f"Пользователь: {html.escape(user.tg_username)}\n"
             f"Магазин: {shop_label}\n"
-            f"Товар: {html.escape(product_title or '')}\n"
-            f"Вариант: {html.escape(variant_label or '')}\n"
-            f"Списано: {points_cost or 0} баллов\n"
-            f"ID заказа: {order_id}"
+            f"{items_text}\n"
+            f"Списано: {result.points_spent} баллов\n"
+            f"ID заказов: {', '.join(str(i) for i in result.order_ids)}"
         )
+        if result.vouchers:
+            message += "\nКоды выданы автоматически"
         background_tasks.add_task(send_telegram_message, message)
 
-    new_points = db.execute(
-        select(User.points).where(User.id == user.id)
-    ).scalar_one()
     return JSONResponse(
         {
             "ok": True,
             "message": "Заказ оформлен. Мы свяжемся с вами в Telegram.",
-            "points": new_points,
+            "points": result.points_left,
+            "order_ids": result.order_ids,
+            "vouchers": result.vouchers,
             "code": "congrat",
         }
     )
+
+
+@router.get("/api/orders")
+def my_orders(
+    request: Request,
+    before: Optional[str] = None,
+    limit: int = USER_ORDERS_PAGE_SIZE,
+    db: Session = Depends(get_read_db),
+) -> JSONResponse:
+    # The username comes from the session, so a page costs one query.
+    tg_username = request.session.get("tg_username")
+    if not tg_username:
+        return error_response(
+            "Нужна авторизация", status_code=401, code="unauthorized"
+        )
+    cursor = None
+    if before:
+        cursor = parse_order_cursor(before)
+        if cursor is None:
+            return error_response("Неверный курсор")
+    orders, next_cursor = user_orders_page(
+        db, tg_username, cursor, max(1, min(limit, 100))
+    )
+    for order in orders:
+        order["created_at"] = order["created_at"].isoformat()
+    return JSONResponse({"ok": True, "orders": orders, "next": next_cursor})
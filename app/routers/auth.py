@@ -3,7 +3,7 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from app.core.database import get_db
+from app.core.database import get_db, get_write_db
 from app.core.security import hash_password, validate_password, verify_password
 from app.core.templates import templates
 from app.models import User
@@ -71,7 +71,7 @@ def register(
     tg_username: str = Form(...),
     password: str = Form(...),
     password_confirm: str = Form(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
 ) -> RedirectResponse:
     normalized = normalize_tg_username(tg_username)
     if not normalized:
@@ -93,6 +93,9 @@ def register(
             {"request": request, "error": password_error},
             status_code=400,
         )
+    # Hash before touching the database so the slow KDF does not run
+    # inside the write transaction.
+    password_hash = hash_password(password)
     user = db.execute(
         select(User).where(User.tg_username == normalized)
     ).scalar_one_or_none()
@@ -105,7 +108,7 @@ def register(
     if not user:
         user = User(tg_username=normalized, points=0)
         db.add(user)
-    user.password_hash = hash_password(password)
+    user.password_hash = password_hash
     db.commit()
     request.session["tg_username"] = normalized
     return RedirectResponse("/shops", status_code=303)
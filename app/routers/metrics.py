@@ -0,0 +1,79 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.load_shedding import load_stats
+from app.core.metrics import format_labels, registry, worker_snapshots
+from app.core.time import local_now
+from app.services.waiting_room import waiting_room
+
+router = APIRouter()
+
+# (stats key, metric name, type). Cumulative values are counters with a
+# _total suffix so rate() works on them; current levels stay gauges.
+# Under gunicorn each worker has its own limiters and queue, so the values
+# are summed over workers (see WorkerSnapshots); the per-class limits in
+# LOAD_LIMITS apply to each worker separately.
+WAITING_ROOM_METRICS = (
+    ("tickets_issued", "waiting_room_tickets_issued_total", "counter"),
+    ("tickets_admitted", "waiting_room_tickets_admitted_total", "counter"),
+    ("admitted_upto", "waiting_room_admitted_upto", "gauge"),
+    ("waiting_responses", "waiting_room_waiting_responses_total", "counter"),
+    ("admitted_responses", "waiting_room_admitted_responses_total", "counter"),
+)
+LOAD_METRICS = (
+    ("in_flight", "load_class_in_flight", "gauge"),
+    ("waiting", "load_class_waiting", "gauge"),
+    ("admitted", "load_class_admitted_total", "counter"),
+    ("shed", "load_class_shed_total", "counter"),
+    ("timed_out", "load_class_timed_out_total", "counter"),
+)
+
+
+def worker_state() -> dict:
+    return {
+        "registry": registry.state(),
+        "waiting_room": waiting_room.stats(local_now()),
+        "load": load_stats(),
+    }
+
+
+def _stats_lines(workers: list[tuple[bool, dict]], label: str,
+                 metrics) -> list[str]:
+    # workers holds (alive, stats) pairs; gauges only sum live workers.
+    lines = []
+    for key, name, kind in metrics:
+        lines.append(f"# TYPE {name} {kind}")
+        totals: dict[str, float] = {}
+        for alive, stats in workers:
+            for owner, values in stats.items():
+                if alive or kind == "counter":
+                    totals[owner] = totals.get(owner, 0) + values[key]
+        for owner, value in sorted(totals.items()):
+            lines.append(
+                f"{name}{format_labels(((label, owner),))} {value}"
+            )
+    return lines
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    if worker_snapshots.enabled:
+        worker_snapshots.write()
+        workers = worker_snapshots.read_all()
+    else:
+        workers = [(True, worker_state())]
+    lines = registry.merged(
+        state["registry"] for _, state in workers
+    ).render()
+    lines += _stats_lines(
+        [(alive, state["waiting_room"]) for alive, state in workers],
+        "shop_type", WAITING_ROOM_METRICS,
+    )
+    lines += _stats_lines(
+        [(alive, state["load"]) for alive, state in workers],
+        "route_class", LOAD_METRICS,
+    )
+    return PlainTextResponse(
+        "\n".join(lines) + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
@@ -1,18 +1,48 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
-from app.core.config import SHOP_TYPES
-from app.core.database import get_db
-from app.core.templates import templates
-from app.core.time import local_now
+from app.core.cache_bus import cache_bus
+from app.core.config import (SHOP_TYPES, USER_ORDERS_PAGE_SIZE,
+                             WAITING_ROOM_REFRESH_SECONDS)
+from app.core.database import get_read_db
+from app.core.templates import templates, variant_stock_key
+from app.core.time import local_now, local_time
 from app.models import Product
-from app.services.auth import get_current_user
+from app.services.codes import available_code_counts, order_codes
+from app.services.orders import parse_order_cursor, user_orders_page
+from app.services.points import user_with_pending_credits
 from app.services.shops import get_shop_settings, has_access, is_shop_open
+from app.services.waiting_room import waiting_room
 
 router = APIRouter()
 
+
+def waiting_room_response(
+    request: Request, shop_type: str
+) -> Optional[HTMLResponse]:
+    if not request.session.get("tg_username"):
+        return RedirectResponse("/login", status_code=303)
+    ticket = waiting_room.check(request, shop_type, local_now())
+    if ticket is None:
+        return None
+    retry_after = min(ticket["eta_seconds"], WAITING_ROOM_REFRESH_SECONDS)
+    return templates.TemplateResponse(
+        "waiting_room.html",
+        {"request": request, "shop_type": shop_type, "ticket": ticket},
+        status_code=503,
+        headers={
+            "Retry-After": str(retry_after),
+            "Refresh": str(retry_after),
+        },
+    )
+
+
+# A cart checkout creates one order per unit; more ids than this are ignored.
+RESULT_MAX_ORDERS = 100
 RESULT_PAGES = {
     "congrat": {
         "image": "congrat.png",
@@ -33,8 +63,10 @@ RESULT_PAGES = {
 
 
 @router.get("/shops", response_class=HTMLResponse)
-def shops(request: Request, db: Session = Depends(get_db)) -> HTMLResponse:
-    user = get_current_user(request, db)
+def shops(request: Request, db: Session = Depends(get_read_db)) -> HTMLResponse:
+    user = user_with_pending_credits(
+        db, request.session.get("tg_username")
+    )
     if not user:
         return RedirectResponse("/login", status_code=303)
     now = local_now()
@@ -57,15 +89,51 @@ def shops(request: Request, db: Session = Depends(get_db)) -> HTMLResponse:
     )
 
 
+@router.get("/orders", response_class=HTMLResponse)
+def my_orders(
+    request: Request,
+    before: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+) -> HTMLResponse:
+    user = user_with_pending_credits(
+        db, request.session.get("tg_username")
+    )
+    if not user:
+        return RedirectResponse("/login", status_code=303)
+    orders, next_cursor = user_orders_page(
+        db,
+        user.tg_username,
+        parse_order_cursor(before) if before else None,
+        USER_ORDERS_PAGE_SIZE,
+    )
+    for order in orders:
+        order["created_local"] = local_time(order["created_at"])
+    return templates.TemplateResponse(
+        "orders.html",
+        {
+            "request": request,
+            "user": user,
+            "orders": orders,
+            "next_cursor": next_cursor,
+            "first_page": not before,
+        },
+    )
+
+
 @router.get("/shop/{shop_type}", response_class=HTMLResponse)
 def shop_view(
     shop_type: str,
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ) -> HTMLResponse:
     if shop_type not in SHOP_TYPES:
         raise HTTPException(status_code=404)
-    user = get_current_user(request, db)
+    waiting = waiting_room_response(request, shop_type)
+    if waiting is not None:
+        return waiting
+    user = user_with_pending_credits(
+        db, request.session.get("tg_username")
+    )
     if not user:
         return RedirectResponse("/login", status_code=303)
 
@@ -73,6 +141,7 @@ def shop_view(
     settings = get_shop_settings(db, shop_type)
     open_now = is_shop_open(settings, local_now())
 
+    catalog_version = cache_bus.version_for(db, "catalog")
     products = []
     if allowed and open_now:
         products = (
@@ -81,11 +150,21 @@ def shop_view(
                 .where(
                     Product.shop_type == shop_type, Product.active.is_(True)
                 )
+                .options(selectinload(Product.variants))
                 .order_by(Product.position, Product.created_at)
             )
             .scalars()
             .all()
         )
+    code_stock = available_code_counts(
+        db,
+        [
+            variant.id
+            for product in products
+            for variant in product.variants
+            if variant.code_pool
+        ],
+    )
 
     return templates.TemplateResponse(
         "shop.html",
@@ -97,6 +176,9 @@ def shop_view(
             "open_now": open_now,
             "settings": settings,
             "products": products,
+            "code_stock": code_stock,
+            "catalog_version": catalog_version,
+            "stock_key": variant_stock_key(products, code_stock),
         },
     )
 
@@ -108,11 +190,16 @@ def product_detail(
     shop_type: str,
     product_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ) -> HTMLResponse:
     if shop_type not in SHOP_TYPES:
         raise HTTPException(status_code=404)
-    user = get_current_user(request, db)
+    waiting = waiting_room_response(request, shop_type)
+    if waiting is not None:
+        return waiting
+    user = user_with_pending_credits(
+        db, request.session.get("tg_username")
+    )
     if not user:
         return RedirectResponse("/login", status_code=303)
 
@@ -133,6 +220,10 @@ def product_detail(
             .scalars()
             .first()
         )
+    code_stock = available_code_counts(
+        db,
+        [v.id for v in product.variants if v.code_pool] if product else [],
+    )
 
     return templates.TemplateResponse(
         "product.html",
@@ -144,6 +235,7 @@ def product_detail(
             "open_now": open_now,
             "settings": settings,
             "product": product,
+            "code_stock": code_stock,
         },
     )
 
@@ -153,17 +245,27 @@ def shop_result(
     shop_type: str,
     result_code: str,
     request: Request,
-    db: Session = Depends(get_db),
+    orders: Optional[str] = None,
+    db: Session = Depends(get_read_db),
 ) -> HTMLResponse:
     if shop_type not in SHOP_TYPES:
         raise HTTPException(status_code=404)
     if result_code not in RESULT_PAGES:
         raise HTTPException(status_code=404)
-    user = get_current_user(request, db)
+    user = user_with_pending_credits(
+        db, request.session.get("tg_username")
+    )
     if not user:
         return RedirectResponse("/login", status_code=303)
 
     payload = RESULT_PAGES[result_code]
+    vouchers = []
+    if result_code == "congrat" and orders:
+        order_ids = [
+            int(part) for part in orders.split(",")[:RESULT_MAX_ORDERS]
+            if part.strip().isdigit()
+        ]
+        vouchers = order_codes(db, user.tg_username, order_ids)
     return templates.TemplateResponse(
         "shop_result.html",
         {
@@ -173,5 +275,6 @@ def shop_result(
             "result_image": payload["image"],
             "result_alt": payload["alt"],
             "action_label": payload["action"],
+            "vouchers": vouchers,
         },
     )
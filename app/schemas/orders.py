@@ -1,5 +1,19 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, Field
 
 
 class RedeemRequest(BaseModel):
     variant_id: int
+    # Lets the waiting room answer before any database access.
+    shop_type: Optional[str] = None
+
+
+class CheckoutItem(BaseModel):
+    variant_id: int
+    qty: int = Field(1, ge=1, le=20)
+
+
+class CheckoutRequest(BaseModel):
+    items: list[CheckoutItem] = Field(..., min_length=1, max_length=50)
+    shop_type: Optional[str] = None
@@ -0,0 +1,71 @@
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, exists, func, insert, literal, select
+
+from app.core.config import (ORDER_ARCHIVE_AFTER_DAYS, ORDER_ARCHIVE_BATCH_SIZE,
+                             ORDER_ARCHIVE_PAUSE_SECONDS,
+                             ORDER_ARCHIVE_STATUSES)
+from app.core.database import WriteSessionLocal
+from app.models import Order, OrderArchive, VariantCode
+
+ARCHIVED_COLUMNS = (
+    "id", "tg_username", "product_variant_id", "points_spent", "status",
+    "created_at",
+)
+
+
+def archive_batch(cutoff: datetime, batch_size: int) -> int:
+    # One short transaction per batch, so the hot table is never locked for
+    # long. Orders holding a claimed code stay: variant_codes references
+    # orders.id. The newest order always stays too, so SQLite never hands
+    # out an archived id again.
+    with WriteSessionLocal() as db:
+        ids = db.execute(
+            select(Order.id)
+            .where(
+                Order.status.in_(ORDER_ARCHIVE_STATUSES),
+                Order.created_at < cutoff,
+                Order.id < select(func.max(Order.id)).scalar_subquery(),
+                ~exists().where(VariantCode.order_id == Order.id),
+            )
+            .order_by(Order.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not ids:
+            return 0
+        archived_at = datetime.utcnow()
+        db.execute(
+            insert(OrderArchive).from_select(
+                [*ARCHIVED_COLUMNS, "archived_at"],
+                select(
+                    *(getattr(Order, column) for column in ARCHIVED_COLUMNS),
+                    literal(archived_at, OrderArchive.archived_at.type),
+                ).where(Order.id.in_(ids)),
+            )
+        )
+        db.execute(delete(Order).where(Order.id.in_(ids)))
+        db.commit()
+    return len(ids)
+
+
+def archive_orders(
+    older_than_days: int = ORDER_ARCHIVE_AFTER_DAYS,
+    batch_size: int = ORDER_ARCHIVE_BATCH_SIZE,
+    pause: float = ORDER_ARCHIVE_PAUSE_SECONDS,
+    max_batches: Optional[int] = None,
+) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+        # Lets checkout writers in between batches.
+        time.sleep(pause)
+    return total
@@ -0,0 +1,554 @@
+import csv
+import io
+import json
+from typing import Optional
+
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.orm import Session, selectinload
+
+from app.core.cache_bus import cache_bus
+from app.core.config import SHOP_TYPES
+from app.models import Product, ProductVariant
+
+CSV_COLUMNS = (
+    "product_key", "shop_type", "title", "description", "image_url",
+    "product_active", "product_position", "variant_key", "label",
+    "points_cost", "stock", "variant_active", "variant_position", "code_pool",
+)
+PRODUCT_FIELDS = ("shop_type", "title", "description", "image_url", "active",
+                  "position")
+VARIANT_FIELDS = ("label", "points_cost", "stock", "active", "position",
+                  "code_pool")
+PRODUCT_DEFAULTS = {"description": None, "image_url": None, "active": True,
+                    "position": 0}
+VARIANT_DEFAULTS = {"stock": None, "active": True, "code_pool": False}
+TRUE_WORDS = {"1", "true", "yes", "on", "да"}
+FALSE_WORDS = {"0", "false", "no", "off", "нет"}
+KEY_MAX_LENGTH = 100
+
+
+class CatalogError(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+# Rows without an external key are exported as "#<id>", and an import
+# matches such a key by primary key, so an export round-trips unchanged.
+def export_key(external_key: Optional[str], row_id: int) -> str:
+    return external_key or f"#{row_id}"
+
+
+def _key_id(key: str) -> Optional[int]:
+    if key.startswith("#") and key[1:].isdigit():
+        return int(key[1:])
+    return None
+
+
+def load_catalog(db: Session) -> list[Product]:
+    return db.execute(
+        select(Product)
+        .options(selectinload(Product.variants))
+        .order_by(Product.shop_type, Product.position, Product.id)
+    ).scalars().all()
+
+
+def export_catalog_json(products: list[Product]) -> str:
+    items = [
+        {
+            "key": export_key(product.external_key, product.id),
+            "shop_type": product.shop_type,
+            "title": product.title,
+            "description": product.description,
+            "image_url": product.image_url,
+            "active": product.active,
+            "position": product.position,
+            "variants": [
+                {
+                    "key": export_key(variant.external_key, variant.id),
+                    "label": variant.label,
+                    "points_cost": variant.points_cost,
+                    "stock": variant.stock,
+                    "active": variant.active,
+                    "position": variant.position,
+                    "code_pool": variant.code_pool,
+                }
+                for variant in product.variants
+            ],
+        }
+        for product in products
+    ]
+    return json.dumps({"products": items}, ensure_ascii=False, indent=2)
+
+
+def export_catalog_csv(products: list[Product]) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_COLUMNS)
+    for product in products:
+        head = [
+            export_key(product.external_key, product.id), product.shop_type,
+            product.title, product.description or "", product.image_url or "",
+            int(product.active), product.position,
+        ]
+        if not product.variants:
+            writer.writerow(head + [""] * 7)
+        for variant in product.variants:
+            writer.writerow(
+                head + [
+                    export_key(variant.external_key, variant.id),
+                    variant.label, variant.points_cost,
+                    "" if variant.stock is None else variant.stock,
+                    int(variant.active), variant.position,
+                    int(variant.code_pool),
+                ]
+            )
+    return output.getvalue()
+
+
+def _parse_bool(value, where: str) -> bool:
+    if isinstance(value, bool):
+        return value
+    word = str(value).strip().lower()
+    if word in TRUE_WORDS:
+        return True
+    if word in FALSE_WORDS:
+        return False
+    raise CatalogError(f"{where}: не понял «{value}», нужно 1 или 0")
+
+
+def _parse_int(value, where: str, allow_none: bool = False) -> Optional[int]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if allow_none:
+            return None
+        raise CatalogError(f"{where}: нужно число")
+    if isinstance(value, bool):
+        raise CatalogError(f"{where}: нужно число")
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise CatalogError(f"{where}: «{value}» не число") from None
+    if number < 0:
+        raise CatalogError(f"{where}: число не может быть меньше нуля")
+    return number
+
+
+def _parse_text(value, where: str, max_length: Optional[int] = None,
+                required: bool = False) -> Optional[str]:
+    text = "" if value is None else str(value).strip()
+    if required and not text:
+        raise CatalogError(f"{where}: пустое значение")
+    if max_length is not None and len(text) > max_length:
+        raise CatalogError(f"{where}: длиннее {max_length} символов")
+    return text or None
+
+
+def _clean_product(raw: dict, where: str) -> dict:
+    # Only fields present in the source are returned: an update leaves the
+    # others as they are, a new product gets PRODUCT_DEFAULTS.
+    values = {}
+    if "shop_type" in raw:
+        shop_type = _parse_text(raw["shop_type"], f"{where}, shop_type",
+                                required=True)
+        if shop_type not in SHOP_TYPES:
+            raise CatalogError(
+                f"{where}: магазин «{shop_type}», нужен один из "
+                f"{', '.join(SHOP_TYPES)}"
+            )
+        values["shop_type"] = shop_type
+    if "title" in raw:
+        values["title"] = _parse_text(raw["title"], f"{where}, title", 200,
+                                      required=True)
+    if "description" in raw:
+        values["description"] = _parse_text(raw["description"],
+                                            f"{where}, description")
+    if "image_url" in raw:
+        values["image_url"] = _parse_text(raw["image_url"],
+                                          f"{where}, image_url", 500)
+    if raw.get("active") not in (None, ""):
+        values["active"] = _parse_bool(raw["active"], f"{where}, active")
+    if raw.get("position") not in (None, ""):
+        values["position"] = _parse_int(raw["position"], f"{where}, position")
+    return values
+
+
+def _clean_variant(raw: dict, where: str) -> dict:
+    values = {}
+    if "label" in raw:
+        values["label"] = _parse_text(raw["label"], f"{where}, label", 120,
+                                      required=True)
+    if "points_cost" in raw:
+        values["points_cost"] = _parse_int(raw["points_cost"],
+                                           f"{where}, points_cost")
+    if "stock" in raw:
+        values["stock"] = _parse_int(raw["stock"], f"{where}, stock",
+                                     allow_none=True)
+    for field in ("active", "code_pool"):
+        if raw.get(field) not in (None, ""):
+            values[field] = _parse_bool(raw[field], f"{where}, {field}")
+    if raw.get("position") not in (None, ""):
+        values["position"] = _parse_int(raw["position"], f"{where}, position")
+    return values
+
+
+def _items_from_csv(text: str) -> list[dict]:
+    reader = csv.DictReader(io.StringIO(text))
+    if "product_key" not in (reader.fieldnames or ()):
+        raise CatalogError("В CSV нет колонки product_key")
+    items: dict[str, dict] = {}
+    for line_number, row in enumerate(reader, start=2):
+        key = (row.get("product_key") or "").strip()
+        item = items.get(key)
+        if item is None:
+            item = {
+                field: row[column]
+                for field, column in (
+                    ("shop_type", "shop_type"), ("title", "title"),
+                    ("description", "description"),
+                    ("image_url", "image_url"), ("active", "product_active"),
+                    ("position", "product_position"),
+                )
+                if column in row
+            }
+            item.update({"key": key, "line": line_number, "variants": []})
+            items[key] = item
+        if any((row.get(column) or "").strip() for column in
+               ("variant_key", "label", "points_cost")):
+            variant = {
+                field: row[column]
+                for field, column in (
+                    ("key", "variant_key"), ("label", "label"),
+                    ("points_cost", "points_cost"), ("stock", "stock"),
+                    ("active", "variant_active"),
+                    ("position", "variant_position"),
+                    ("code_pool", "code_pool"),
+                )
+                if column in row
+            }
+            variant["line"] = line_number
+            item["variants"].append(variant)
+    return list(items.values())
+
+
+def parse_catalog(raw: bytes, filename: str = "") -> list[dict]:
+    # Reads a JSON ({"products": [...]} or a bare list) or CSV file into
+    # validated product dicts; the first problem raises CatalogError.
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise CatalogError("Файл должен быть в UTF-8") from None
+    if filename.lower().endswith(".json") or text.lstrip().startswith(
+        ("[", "{")
+    ):
+        try:
+            data = json.loads(text)
+        except ValueError as exc:
+            raise CatalogError(f"Ошибка JSON: {exc}") from None
+        raw_items = data.get("products") if isinstance(data, dict) else data
+        if not isinstance(raw_items, list):
+            raise CatalogError("В JSON нужен список products")
+    else:
+        raw_items = _items_from_csv(text)
+
+    items = []
+    product_keys = set()
+    for index, raw_item in enumerate(raw_items, start=1):
+        if not isinstance(raw_item, dict):
+            raise CatalogError(f"Товар {index}: ожидался объект")
+        where = (
+            f"Строка {raw_item['line']}" if "line" in raw_item
+            else f"Товар {index}"
+        )
+        key = _parse_text(raw_item.get("key"), f"{where}, key",
+                          KEY_MAX_LENGTH, required=True)
+        if key in product_keys:
+            raise CatalogError(f"{where}: ключ «{key}» повторяется")
+        product_keys.add(key)
+        variants = []
+        variant_keys = set()
+        raw_variants = raw_item.get("variants") or []
+        if not isinstance(raw_variants, list):
+            raise CatalogError(f"{where}: variants должен быть списком")
+        for variant_index, raw_variant in enumerate(raw_variants, start=1):
+            if not isinstance(raw_variant, dict):
+                raise CatalogError(f"{where}, вариант {variant_index}: "
+                                   "ожидался объект")
+            variant_where = (
+                f"Строка {raw_variant['line']}" if "line" in raw_variant
+                else f"{where}, вариант {variant_index}"
+            )
+            variant_key = _parse_text(raw_variant.get("key"),
+                                      f"{variant_where}, key", KEY_MAX_LENGTH)
+            values = _clean_variant(raw_variant, variant_where)
+            # Without a key a variant is matched by its label.
+            match = variant_key or f"label:{values.get('label')}"
+            if match in variant_keys:
+                raise CatalogError(f"{variant_where}: вариант повторяется")
+            variant_keys.add(match)
+            variants.append(
+                {"key": variant_key, "values": values,
+                 "where": variant_where}
+            )
+        items.append(
+            {"key": key, "values": _clean_product(raw_item, where),
+             "variants": variants, "where": where}
+        )
+    return items
+
+
+def _changes(row, values: dict, fields) -> list[tuple[str, object, object]]:
+    return [
+        (field, getattr(row, field), values[field])
+        for field in fields
+        if field in values and getattr(row, field) != values[field]
+    ]
+
+
+def _check_code_pool(current: dict, where: str) -> None:
+    # Same rule as adding codes in the admin: a code-pool variant's stock is
+    # its free codes, so the stock column stays empty.
+    if current.get("code_pool") and current.get("stock") is not None:
+        raise CatalogError(
+            f"{where}: у варианта с кодами остаток считается по кодам, "
+            "stock должен быть пустым"
+        )
+
+
+def plan_catalog_import(db: Session, items: list[dict],
+                        with_stock: bool = False) -> dict:
+    # Diff of the file against the database: every product and variant is
+    # "create", "update" (with its changed fields) or "same". Reads the
+    # affected products with two queries and writes nothing.
+    #
+    # Stock of existing variants is only taken from the file with
+    # with_stock: an old export would otherwise put back every unit sold
+    # since it was made. New variants always get the file's stock.
+    keys = [item["key"] for item in items if _key_id(item["key"]) is None]
+    ids = [_key_id(item["key"]) for item in items
+           if _key_id(item["key"]) is not None]
+    existing = db.execute(
+        select(Product)
+        .options(selectinload(Product.variants))
+        .where(or_(Product.external_key.in_(keys), Product.id.in_(ids)))
+    ).scalars().all()
+    by_key = {product.external_key: product for product in existing
+              if product.external_key}
+    by_id = {product.id: product for product in existing}
+
+    plan = []
+    for item in items:
+        key_id = _key_id(item["key"])
+        product = by_id.get(key_id) if key_id is not None else (
+            by_key.get(item["key"])
+        )
+        values = item["values"]
+        if product is None:
+            if key_id is not None:
+                raise CatalogError(
+                    f"{item['where']}: товара {item['key']} нет в каталоге"
+                )
+            for field in ("shop_type", "title"):
+                if field not in values:
+                    raise CatalogError(
+                        f"{item['where']}: для нового товара нужен {field}"
+                    )
+            entry = {"action": "create", "key": item["key"], "id": None,
+                     "title": values["title"], "changes": [],
+                     "values": {**PRODUCT_DEFAULTS, **values}}
+        else:
+            changes = _changes(product, values, PRODUCT_FIELDS)
+            entry = {"action": "update" if changes else "same",
+                     "key": item["key"], "id": product.id,
+                     "title": values.get("title", product.title),
+                     "changes": changes, "values": values}
+
+        variants_by_key = {}
+        variants_by_label = {}
+        if product is not None:
+            for variant in product.variants:
+                if variant.external_key:
+                    variants_by_key[variant.external_key] = variant
+                variants_by_label.setdefault(variant.label, variant)
+                variants_by_key.setdefault(f"#{variant.id}", variant)
+        next_position = max(
+            (variant.position for variant in product.variants), default=-1
+        ) + 1 if product is not None else 0
+        entry["variants"] = []
+        for variant_item in item["variants"]:
+            variant_key = variant_item["key"]
+            variant_values = variant_item["values"]
+            if variant_key:
+                variant = variants_by_key.get(variant_key)
+                if variant is None and _key_id(variant_key) is not None:
+                    raise CatalogError(
+                        f"{variant_item['where']}: у товара нет варианта "
+                        f"{variant_key}"
+                    )
+            else:
+                variant = variants_by_label.get(variant_values.get("label"))
+            if variant is not None and not with_stock:
+                variant_values = {
+                    field: value for field, value in variant_values.items()
+                    if field != "stock"
+                }
+            if variant is None:
+                for field in ("label", "points_cost"):
+                    if field not in variant_values:
+                        raise CatalogError(
+                            f"{variant_item['where']}: для нового варианта "
+                            f"нужен {field}"
+                        )
+                defaults = {**VARIANT_DEFAULTS, "position": next_position}
+                next_position += 1
+                _check_code_pool({**defaults, **variant_values},
+                                 variant_item["where"])
+                entry["variants"].append(
+                    {"action": "create", "key": variant_key, "id": None,
+                     "label": variant_values["label"], "changes": [],
+                     "values": {**defaults, **variant_values}}
+                )
+            else:
+                code_pool = variant_values.get("code_pool", variant.code_pool)
+                if code_pool and "stock" not in variant_values:
+                    variant_values = {**variant_values, "stock": None}
+                _check_code_pool(
+                    {"code_pool": code_pool, "stock": variant_values.get(
+                        "stock", variant.stock)},
+                    variant_item["where"],
+                )
+                changes = _changes(variant, variant_values, VARIANT_FIELDS)
+                entry["variants"].append(
+                    {"action": "update" if changes else "same",
+                     "key": variant_key, "id": variant.id,
+                     "label": variant_values.get("label", variant.label),
+                     "changes": changes, "values": variant_values}
+                )
+        plan.append(entry)
+
+    summary = {"created": 0, "updated": 0, "unchanged": 0,
+               "variants_created": 0, "variants_updated": 0}
+    counters = {"create": "created", "update": "updated", "same": "unchanged"}
+    for entry in plan:
+        summary[counters[entry["action"]]] += 1
+        for variant_entry in entry["variants"]:
+            if variant_entry["action"] != "same":
+                summary[f"variants_{counters[variant_entry['action']]}"] += 1
+    return {"products": plan, "summary": summary}
+
+
+def previewed_stock(plan: dict) -> dict[str, Optional[int]]:
+    # Stock each changed variant had when the preview was shown, keyed by
+    # variant id; apply refuses to overwrite a value that has moved since.
+    return {
+        str(variant_entry["id"]): old
+        for entry in plan["products"]
+        for variant_entry in entry["variants"]
+        for field, old, _ in variant_entry["changes"]
+        if field == "stock"
+    }
+
+
+def _check_stock_unchanged(db: Session, plan: dict,
+                           expected: dict[str, Optional[int]]) -> None:
+    # Compare-and-set: the rows are locked, so a redeem cannot slip in
+    # between this check and the UPDATE.
+    labels = {
+        variant_entry["id"]: variant_entry["label"]
+        for entry in plan["products"] for variant_entry in entry["variants"]
+    }
+    changed = previewed_stock(plan)
+    if not changed:
+        return
+    live = dict(
+        db.execute(
+            select(ProductVariant.id, ProductVariant.stock)
+            .where(ProductVariant.id.in_([int(key) for key in changed]))
+            .with_for_update()
+        ).all()
+    )
+    for key in changed:
+        if key not in expected or live.get(int(key)) != expected[key]:
+            raise CatalogError(
+                f"Остаток варианта «{labels[int(key)]}» изменился после "
+                "предпросмотра, загрузите файл ещё раз"
+            )
+
+
+def apply_catalog_import(db: Session, plan: dict,
+                         expected_stock: dict[str, Optional[int]]) -> None:
+    # Set-based writes in the caller's transaction: one multi-row INSERT and
+    # one executemany UPDATE per table, and a single catalog version bump.
+    # expected_stock is previewed_stock() of the plan the admin confirmed.
+    _check_stock_unchanged(db, plan, expected_stock)
+    entries = plan["products"]
+    created = [entry for entry in entries if entry["action"] == "create"]
+    product_ids = {entry["key"]: entry["id"] for entry in entries}
+    if created:
+        rows = db.execute(
+            insert(Product).returning(Product.id, Product.external_key),
+            [{**entry["values"], "external_key": entry["key"]}
+             for entry in created],
+        ).all()
+        product_ids.update({key: row_id for row_id, key in rows})
+    updated = [
+        {"id": entry["id"], **{field: new for field, _, new in entry["changes"]}}
+        for entry in entries if entry["action"] == "update"
+    ]
+    if updated:
+        db.execute(update(Product), updated)
+
+    new_variants = []
+    changed_variants = []
+    for entry in entries:
+        for variant_entry in entry["variants"]:
+            if variant_entry["action"] == "create":
+                new_variants.append(
+                    {**variant_entry["values"],
+                     "product_id": product_ids[entry["key"]],
+                     "external_key": variant_entry["key"]}
+                )
+            elif variant_entry["action"] == "update":
+                changed_variants.append(
+                    {"id": variant_entry["id"],
+                     **{field: new
+                        for field, _, new in variant_entry["changes"]}}
+                )
+    if new_variants:
+        db.execute(insert(ProductVariant), new_variants)
+    if changed_variants:
+        db.execute(update(ProductVariant), changed_variants)
+
+    if created or updated or new_variants or changed_variants:
+        cache_bus.publish(db, "catalog")
+
+
+def plan_payload(items: list[dict], plan: dict) -> str:
+    # The parsed file, carried from the preview page to the apply request,
+    # with the stock values the preview showed.
+    return json.dumps(
+        {
+            "expected_stock": previewed_stock(plan),
+            "products": [
+                {
+                    "key": item["key"], **item["values"],
+                    "variants": [
+                        {"key": variant["key"], **variant["values"]}
+                        for variant in item["variants"]
+                    ],
+                }
+                for item in items
+            ]
+        },
+        ensure_ascii=False,
+    )
+
+
+def payload_expected_stock(raw: bytes) -> dict[str, Optional[int]]:
+    # Anything but a payload from plan_payload expects nothing, so any
+    # stock change in it is refused.
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return {}
+    expected = data.get("expected_stock") if isinstance(data, dict) else None
+    return expected if isinstance(expected, dict) else {}
@@ -0,0 +1,256 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Order, Product, ProductVariant, User
+from app.services.codes import claim_codes
+from app.services.points import fold_pending, lock_user, record_order_debits
+from app.services.sales import record_new_orders
+
+UNAVAILABLE_MESSAGE = "Позиция недоступна"
+OUT_OF_STOCK_MESSAGE = "Товар закончился"
+NOT_ENOUGH_POINTS_MESSAGE = "Недостаточно баллов"
+
+
+class RedeemError(Exception):
+    def __init__(self, message: str, code: Optional[str] = None, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.status_code = status_code
+
+
+@dataclass
+class CartLine:
+    variant_id: int
+    qty: int
+    product_title: str = ""
+    variant_label: str = ""
+    points_cost: int = 0
+    code_pool: bool = False
+
+
+@dataclass
+class CartResult:
+    order_ids: list[int]
+    lines: list[CartLine]
+    points_spent: int
+    vouchers: list[str]
+    points_left: int = 0
+
+
+def merge_cart_items(items) -> dict[int, int]:
+    quantities: dict[int, int] = {}
+    for item in items:
+        quantities[item.variant_id] = quantities.get(item.variant_id, 0) + (
+            item.qty
+        )
+    return quantities
+
+
+def load_cart_variants(
+    db: Session, variant_ids
+) -> list[tuple[ProductVariant, Product]]:
+    return db.execute(
+        select(ProductVariant, Product)
+        .join(Product, ProductVariant.product_id == Product.id)
+        .where(ProductVariant.id.in_(variant_ids))
+        .order_by(ProductVariant.id)
+    ).all()
+
+
+def insert_orders(db: Session, tg_username: str, lines: list[CartLine]):
+    # One multi-row INSERT ... RETURNING for the whole cart instead of a
+    # flush per order. RETURNING does not promise parameter order, so codes
+    # are matched by the returned variant id; the rows carry everything
+    # sales and the ledger need.
+    rows = db.execute(
+        insert(Order).returning(
+            Order.id,
+            Order.product_variant_id,
+            Order.points_spent,
+            Order.status,
+            Order.created_at,
+        ),
+        [
+            {
+                "tg_username": tg_username,
+                "product_variant_id": line.variant_id,
+                "points_spent": line.points_cost,
+            }
+            for line in lines
+            for _ in range(line.qty)
+        ],
+    ).all()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def place_single_order(db: Session, user: User, variant_id: int) -> CartResult:
+    rows = load_cart_variants(db, [variant_id])
+    if not rows:
+        raise RedeemError(UNAVAILABLE_MESSAGE)
+    variant, product = rows[0]
+    if not variant.active or not product.active:
+        raise RedeemError(UNAVAILABLE_MESSAGE)
+    if variant.stock is not None and variant.stock <= 0:
+        raise RedeemError(OUT_OF_STOCK_MESSAGE, code="not-enough-tovar")
+
+    line = CartLine(
+        variant_id=variant.id,
+        qty=1,
+        product_title=product.title or "Товар",
+        variant_label=variant.label,
+        points_cost=variant.points_cost,
+        code_pool=variant.code_pool,
+    )
+    # The buyer's row is locked first, as carts do, and pending ledger
+    # credits are folded in by the same conditional UPDATE that spends.
+    # Both guards live in the WHERE clause, so two concurrent redeems can
+    # never spend the same points or the last unit twice.
+    lock_user(db, user.id)
+    pending = fold_pending(db, user.id)
+    points_left = db.execute(
+        update(User)
+        .where(User.id == user.id, User.points + pending >= line.points_cost)
+        .values(points=User.points + pending - line.points_cost)
+        .returning(User.points)
+    ).scalar_one_or_none()
+    if points_left is None:
+        raise RedeemError(
+            NOT_ENOUGH_POINTS_MESSAGE, code="not-enough-points"
+        )
+    if variant.stock is not None:
+        stock_result = db.execute(
+            update(ProductVariant)
+            .where(ProductVariant.id == variant.id, ProductVariant.stock > 0)
+            .values(stock=ProductVariant.stock - 1)
+        )
+        if stock_result.rowcount == 0:
+            raise RedeemError(OUT_OF_STOCK_MESSAGE, code="not-enough-tovar")
+
+    order = insert_orders(db, user.tg_username, [line])[0]
+    record_new_orders(
+        db, [order],
+        {variant.id: (product.id, product.shop_type)},
+    )
+    record_order_debits(db, user.id, [order])
+    vouchers = []
+    if line.code_pool:
+        vouchers = claim_codes(db, variant.id, [order.id])
+        if not vouchers:
+            raise RedeemError(OUT_OF_STOCK_MESSAGE, code="not-enough-tovar")
+    return CartResult(
+        order_ids=[order.id],
+        lines=[line],
+        points_spent=line.points_cost,
+        vouchers=vouchers,
+        points_left=points_left,
+    )
+
+
+def place_cart_order(
+    db: Session, user: User, quantities: dict[int, int]
+) -> CartResult:
+    # Rows are locked in a fixed order - the buyer first, then variants by
+    # id - which is the same order single-item redeems take, so concurrent
+    # carts and redeems cannot deadlock each other.
+    lock_user(db, user.id)
+    variant_ids = sorted(quantities)
+    locked = db.execute(
+        select(
+            ProductVariant.id,
+            ProductVariant.label,
+            ProductVariant.points_cost,
+            ProductVariant.stock,
+            ProductVariant.active,
+            ProductVariant.code_pool,
+            Product.title,
+            Product.active.label("product_active"),
+            Product.id.label("product_id"),
+            Product.shop_type,
+        )
+        .join(Product, ProductVariant.product_id == Product.id)
+        .where(ProductVariant.id.in_(variant_ids))
+        .order_by(ProductVariant.id)
+        .with_for_update(of=ProductVariant)
+    ).all()
+    if len(locked) != len(variant_ids):
+        raise RedeemError(UNAVAILABLE_MESSAGE)
+
+    lines = []
+    limited: dict[int, int] = {}
+    for row in locked:
+        if not row.active or not row.product_active:
+            raise RedeemError(UNAVAILABLE_MESSAGE)
+        qty = quantities[row.id]
+        if row.stock is not None:
+            if row.stock < qty:
+                raise RedeemError(
+                    OUT_OF_STOCK_MESSAGE, code="not-enough-tovar"
+                )
+            limited[row.id] = qty
+        lines.append(
+            CartLine(
+                variant_id=row.id,
+                qty=qty,
+                product_title=row.title or "Товар",
+                variant_label=row.label,
+                points_cost=row.points_cost,
+                code_pool=row.code_pool,
+            )
+        )
+    total = sum(line.points_cost * line.qty for line in lines)
+
+    pending = fold_pending(db, user.id)
+    points_left = db.execute(
+        update(User)
+        .where(User.id == user.id, User.points + pending >= total)
+        .values(points=User.points + pending - total)
+        .returning(User.points)
+    ).scalar_one_or_none()
+    if points_left is None:
+        raise RedeemError(
+            NOT_ENOUGH_POINTS_MESSAGE, code="not-enough-points"
+        )
+
+    if limited:
+        qty_by_id = case(limited, value=ProductVariant.id)
+        stock_result = db.execute(
+            update(ProductVariant)
+            .where(
+                ProductVariant.id.in_(limited),
+                ProductVariant.stock >= qty_by_id,
+            )
+            .values(stock=ProductVariant.stock - qty_by_id)
+            .execution_options(synchronize_session=False)
+        )
+        if stock_result.rowcount != len(limited):
+            raise RedeemError(OUT_OF_STOCK_MESSAGE, code="not-enough-tovar")
+
+    orders = insert_orders(db, user.tg_username, lines)
+    record_new_orders(
+        db, orders, {row.id: (row.product_id, row.shop_type) for row in locked}
+    )
+    record_order_debits(db, user.id, orders)
+
+    vouchers = []
+    for line in lines:
+        if not line.code_pool:
+            continue
+        order_ids = [
+            order.id for order in orders
+            if order.product_variant_id == line.variant_id
+        ]
+        codes = claim_codes(db, line.variant_id, order_ids)
+        if not codes:
+            raise RedeemError(OUT_OF_STOCK_MESSAGE, code="not-enough-tovar")
+        vouchers.extend(codes)
+    return CartResult(
+        order_ids=[order.id for order in orders],
+        lines=lines,
+        points_spent=total,
+        vouchers=vouchers,
+        points_left=points_left,
+    )
@@ -0,0 +1,144 @@
+from datetime import datetime
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Order, VariantCode
+
+
+def parse_codes_raw(raw: str) -> list[str]:
+    codes = []
+    seen = set()
+    for line in (raw or "").splitlines():
+        cleaned = line.strip()
+        if not cleaned or cleaned in seen:
+            continue
+        seen.add(cleaned)
+        codes.append(cleaned[:255])
+    return codes
+
+
+def add_codes(db: Session, variant_id: int, codes: list[str]) -> int:
+    if not codes:
+        return 0
+    existing = set(
+        db.execute(
+            select(VariantCode.code).where(
+                VariantCode.variant_id == variant_id
+            )
+        ).scalars()
+    )
+    fresh = [code for code in codes if code not in existing]
+    if fresh:
+        db.execute(
+            insert(VariantCode),
+            [{"variant_id": variant_id, "code": code} for code in fresh],
+        )
+    return len(fresh)
+
+
+def available_code_counts(db: Session, variant_ids) -> dict[int, int]:
+    variant_ids = list(variant_ids)
+    if not variant_ids:
+        return {}
+    rows = db.execute(
+        select(VariantCode.variant_id, func.count(VariantCode.id))
+        .where(
+            VariantCode.variant_id.in_(variant_ids),
+            VariantCode.order_id.is_(None),
+        )
+        .group_by(VariantCode.variant_id)
+    ).all()
+    counts = {variant_id: 0 for variant_id in variant_ids}
+    counts.update({variant_id: count for variant_id, count in rows})
+    return counts
+
+
+def order_codes(
+    db: Session, tg_username: str, order_ids: list[int]
+) -> list[str]:
+    # Codes are read back from the orders they were claimed for, so they
+    # survive a reload and do not ride in the session cookie.
+    if not order_ids:
+        return []
+    return list(
+        db.execute(
+            select(VariantCode.code)
+            .join(Order, VariantCode.order_id == Order.id)
+            .where(
+                Order.id.in_(order_ids),
+                Order.tg_username == tg_username,
+            )
+            .order_by(VariantCode.order_id)
+        ).scalars()
+    )
+
+
+def _claim_skip_locked(
+    db: Session, variant_id: int, order_ids: list[int]
+) -> list[str]:
+    rows = db.execute(
+        select(VariantCode.id, VariantCode.code)
+        .where(
+            VariantCode.variant_id == variant_id,
+            VariantCode.order_id.is_(None),
+        )
+        .order_by(VariantCode.id)
+        .limit(len(order_ids))
+        .with_for_update(skip_locked=True)
+    ).all()
+    if len(rows) < len(order_ids):
+        return []
+    claimed_at = datetime.utcnow()
+    db.execute(
+        update(VariantCode),
+        [
+            {"id": code_id, "order_id": order_id, "claimed_at": claimed_at}
+            for (code_id, _), order_id in zip(rows, order_ids)
+        ],
+    )
+    return [code for _, code in rows]
+
+
+def _claim_in_one_update(
+    db: Session, variant_id: int, order_ids: list[int]
+) -> list[str]:
+    # SQLite has no row locks, but every statement runs under the database
+    # write lock, so one UPDATE of "the first n rows that are still free"
+    # is atomic on its own. Each free row is ranked and handed the order at
+    # that rank, so a cart costs one statement however many codes it takes.
+    free = (
+        select(
+            VariantCode.id,
+            (func.row_number().over(order_by=VariantCode.id) - 1).label(
+                "rank"
+            ),
+        )
+        .where(
+            VariantCode.variant_id == variant_id,
+            VariantCode.order_id.is_(None),
+        )
+        .order_by(VariantCode.id)
+        .limit(len(order_ids))
+        .subquery()
+    )
+    rows = db.execute(
+        update(VariantCode)
+        .where(VariantCode.id == free.c.id, VariantCode.order_id.is_(None))
+        .values(
+            order_id=case(dict(enumerate(order_ids)), value=free.c.rank),
+            claimed_at=datetime.utcnow(),
+        )
+        .returning(VariantCode.order_id, VariantCode.code)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if len(rows) < len(order_ids):
+        return []
+    codes = dict(rows)
+    return [codes[order_id] for order_id in order_ids]
+
+
+def claim_codes(db: Session, variant_id: int, order_ids: list[int]) -> list[str]:
+    if db.get_bind().dialect.name == "postgresql":
+        return _claim_skip_locked(db, variant_id, order_ids)
+    return _claim_in_one_update(db, variant_id, order_ids)
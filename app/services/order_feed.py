@@ -0,0 +1,106 @@
+import threading
+import time
+
+from sqlalchemy import select
+
+from app.core.config import (ORDER_FEED_BUFFER_SIZE,
+                             ORDER_FEED_REFRESH_SECONDS,
+                             ORDER_FEED_RESEND_IDS, ORDER_STATUS_LABELS)
+from app.core.database import SessionLocal
+from app.models import Order, Product, ProductVariant
+
+
+def _feed_query():
+    return (
+        select(
+            Order.id,
+            Order.created_at,
+            Order.tg_username,
+            Order.points_spent,
+            Order.status,
+            ProductVariant.label,
+            Product.title,
+            Product.shop_type,
+        )
+        .join(
+            ProductVariant, Order.product_variant_id == ProductVariant.id,
+            isouter=True
+        )
+        .join(Product, ProductVariant.product_id == Product.id, isouter=True)
+    )
+
+
+def _row_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "created_at": row.created_at.isoformat() if row.created_at else "",
+        "tg_username": row.tg_username,
+        "points_spent": row.points_spent,
+        "status": row.status,
+        "status_label": ORDER_STATUS_LABELS.get(row.status, row.status),
+        "variant_label": row.label or "",
+        "product_title": row.title or "",
+        "shop_type": row.shop_type or "",
+    }
+
+
+# One buffer per process: the database is polled at most once per
+# refresh interval no matter how many admin tabs are asking for updates.
+class OrderFeed:
+    def __init__(self, refresh_seconds: float, buffer_size: int,
+                 resend_ids: int = ORDER_FEED_RESEND_IDS) -> None:
+        self.refresh_seconds = refresh_seconds
+        self.buffer_size = buffer_size
+        self.resend_ids = resend_ids
+        self._rows: list[dict] = []
+        self._last_id = 0
+        # Orders at or below this id are no longer in the buffer.
+        self._floor_id = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        # The newest orders are re-read as a whole instead of only the ids
+        # above the last one seen: Postgres hands out ids before commit, so
+        # a lower id can become visible after higher ones, and statuses
+        # change after an order was first seen.
+        with SessionLocal() as db:
+            rows = db.execute(
+                _feed_query().order_by(Order.id.desc()).limit(
+                    self.buffer_size
+                )
+            ).all()
+        rows.reverse()
+        if len(rows) == self.buffer_size:
+            self._floor_id = max(self._floor_id, rows[0].id - 1)
+        self._rows = [_row_to_dict(row) for row in rows]
+        self._last_id = max(self._last_id, rows[-1].id if rows else 0)
+
+    def _maybe_refresh(self) -> None:
+        if time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+                self._refresh()
+                self._refreshed_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def since(self, since_id: int) -> tuple[list[dict], int, bool]:
+        # reset is True when orders newer than since_id were already pushed
+        # out of the buffer; the client has to reload instead of skipping
+        # them.
+        self._maybe_refresh()
+        if since_id < self._floor_id:
+            return [], self._last_id, True
+        # Rows just below since_id are sent again; the client replaces the
+        # ones it already shows.
+        resend_from = since_id - self.resend_ids
+        rows = [row for row in self._rows if row["id"] > resend_from]
+        last_id = max(since_id, self._last_id)
+        return rows, last_id, False
+
+
+order_feed = OrderFeed(ORDER_FEED_REFRESH_SECONDS, ORDER_FEED_BUFFER_SIZE)
@@ -2,8 +2,15 @@ import urllib.parse
 from datetime import date, datetime, time
 from typing import Optional
 
-from app.core.config import ORDER_STATUSES
-from app.models import Order
+from sqlalchemy import (false, func, select, true, tuple_, union_all,
+                        update)
+from sqlalchemy.orm import Session
+
+from app.core.config import (ORDER_ARCHIVE_STATUSES, ORDER_STATUS_LABELS,
+                             ORDER_STATUS_TRANSITIONS, ORDER_STATUSES)
+from app.models import (Order, OrderArchive, Product, ProductVariant,
+                        VariantCode)
+from app.services.sales import record_status_change
 
 
 def parse_date_input(
@@ -26,6 +33,7 @@ def build_order_filters(
     status_filter: Optional[str],
     date_from: Optional[str],
     date_to: Optional[str],
+    model=Order,
 ) -> tuple[list, Optional[str], Optional[datetime], Optional[datetime]]:
     filters: list = []
     resolved_status = status_filter if (
@@ -34,19 +42,214 @@ def build_order_filters(
     start_dt = parse_date_input(date_from, end_of_day=False)
     end_dt = parse_date_input(date_to, end_of_day=True)
     if resolved_status:
-        filters.append(Order.status == resolved_status)
+        filters.append(model.status == resolved_status)
     if start_dt:
-        filters.append(Order.created_at >= start_dt)
+        filters.append(model.created_at >= start_dt)
     if end_dt:
-        filters.append(Order.created_at <= end_dt)
+        filters.append(model.created_at <= end_dt)
     return filters, resolved_status, start_dt, end_dt
 
 
-def build_export_url(
+def archive_reached(
+    db: Session,
+    resolved_status: Optional[str],
+    start_dt: Optional[datetime],
+) -> bool:
+    if resolved_status and resolved_status not in ORDER_ARCHIVE_STATUSES:
+        return False
+    newest = db.execute(select(func.max(OrderArchive.created_at))).scalar()
+    if newest is None:
+        return False
+    return start_dt is None or start_dt <= newest
+
+
+def _order_columns(model, archived: bool) -> list:
+    return [
+        model.id,
+        model.tg_username,
+        model.product_variant_id,
+        model.points_spent,
+        model.status,
+        model.created_at,
+        (true() if archived else false()).label("archived"),
+    ]
+
+
+def build_orders_query(
+    db: Session,
     status_filter: Optional[str],
     date_from: Optional[str],
     date_to: Optional[str],
-) -> str:
+    limit: Optional[int] = None,
+):
+    # Orders newest first, joined with their variant and product, from the
+    # hot table plus orders_archive when the filter reaches into it. Rows
+    # expose the order columns, "archived", "variant_label", "product_title"
+    # and "shop_type".
+    filters, resolved_status, start_dt, _ = build_order_filters(
+        status_filter, date_from, date_to
+    )
+    arms = [(Order, filters, False)]
+    if archive_reached(db, resolved_status, start_dt):
+        archive_filters, _, _, _ = build_order_filters(
+            status_filter, date_from, date_to, model=OrderArchive
+        )
+        arms.append((OrderArchive, archive_filters, True))
+    selects = []
+    for model, model_filters, archived in arms:
+        arm = select(*_order_columns(model, archived)).where(*model_filters)
+        if limit is not None:
+            # Each arm is limited on its own index before the merge.
+            arm = select(
+                arm.order_by(model.created_at.desc()).limit(limit).subquery()
+            )
+        selects.append(arm)
+    source = (
+        union_all(*selects) if len(selects) > 1 else selects[0]
+    ).subquery("all_orders")
+    query = (
+        select(
+            source,
+            ProductVariant.label.label("variant_label"),
+            Product.title.label("product_title"),
+            Product.shop_type.label("shop_type"),
+        )
+        .join(
+            ProductVariant,
+            source.c.product_variant_id == ProductVariant.id,
+            isouter=True,
+        )
+        .join(Product, ProductVariant.product_id == Product.id, isouter=True)
+        .order_by(source.c.created_at.desc(), source.c.id.desc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return query, filters, resolved_status
+
+
+def change_order_status(db: Session, new_status: str, selection: list) -> list[int]:
+    # Moves every order matching selection whose current status allows it
+    # and returns the changed ids. One set-based UPDATE ... RETURNING per
+    # source status, so the old status of each returned row is known for
+    # sales_daily; rows are locked in id order and re-checked after any
+    # wait, so concurrent changes never move the same order twice.
+    changed: list[tuple] = []
+    for old_status in sorted(
+        status for status, targets in ORDER_STATUS_TRANSITIONS.items()
+        if new_status in targets
+    ):
+        locked = (
+            select(Order.id)
+            .where(Order.status == old_status, *selection)
+            .order_by(Order.id)
+            .with_for_update()
+        )
+        rows = db.execute(
+            update(Order)
+            .where(Order.id.in_(locked), Order.status == old_status)
+            .values(status=new_status)
+            .returning(Order.id, Order.created_at, Order.product_variant_id,
+                       Order.points_spent)
+            .execution_options(synchronize_session=False)
+        ).all()
+        changed.extend((row, old_status) for row in rows)
+    record_status_change(
+        db,
+        [
+            (row.created_at, row.product_variant_id, row.points_spent, old)
+            for row, old in changed
+        ],
+        new_status,
+    )
+    return sorted(row.id for row, _ in changed)
+
+
+def encode_order_cursor(created_at: datetime, order_id: int) -> str:
+    return f"{created_at.isoformat()}~{order_id}"
+
+
+def parse_order_cursor(value: str) -> Optional[tuple[datetime, int]]:
+    created_at, _, order_id = value.partition("~")
+    try:
+        return datetime.fromisoformat(created_at), int(order_id)
+    except ValueError:
+        return None
+
+
+def user_orders_page(
+    db: Session,
+    tg_username: str,
+    before: Optional[tuple[datetime, int]],
+    limit: int,
+) -> tuple[list[dict], Optional[str]]:
+    # One query per page: each table seeks on its
+    # (tg_username, created_at, id) index past the cursor and stops after
+    # limit + 1 rows, so the cost does not grow with the user's history.
+    selects = []
+    for model, archived in ((Order, False), (OrderArchive, True)):
+        arm = select(*_order_columns(model, archived)).where(
+            model.tg_username == tg_username
+        )
+        if before is not None:
+            arm = arm.where(tuple_(model.created_at, model.id) < before)
+        selects.append(
+            select(
+                arm.order_by(model.created_at.desc(), model.id.desc())
+                .limit(limit + 1)
+                .subquery()
+            )
+        )
+    source = union_all(*selects).subquery("user_orders")
+    rows = db.execute(
+        select(
+            source,
+            ProductVariant.label.label("variant_label"),
+            Product.title.label("product_title"),
+            Product.shop_type.label("shop_type"),
+            VariantCode.code.label("code"),
+        )
+        .join(
+            ProductVariant,
+            source.c.product_variant_id == ProductVariant.id,
+            isouter=True,
+        )
+        .join(Product, ProductVariant.product_id == Product.id, isouter=True)
+        # Orders with a code are never archived (see services/archive.py).
+        .join(
+            VariantCode,
+            (VariantCode.order_id == source.c.id) & ~source.c.archived,
+            isouter=True,
+        )
+        .order_by(source.c.created_at.desc(), source.c.id.desc())
+        .limit(limit + 1)
+    ).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_order_cursor(rows[-1].created_at, rows[-1].id)
+    orders = [
+        {
+            "id": row.id,
+            "created_at": row.created_at,
+            "points_spent": row.points_spent,
+            "status": row.status,
+            "status_label": ORDER_STATUS_LABELS.get(row.status, row.status),
+            "variant_label": row.variant_label or "",
+            "product_title": row.product_title or "",
+            "shop_type": row.shop_type or "",
+            "archived": bool(row.archived),
+            "code": row.code,
+        }
+        for row in rows
+    ]
+    return orders, next_cursor
+
+
+def _filter_params(
+    status_filter: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+) -> dict:
     params = {}
     if status_filter:
         params["status"] = status_filter
@@ -54,5 +257,28 @@ def build_export_url(
         params["date_from"] = date_from
     if date_to:
         params["date_to"] = date_to
-    query = urllib.parse.urlencode(params)
+    return params
+
+
+def build_export_url(
+    status_filter: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+) -> str:
+    query = urllib.parse.urlencode(
+        _filter_params(status_filter, date_from, date_to)
+    )
     return f"/admin/orders/export?{query}" if query else "/admin/orders/export"
+
+
+def build_dashboard_url(
+    status_filter: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    **extra,
+) -> str:
+    params = _filter_params(status_filter, date_from, date_to)
+    params.update({key: value for key, value in extra.items()
+                   if value is not None})
+    query = urllib.parse.urlencode(params)
+    return f"/admin?{query}" if query else "/admin"
@@ -0,0 +1,281 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import func, insert, literal, select, text, update
+from sqlalchemy.orm import Session
+
+from app.core.config import POINTS_FOLD_SECONDS
+from app.core.database import WriteSessionLocal
+from app.models import Order, PointsLedger, PointsSnapshot, User
+
+logger = logging.getLogger("app.points")
+
+
+# Every writer that changes users.points takes the locks in the same order:
+# the user row, then that user's pending ledger rows.
+def lock_user(db: Session, user_id: int) -> None:
+    if db.get_bind().dialect.name == "sqlite":
+        # SQLite ignores FOR UPDATE; its database write lock already
+        # serializes these writers, so the SELECT would only cost a query.
+        return
+    db.execute(
+        select(User.id).where(User.id == user_id).with_for_update()
+    ).all()
+
+
+def fold_pending(db: Session, user_id: int) -> int:
+    # Claims the user's unapplied credits and returns their sum; the caller
+    # adds it to users.points in the same transaction.
+    deltas = db.execute(
+        update(PointsLedger)
+        .where(PointsLedger.user_id == user_id,
+               PointsLedger.applied.is_(False))
+        .values(applied=True)
+        .returning(PointsLedger.delta)
+    ).scalars().all()
+    return sum(deltas)
+
+
+def record_order_debits(db: Session, user_id: int,
+                        orders: Iterable[Order]) -> None:
+    db.execute(
+        insert(PointsLedger),
+        [
+            {"user_id": user_id, "delta": -order.points_spent,
+             "reason": "order", "order_id": order.id, "applied": True}
+            for order in orders
+        ],
+    )
+
+
+def credit_points(db: Session, user_ids: Iterable[int], amount: int,
+                  reason: Optional[str]) -> int:
+    # Inserts only, so a bulk credit never waits on a buyer's row lock.
+    # Folding adds these without a balance check, so amount must be
+    # positive; debits go through set_points.
+    if amount <= 0:
+        raise ValueError("credit amount must be positive")
+    rows = [
+        {"user_id": user_id, "delta": amount, "reason": reason,
+         "applied": False}
+        for user_id in user_ids
+    ]
+    if rows:
+        db.execute(insert(PointsLedger), rows)
+    return len(rows)
+
+
+def set_points(db: Session, user: User, points: int,
+               reason: Optional[str]) -> None:
+    lock_user(db, user.id)
+    pending = fold_pending(db, user.id)
+    current = db.execute(
+        select(User.points).where(User.id == user.id)
+    ).scalar_one() + pending
+    db.execute(
+        update(User).where(User.id == user.id).values(points=points)
+    )
+    if points != current:
+        db.add(
+            PointsLedger(user_id=user.id, delta=points - current,
+                         reason=reason, applied=True)
+        )
+
+
+def pending_credits(db: Session, user_ids: Iterable[int]) -> dict[int, int]:
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    return dict(
+        db.execute(
+            select(PointsLedger.user_id, func.sum(PointsLedger.delta))
+            .where(PointsLedger.user_id.in_(user_ids),
+                   PointsLedger.applied.is_(False))
+            .group_by(PointsLedger.user_id)
+        ).all()
+    )
+
+
+def user_with_pending_credits(db: Session,
+                              tg_username: Optional[str]) -> Optional[User]:
+    # Shop pages show the balance with pending credits, so the user row and
+    # the sum of their unapplied ledger rows come back in one query.
+    if not tg_username:
+        return None
+    pending = (
+        select(func.coalesce(func.sum(PointsLedger.delta), 0))
+        .where(PointsLedger.user_id == User.id,
+               PointsLedger.applied.is_(False))
+        .correlate(User)
+        .scalar_subquery()
+    )
+    row = db.execute(
+        select(User, pending).where(User.tg_username == tg_username)
+    ).first()
+    if row is None:
+        return None
+    user, user.pending_points = row
+    return user
+
+
+def ledger_balances(db: Session, user_ids: Iterable[int]) -> dict[int, int]:
+    # Snapshot plus the tail of the ledger after it.
+    user_ids = list(user_ids)
+    balances = {user_id: 0 for user_id in user_ids}
+    snapshots = {
+        snapshot.user_id: snapshot
+        for snapshot in db.execute(
+            select(PointsSnapshot).where(PointsSnapshot.user_id.in_(user_ids))
+        ).scalars()
+    }
+    for user_id, snapshot in snapshots.items():
+        balances[user_id] = snapshot.balance
+    tail = db.execute(
+        select(PointsLedger.user_id, func.sum(PointsLedger.delta))
+        .outerjoin(PointsSnapshot,
+                   PointsSnapshot.user_id == PointsLedger.user_id)
+        .where(
+            PointsLedger.user_id.in_(user_ids),
+            PointsLedger.id > func.coalesce(PointsSnapshot.ledger_id, 0),
+        )
+        .group_by(PointsLedger.user_id)
+    ).all()
+    for user_id, delta in tail:
+        balances[user_id] += delta
+    return balances
+
+
+def ensure_opening_snapshots(db: Session) -> None:
+    # Points that existed before the ledger become each user's opening
+    # snapshot, so balance = snapshot + tail holds from the start.
+    has_history = select(PointsLedger.id).where(
+        PointsLedger.user_id == User.id
+    ).exists()
+    has_snapshot = select(PointsSnapshot.user_id).where(
+        PointsSnapshot.user_id == User.id
+    ).exists()
+    db.execute(
+        insert(PointsSnapshot).from_select(
+            ["user_id", "balance", "ledger_id", "taken_at"],
+            select(
+                User.id, User.points, literal(0),
+                func.coalesce(User.created_at, datetime.utcnow()),
+            ).where(User.points != 0, ~has_history, ~has_snapshot),
+        )
+    )
+
+
+def fold_user(user_id: int) -> int:
+    with WriteSessionLocal() as db:
+        lock_user(db, user_id)
+        pending = fold_pending(db, user_id)
+        if pending:
+            db.execute(
+                update(User).where(User.id == user_id)
+                .values(points=User.points + pending)
+            )
+        db.commit()
+    return pending
+
+
+def fold_all_pending(batch_size: int = 200) -> int:
+    # One short transaction per user, so buyers wait on at most one of them.
+    folded = 0
+    while True:
+        with WriteSessionLocal() as db:
+            user_ids = db.execute(
+                select(PointsLedger.user_id)
+                .where(PointsLedger.applied.is_(False))
+                .distinct()
+                .limit(batch_size)
+            ).scalars().all()
+        if not user_ids:
+            return folded
+        for user_id in user_ids:
+            fold_user(user_id)
+            folded += 1
+
+
+def compact_ledger() -> tuple[int, list[tuple[str, int, int]]]:
+    # Folds every pending credit, moves each user's snapshot up to the
+    # newest ledger row and reports users whose cached points disagree with
+    # the ledger.
+    fold_all_pending()
+    with WriteSessionLocal() as db:
+        if db.get_bind().dialect.name == "postgresql":
+            # Waits for in-flight ledger writers, so no row below upto can
+            # still commit after the snapshot skips past it.
+            db.execute(text("LOCK TABLE points_ledger IN SHARE MODE"))
+        upto = db.execute(select(func.max(PointsLedger.id))).scalar() or 0
+        tails = db.execute(
+            select(PointsLedger.user_id, func.sum(PointsLedger.delta))
+            .outerjoin(PointsSnapshot,
+                       PointsSnapshot.user_id == PointsLedger.user_id)
+            .where(
+                PointsLedger.id > func.coalesce(PointsSnapshot.ledger_id, 0),
+                PointsLedger.id <= upto,
+            )
+            .group_by(PointsLedger.user_id)
+        ).all()
+        snapshots = {
+            snapshot.user_id: snapshot
+            for snapshot in db.execute(
+                select(PointsSnapshot).where(
+                    PointsSnapshot.user_id.in_([row[0] for row in tails])
+                )
+            ).scalars()
+        }
+        now = datetime.utcnow()
+        for user_id, delta in tails:
+            snapshot = snapshots.get(user_id)
+            if snapshot is None:
+                db.add(PointsSnapshot(user_id=user_id, balance=delta,
+                                      ledger_id=upto, taken_at=now))
+            else:
+                snapshot.balance += delta
+                snapshot.ledger_id = upto
+                snapshot.taken_at = now
+        db.commit()
+
+        drift = []
+        users = db.execute(select(User.id, User.tg_username, User.points)).all()
+        balances = ledger_balances(db, [row.id for row in users])
+        pending = pending_credits(db, [row.id for row in users])
+        for row in users:
+            expected = balances[row.id] - pending.get(row.id, 0)
+            if row.points != expected:
+                drift.append((row.tg_username, row.points, expected))
+    return len(tails), drift
+
+
+class PointsFolder:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or (
+            self._thread is not None and self._thread.is_alive()
+        ):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="points-folder", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                fold_all_pending()
+            except Exception:
+                logger.exception("folding pending credits failed")
+
+
+points_folder = PointsFolder(POINTS_FOLD_SECONDS)
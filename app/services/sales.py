@@ -0,0 +1,226 @@
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import case, delete, func, insert, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.core.database import WriteSessionLocal
+from app.core.time import local_day, local_now
+from app.models import (Order, OrderArchive, Product, ProductVariant,
+                        SalesDaily)
+
+SalesDeltas = dict[tuple[date, int, str], dict]
+
+
+def add_sale(
+    deltas: SalesDeltas,
+    created_at: datetime,
+    variant_id: int,
+    status: str,
+    orders: int,
+    points: int,
+    product_id: Optional[int] = None,
+    shop_type: Optional[str] = None,
+) -> None:
+    entry = deltas.setdefault(
+        (local_day(created_at), variant_id, status),
+        {"product_id": product_id, "shop_type": shop_type, "orders": 0,
+         "points": 0},
+    )
+    entry["orders"] += orders
+    entry["points"] += points
+
+
+def apply_sales(db: Session, deltas: SalesDeltas) -> None:
+    if not deltas:
+        return
+    # Sorted keys give concurrent writers the same row lock order.
+    rows = [
+        {
+            "day": day,
+            "product_variant_id": variant_id,
+            "status": status,
+            **entry,
+        }
+        for (day, variant_id, status), entry in sorted(deltas.items())
+        if entry["orders"] or entry["points"]
+    ]
+    if not rows:
+        return
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else (
+        sqlite
+    )
+    statement = dialect.insert(SalesDaily).values(rows)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=["day", "product_variant_id", "status"],
+            set_={
+                "orders": SalesDaily.orders + statement.excluded.orders,
+                "points": SalesDaily.points + statement.excluded.points,
+                "product_id": func.coalesce(
+                    statement.excluded.product_id, SalesDaily.product_id
+                ),
+                "shop_type": func.coalesce(
+                    statement.excluded.shop_type, SalesDaily.shop_type
+                ),
+            },
+        )
+    )
+
+
+def record_new_orders(db: Session, orders: Iterable[Order],
+                      catalog: dict[int, tuple[int, str]]) -> None:
+    # catalog maps variant id -> (product id, shop type).
+    deltas: SalesDeltas = {}
+    for order in orders:
+        product_id, shop_type = catalog.get(
+            order.product_variant_id, (None, None)
+        )
+        add_sale(
+            deltas, order.created_at or datetime.utcnow(),
+            order.product_variant_id, order.status or "new", 1,
+            order.points_spent, product_id, shop_type,
+        )
+    apply_sales(db, deltas)
+
+
+def record_status_change(db: Session, orders: Iterable, new_status: str) -> None:
+    # orders yields (created_at, product_variant_id, points_spent, old_status)
+    # as they were before the change.
+    orders = [order for order in orders if order[3] != new_status]
+    if not orders:
+        return
+    catalog = variant_catalog(db, {order[1] for order in orders})
+    deltas: SalesDeltas = {}
+    for created_at, variant_id, points, old_status in orders:
+        product_id, shop_type = catalog.get(variant_id, (None, None))
+        add_sale(deltas, created_at, variant_id, old_status, -1, -points)
+        add_sale(deltas, created_at, variant_id, new_status, 1, points,
+                 product_id, shop_type)
+    apply_sales(db, deltas)
+
+
+def variant_catalog(db: Session, variant_ids) -> dict[int, tuple[int, str]]:
+    if not variant_ids:
+        return {}
+    rows = db.execute(
+        select(ProductVariant.id, Product.id, Product.shop_type)
+        .join(Product, ProductVariant.product_id == Product.id)
+        .where(ProductVariant.id.in_(variant_ids))
+    ).all()
+    return {variant_id: (product_id, shop) for variant_id, product_id, shop in rows}
+
+
+def rebuild_sales(batch_size: int = 1000) -> int:
+    with WriteSessionLocal() as db:
+        if db.get_bind().dialect.name == "postgresql":
+            # Checkouts that upsert meanwhile wait for this transaction and
+            # then add on top of the rebuilt rows; earlier ones are read.
+            db.execute(text("LOCK TABLE sales_daily IN EXCLUSIVE MODE"))
+        source = union_all(
+            select(Order.created_at, Order.product_variant_id,
+                   Order.points_spent, Order.status),
+            select(OrderArchive.created_at, OrderArchive.product_variant_id,
+                   OrderArchive.points_spent, OrderArchive.status),
+        ).subquery()
+        deltas: SalesDeltas = {}
+        result = db.execute(
+            select(source, Product.id, Product.shop_type)
+            .join(ProductVariant,
+                  source.c.product_variant_id == ProductVariant.id,
+                  isouter=True)
+            .join(Product, ProductVariant.product_id == Product.id,
+                  isouter=True)
+            .execution_options(yield_per=batch_size)
+        )
+        for created_at, variant_id, points, status, product_id, shop in result:
+            add_sale(deltas, created_at, variant_id, status, 1, points,
+                     product_id, shop)
+        db.execute(delete(SalesDaily))
+        rows = [
+            {"day": day, "product_variant_id": variant_id, "status": status,
+             **entry}
+            for (day, variant_id, status), entry in sorted(deltas.items())
+        ]
+        for start in range(0, len(rows), batch_size):
+            db.execute(insert(SalesDaily), rows[start:start + batch_size])
+        db.commit()
+    return len(rows)
+
+
+def sales_summary(db: Session, days: int = 14, top: int = 20) -> dict:
+    # Reads only sales_daily, so the cost follows days x variants, not the
+    # number of orders.
+    live = SalesDaily.status != "cancelled"
+    orders_sum = func.sum(case((live, SalesDaily.orders), else_=0))
+    points_sum = func.sum(case((live, SalesDaily.points), else_=0))
+    cancelled_sum = func.sum(
+        case((SalesDaily.status == "cancelled", SalesDaily.orders), else_=0)
+    )
+
+    by_shop = [
+        {"shop_type": shop or "—", "orders": orders or 0,
+         "points": points or 0, "cancelled": cancelled or 0}
+        for shop, orders, points, cancelled in db.execute(
+            select(SalesDaily.shop_type, orders_sum, points_sum, cancelled_sum)
+            .group_by(SalesDaily.shop_type)
+            .order_by(SalesDaily.shop_type)
+        )
+    ]
+
+    # Titles and labels ride along on the grouped rows; deleted products and
+    # variants come back as NULL.
+    grouped = (
+        select(SalesDaily.product_id, SalesDaily.product_variant_id,
+               orders_sum.label("orders"), points_sum.label("points"),
+               cancelled_sum.label("cancelled"))
+        .group_by(SalesDaily.product_id, SalesDaily.product_variant_id)
+        .subquery()
+    )
+    product_rows = db.execute(
+        select(grouped, Product.title, ProductVariant.label)
+        .join(Product, Product.id == grouped.c.product_id, isouter=True)
+        .join(ProductVariant,
+              ProductVariant.id == grouped.c.product_variant_id,
+              isouter=True)
+    ).all()
+    products: dict[Optional[int], dict] = {}
+    for (product_id, variant_id, orders, points, cancelled, title,
+         label) in product_rows:
+        entry = products.setdefault(
+            product_id,
+            {"product_id": product_id, "title": title or "Удалённый товар",
+             "orders": 0, "points": 0, "cancelled": 0, "variants": []},
+        )
+        entry["orders"] += orders or 0
+        entry["points"] += points or 0
+        entry["cancelled"] += cancelled or 0
+        entry["variants"].append(
+            {"variant_id": variant_id, "label": label or "—",
+             "orders": orders or 0, "points": points or 0,
+             "cancelled": cancelled or 0}
+        )
+    by_product = sorted(
+        products.values(), key=lambda item: (-item["points"], -item["orders"])
+    )[:top]
+    for item in by_product:
+        item["variants"].sort(key=lambda variant: -variant["points"])
+
+    today = local_now().date()
+    first_day = today - timedelta(days=days - 1)
+    per_day = {
+        day: (orders or 0, points or 0)
+        for day, orders, points in db.execute(
+            select(SalesDaily.day, orders_sum, points_sum)
+            .where(SalesDaily.day >= first_day)
+            .group_by(SalesDaily.day)
+        )
+    }
+    by_day = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        orders, points = per_day.get(day, (0, 0))
+        by_day.append({"day": day, "orders": orders, "points": points})
+
+    return {"by_shop": by_shop, "by_product": by_product, "by_day": by_day}
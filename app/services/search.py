@@ -0,0 +1,238 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import case, column, false, select, text, true, union_all
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.core.config import ORDER_STATUS_LABELS
+from app.models import (AllowlistEntry, Order, OrderArchive, Product,
+                        ProductVariant, User)
+
+logger = logging.getLogger("app.search")
+
+# Trigram indexes only help from three characters on; shorter queries are
+# matched by prefix.
+SUBSTRING_MIN_CHARS = 3
+
+# table -> FTS5 shadow table kept in sync by triggers on SQLite.
+FTS_TABLES = {"users": "users_fts", "allowlist_entries": "allowlist_fts"}
+
+_fts_ready: dict[str, bool] = {}
+
+
+def ensure_search_indexes(db: Session) -> None:
+    # Substring search on tg_username: pg_trgm GIN indexes on Postgres,
+    # FTS5 trigram tables on SQLite. Without either, search falls back to
+    # LIKE, which still works but scans.
+    if db.get_bind().dialect.name == "postgresql":
+        _ensure_prefix_indexes(db)
+        _ensure_trigram_indexes(db)
+    elif db.get_bind().dialect.name == "sqlite":
+        for table, fts in FTS_TABLES.items():
+            _ensure_fts_table(db, table, fts)
+
+
+def _ensure_prefix_indexes(db: Session) -> None:
+    # Under a non-C collation the plain index cannot serve LIKE 'prefix%';
+    # a text_pattern_ops index compares bytes and can.
+    for table in FTS_TABLES:
+        db.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_username_prefix "
+                f"ON {table} (tg_username text_pattern_ops)"
+            )
+        )
+
+
+def _ensure_trigram_indexes(db: Session) -> None:
+    try:
+        with db.begin_nested():
+            db.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for table in FTS_TABLES:
+                db.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_username_trgm "
+                        f"ON {table} USING gin (tg_username gin_trgm_ops)"
+                    )
+                )
+    except DBAPIError:
+        logger.warning("pg_trgm is not available; admin search will scan")
+
+
+def _ensure_fts_table(db: Session, table: str, fts: str) -> None:
+    exists = db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": fts},
+    ).first()
+    if exists:
+        _fts_ready[fts] = True
+        return
+    try:
+        with db.begin_nested():
+            db.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE {fts} USING fts5(tg_username, "
+                    f"content='{table}', content_rowid='id', "
+                    "tokenize='trigram')"
+                )
+            )
+            db.execute(
+                text(
+                    f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+                    f"INSERT INTO {fts}(rowid, tg_username) "
+                    "VALUES (new.id, new.tg_username); END"
+                )
+            )
+            db.execute(
+                text(
+                    f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, tg_username) "
+                    "VALUES ('delete', old.id, old.tg_username); END"
+                )
+            )
+            db.execute(
+                text(
+                    f"CREATE TRIGGER {fts}_au AFTER UPDATE OF tg_username "
+                    f"ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, tg_username) "
+                    "VALUES ('delete', old.id, old.tg_username); "
+                    f"INSERT INTO {fts}(rowid, tg_username) "
+                    "VALUES (new.id, new.tg_username); END"
+                )
+            )
+            db.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        _fts_ready[fts] = True
+    except DBAPIError:
+        # Built without FTS5 or older than 3.34 (no trigram tokenizer).
+        logger.warning("FTS5 trigram is not available; admin search will scan")
+
+
+def _fts_available(db: Session, fts: str) -> bool:
+    if fts not in _fts_ready:
+        _fts_ready[fts] = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+            {"name": fts},
+        ).first() is not None
+    return _fts_ready[fts]
+
+
+def _prefix_bounds(prefix: str) -> tuple[str, str]:
+    # A range on the plain tg_username index instead of LIKE, which SQLite
+    # will not run through an index by default. Only right under a byte-order
+    # collation, which is SQLite's BINARY default.
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _escape_like(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    )
+
+
+def _username_match(db: Session, model, needle: str):
+    # Returns (where clause, prefix-first sort key) for model.tg_username.
+    if db.get_bind().dialect.name == "postgresql":
+        # Postgres sorts by the database collation, where the range can
+        # miss or over-match; LIKE uses the text_pattern_ops index instead.
+        is_prefix = model.tg_username.like(
+            f"{_escape_like('@' + needle)}%", escape="\\"
+        )
+    else:
+        low, high = _prefix_bounds("@" + needle)
+        is_prefix = (model.tg_username >= low) & (model.tg_username < high)
+    if len(needle) < SUBSTRING_MIN_CHARS:
+        return is_prefix, model.tg_username
+    fts = FTS_TABLES[model.__tablename__]
+    if db.get_bind().dialect.name == "sqlite" and _fts_available(db, fts):
+        quoted = '"' + needle.replace('"', '""') + '"'
+        matched = text(
+            f"SELECT rowid FROM {fts} WHERE {fts} MATCH :pattern"
+        ).bindparams(pattern=quoted).columns(column("rowid"))
+        where = model.id.in_(matched)
+    else:
+        where = model.tg_username.like(
+            f"%{_escape_like(needle)}%", escape="\\"
+        )
+    return where, case((is_prefix, 0), else_=1)
+
+
+def normalize_query(raw: Optional[str]) -> str:
+    return (raw or "").strip().lower().lstrip("@")
+
+
+def admin_search(db: Session, raw_query: Optional[str], limit: int) -> dict:
+    needle = normalize_query(raw_query)
+    if not needle:
+        return {"query": "", "users": [], "allowlist": [], "orders": []}
+
+    where, order = _username_match(db, User, needle)
+    users = db.execute(
+        select(User).where(where).order_by(order, User.tg_username)
+        .limit(limit)
+    ).scalars().all()
+
+    where, order = _username_match(db, AllowlistEntry, needle)
+    allowlist = db.execute(
+        select(AllowlistEntry).where(where)
+        .order_by(order, AllowlistEntry.tg_username, AllowlistEntry.shop_type)
+        .limit(limit)
+    ).scalars().all()
+
+    # Orders are found through the matched usernames, so they ride the
+    # (tg_username, created_at, id) index instead of scanning orders.
+    usernames = sorted(
+        {user.tg_username for user in users}
+        | {entry.tg_username for entry in allowlist}
+    )
+    orders = []
+    if usernames:
+        selects = []
+        for model, archived in ((Order, False), (OrderArchive, True)):
+            selects.append(
+                select(
+                    select(
+                        model.id, model.tg_username, model.product_variant_id,
+                        model.points_spent, model.status, model.created_at,
+                        (true() if archived else false()).label("archived"),
+                    )
+                    .where(model.tg_username.in_(usernames))
+                    .order_by(model.created_at.desc())
+                    .limit(limit)
+                    .subquery()
+                )
+            )
+        source = union_all(*selects).subquery("matched_orders")
+        orders = [
+            {
+                "id": row.id,
+                "tg_username": row.tg_username,
+                "points_spent": row.points_spent,
+                "status": row.status,
+                "status_label": ORDER_STATUS_LABELS.get(row.status, row.status),
+                "created_at": row.created_at,
+                "archived": bool(row.archived),
+                "variant_label": row.label or "",
+                "product_title": row.title or "",
+            }
+            for row in db.execute(
+                select(source, ProductVariant.label, Product.title)
+                .join(
+                    ProductVariant,
+                    source.c.product_variant_id == ProductVariant.id,
+                    isouter=True,
+                )
+                .join(
+                    Product, ProductVariant.product_id == Product.id,
+                    isouter=True,
+                )
+                .order_by(source.c.created_at.desc(), source.c.id.desc())
+                .limit(limit)
+            )
+        ]
+    return {
+        "query": needle,
+        "users": users,
+        "allowlist": allowlist,
+        "orders": orders,
+    }
@@ -1,34 +1,90 @@
-import shutil
+import hashlib
+import os
 import uuid
 from pathlib import Path
 from typing import Optional
 
+import anyio
 from fastapi import HTTPException, UploadFile
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
 
-from app.core.config import ALLOWED_IMAGE_EXTS, UPLOAD_DIR
+from app.core.config import ALLOWED_IMAGE_EXTS, UPLOAD_DIR, UPLOAD_MAX_BYTES
+from app.models import Product
 
+CHUNK_BYTES = 64 * 1024
 
-def save_image_upload(image_file: Optional[UploadFile]) -> Optional[str]:
+
+def sniff_image_ext(head: bytes) -> Optional[str]:
+    # The client's filename and Content-Type are not trusted; the stored
+    # extension comes from the file signature.
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis"):
+        return ".avif"
+    return None
+
+
+async def save_image_upload(
+    image_file: Optional[UploadFile],
+) -> Optional[str]:
     if not image_file or not image_file.filename:
         return None
-    if image_file.content_type and not image_file.content_type.startswith(
-        "image/"
-    ):
-        raise HTTPException(status_code=400, detail="Нужна картинка (image/*)")
-    ext = Path(image_file.filename).suffix.lower()
-    if not ext or ext not in ALLOWED_IMAGE_EXTS:
-        raise HTTPException(
-            status_code=400,
-            detail="Формат изображения: JPG, PNG, WebP, GIF, AVIF",
-        )
     UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-    filename = f"{uuid.uuid4().hex}{ext}"
-    destination = UPLOAD_DIR / filename
-    with destination.open("wb") as buffer:
-        shutil.copyfileobj(image_file.file, buffer)
+    # Written next to the destination so the final rename is atomic.
+    temp_path = UPLOAD_DIR / f".upload-{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    try:
+        async with await anyio.open_file(temp_path, "wb") as buffer:
+            while chunk := await image_file.read(CHUNK_BYTES):
+                if ext is None:
+                    ext = sniff_image_ext(chunk[:32])
+                    if ext is None or ext not in ALLOWED_IMAGE_EXTS:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="Формат изображения: JPG, PNG, WebP, GIF, AVIF",
+                        )
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=(
+                            "Картинка больше "
+                            f"{round(UPLOAD_MAX_BYTES / 1024 / 1024, 1):g} МБ"
+                        ),
+                    )
+                digest.update(chunk)
+                await buffer.write(chunk)
+        if ext is None:
+            raise HTTPException(status_code=400, detail="Пустой файл")
+        # Named by content, so re-uploading the same picture reuses the file.
+        filename = f"{digest.hexdigest()[:32]}{ext}"
+        await anyio.to_thread.run_sync(
+            os.replace, temp_path, UPLOAD_DIR / filename
+        )
+    finally:
+        temp_path.unlink(missing_ok=True)
     return f"/static/uploads/{filename}"
 
 
+def image_shared(db: Session, image_url: str, product_id: int) -> bool:
+    return bool(
+        db.scalar(
+            select(func.count(Product.id)).where(
+                Product.image_url == image_url, Product.id != product_id
+            )
+        )
+    )
+
+
 def delete_image_file(image_url: Optional[str]) -> None:
     if not image_url or not image_url.startswith("/static/uploads/"):
         return
@@ -0,0 +1,148 @@
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.config import WAITING_ROOM_BURST, WAITING_ROOM_DEFAULT_RATE
+from app.models import ShopSettings
+
+SESSION_KEY = "queue"
+
+
+@dataclass
+class QueueState:
+    enabled: bool = False
+    rate: int = WAITING_ROOM_DEFAULT_RATE
+    opens_at: Optional[datetime] = None
+    closes_at: Optional[datetime] = None
+    issued: int = 0
+    admitted: int = 0
+    waiting_hits: int = 0
+    admitted_hits: int = 0
+    window: str = field(default="")
+
+
+# Admission is decided from the in-memory copy of the shop window and the
+# ticket stored in the signed session cookie, so a waiting user never costs
+# a database round trip. Tickets are admitted at ``rate`` per second counted
+# from ``opens_at``, plus an initial burst.
+class WaitingRoom:
+    def __init__(self) -> None:
+        self._states: dict[str, QueueState] = {}
+        self._lock = threading.Lock()
+        # Tickets are numbered per process. With several server workers
+        # each one admits its share of the rate, which keeps the total close
+        # to the configured rate as long as connections are spread evenly.
+        self.workers = 1
+
+    def load(self, db: Session) -> None:
+        rows = db.execute(select(ShopSettings)).scalars().all()
+        for settings in rows:
+            self.configure(settings)
+
+    def configure(self, settings: ShopSettings) -> None:
+        window = settings.opens_at.isoformat() if settings.opens_at else ""
+        with self._lock:
+            state = self._states.get(settings.shop_type)
+            if state is None or state.window != window:
+                state = QueueState(window=window)
+                self._states[settings.shop_type] = state
+            state.enabled = bool(settings.queue_enabled)
+            state.rate = settings.queue_rate or WAITING_ROOM_DEFAULT_RATE
+            state.opens_at = settings.opens_at
+            state.closes_at = settings.closes_at
+
+    def _active_state(
+        self, shop_type: str, now: datetime
+    ) -> Optional[QueueState]:
+        state = self._states.get(shop_type)
+        if not state or not state.enabled:
+            return None
+        if not state.opens_at or not state.closes_at:
+            return None
+        if not state.opens_at <= now <= state.closes_at:
+            return None
+        return state
+
+    def _admitted_upto(self, state: QueueState, now: datetime) -> int:
+        elapsed = max(0.0, (now - state.opens_at).total_seconds())
+        return (
+            WAITING_ROOM_BURST + int(elapsed * state.rate)
+        ) // max(1, self.workers)
+
+    def check(
+        self, request: Request, shop_type: str, now: datetime
+    ) -> Optional[dict]:
+        state = self._active_state(shop_type, now)
+        if state is None:
+            return None
+        tickets = dict(request.session.get(SESSION_KEY) or {})
+        ticket = tickets.get(shop_type)
+        with self._lock:
+            if not ticket or ticket.get("window") != state.window:
+                state.issued += 1
+                ticket = {"position": state.issued, "window": state.window}
+                tickets[shop_type] = ticket
+                request.session[SESSION_KEY] = tickets
+            admitted_upto = self._admitted_upto(state, now)
+            if ticket["position"] <= admitted_upto:
+                if not ticket.get("admitted"):
+                    ticket["admitted"] = True
+                    tickets[shop_type] = ticket
+                    request.session[SESSION_KEY] = tickets
+                    state.admitted += 1
+                state.admitted_hits += 1
+                return None
+            state.waiting_hits += 1
+        ahead = ticket["position"] - admitted_upto
+        return {
+            "position": ticket["position"],
+            "ahead": ahead,
+            "eta_seconds": max(
+                1, ahead * max(1, self.workers) // max(1, state.rate)
+            ),
+        }
+
+    def check_early(
+        self, request: Request, shop_type: Optional[str], now: datetime
+    ) -> Optional[dict]:
+        # Runs before the handler touches the database, so queued clients
+        # are turned away for free. The shop comes from the request body;
+        # without one, any shop the session already waits for counts. The
+        # handler still calls check() once the real shop type is loaded.
+        if shop_type:
+            return self.check(request, shop_type, now)
+        tickets = request.session.get(SESSION_KEY) or {}
+        for queued_shop, ticket in tickets.items():
+            if ticket.get("admitted"):
+                continue
+            waiting = self.check(request, queued_shop, now)
+            if waiting is not None:
+                return waiting
+        return None
+
+    def stats(self, now: datetime) -> dict:
+        with self._lock:
+            return {
+                shop_type: {
+                    "enabled": state.enabled,
+                    "active": self._active_state(shop_type, now) is not None,
+                    "rate": state.rate,
+                    "tickets_issued": state.issued,
+                    "tickets_admitted": state.admitted,
+                    "admitted_upto": (
+                        self._admitted_upto(state, now)
+                        if state.opens_at else 0
+                    ),
+                    "waiting_responses": state.waiting_hits,
+                    "admitted_responses": state.admitted_hits,
+                }
+                for shop_type, state in self._states.items()
+            }
+
+
+waiting_room = WaitingRoom()
@@ -0,0 +1,175 @@
+const ordersList = document.getElementById("orders-list");
+
+const createEl = (tag, className, text) => {
+  const el = document.createElement(tag);
+  if (className) el.className = className;
+  if (text !== undefined) el.textContent = text;
+  return el;
+};
+
+const buildOrderRow = (order, statuses, transitions) => {
+  const row = createEl("div", "list__row list__row--stack");
+  row.dataset.orderId = order.id;
+  row.dataset.status = order.status;
+  const main = createEl("div", "list__main");
+  const pick = createEl("input");
+  pick.type = "checkbox";
+  pick.name = "order_ids";
+  pick.value = order.id;
+  pick.setAttribute("form", "bulk-status");
+  main.append(
+    pick,
+    createEl("strong", "", order.product_title || "Товар"),
+    createEl("span", "muted", order.variant_label),
+    createEl("span", "pill pill--muted", `${order.points_spent} баллов`),
+    createEl("span", "muted", order.tg_username)
+  );
+
+  const form = createEl("form", "form form--inline");
+  form.method = "post";
+  form.action = "/admin/order/status";
+  const idInput = createEl("input");
+  idInput.type = "hidden";
+  idInput.name = "order_id";
+  idInput.value = order.id;
+  const field = createEl("label", "field field--compact");
+  const select = createEl("select");
+  select.name = "status";
+  const allowed = transitions[order.status] || [];
+  Object.entries(statuses).forEach(([value, label]) => {
+    if (value !== order.status && !allowed.includes(value)) return;
+    const option = createEl("option", "", label);
+    option.value = value;
+    option.selected = value === order.status;
+    select.append(option);
+  });
+  field.append(createEl("span", "", "Статус"), select);
+  const submit = createEl("button", "ghost", "Сохранить");
+  submit.type = "submit";
+  form.append(idInput, field, submit);
+
+  row.append(main, form);
+  return row;
+};
+
+if (ordersList && ordersList.dataset.orderFeed) {
+  const feedUrl = ordersList.dataset.orderFeed;
+  const statuses = JSON.parse(ordersList.dataset.statuses || "{}");
+  const transitions = JSON.parse(ordersList.dataset.transitions || "{}");
+  let lastId = Number(ordersList.dataset.lastId || 0);
+  let inFlight = false;
+
+  const poll = async () => {
+    if (inFlight || document.hidden) return;
+    inFlight = true;
+    try {
+      const response = await fetch(`${feedUrl}?since_id=${lastId}`, {
+        headers: { Accept: "application/json" },
+      });
+      if (!response.ok) return;
+      const payload = await response.json();
+      if (payload.reset) {
+        // More orders arrived than the feed keeps; show them all.
+        window.location.reload();
+        return;
+      }
+      const orders = payload.orders || [];
+      if (orders.length) {
+        const empty = ordersList.querySelector("[data-orders-empty]");
+        if (empty) empty.remove();
+      }
+      // The feed re-sends recent orders: rows already shown are replaced
+      // when their status changed, and an order that committed late is
+      // slotted in by id instead of going to the top.
+      orders.forEach((order) => {
+        const shown = ordersList.querySelector(`[data-order-id="${order.id}"]`);
+        if (shown) {
+          if (shown.dataset.status === order.status) return;
+          const row = buildOrderRow(order, statuses, transitions);
+          const picked = shown.querySelector('input[name="order_ids"]');
+          row.querySelector('input[name="order_ids"]').checked = Boolean(
+            picked && picked.checked
+          );
+          shown.replaceWith(row);
+          return;
+        }
+        const older = Array.from(
+          ordersList.querySelectorAll("[data-order-id]")
+        ).find((row) => Number(row.dataset.orderId) < order.id);
+        ordersList.insertBefore(
+          buildOrderRow(order, statuses, transitions),
+          older || null
+        );
+      });
+      lastId = Math.max(lastId, payload.last_id || 0);
+    } catch (error) {
+      // Network hiccups are retried on the next tick.
+    } finally {
+      inFlight = false;
+    }
+  };
+
+  setInterval(poll, 5000);
+}
+
+const bulkForm = document.getElementById("bulk-status");
+
+if (bulkForm) {
+  const selectPage = bulkForm.querySelector("[data-select-page]");
+  const selectAll = bulkForm.querySelector("[data-select-all]");
+  const pageBoxes = () =>
+    document.querySelectorAll('input[name="order_ids"][form="bulk-status"]');
+
+  selectPage.addEventListener("change", () => {
+    pageBoxes().forEach((box) => {
+      box.checked = selectPage.checked;
+    });
+  });
+  bulkForm.addEventListener("submit", (event) => {
+    const picked = Array.from(pageBoxes()).some((box) => box.checked);
+    if (selectAll.checked) {
+      if (!confirm("Изменить статус у всех заказов по текущему фильтру?")) {
+        event.preventDefault();
+      }
+    } else if (!picked) {
+      event.preventDefault();
+      alert("Выберите заказы или отметьте «Все по текущему фильтру».");
+    }
+  });
+}
+
+const searchForm = document.querySelector("[data-admin-search]");
+const searchResults = document.getElementById("admin-search-results");
+
+if (searchForm && searchResults) {
+  const input = searchForm.querySelector("input[name=q]");
+  let timer = null;
+  let controller = null;
+
+  const search = async () => {
+    if (controller) controller.abort();
+    controller = new AbortController();
+    const query = input.value.trim();
+    try {
+      const response = await fetch(
+        `${searchForm.action}?q=${encodeURIComponent(query)}`,
+        { signal: controller.signal }
+      );
+      if (!response.ok) return;
+      // Rendered and escaped by the server.
+      searchResults.innerHTML = await response.text();
+    } catch (error) {
+      // Superseded by a newer query or a network hiccup.
+    }
+  };
+
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(search, 200);
+  });
+  searchForm.addEventListener("submit", (event) => {
+    event.preventDefault();
+    clearTimeout(timer);
+    search();
+  });
+}
@@ -41,12 +41,13 @@ const getShopType = () => {
   return el ? el.dataset.shopType : null;
 };
 
-const redirectToResult = (code) => {
+const redirectToResult = (code, orderIds) => {
   const shopType = getShopType();
   if (!shopType || !code) return false;
   const allowed = new Set(["congrat", "not-enough-tovar", "not-enough-points"]);
   if (!allowed.has(code)) return false;
-  window.location.href = `/shop/${shopType}/result/${code}`;
+  const query = orderIds && orderIds.length ? `?orders=${orderIds.join(",")}` : "";
+  window.location.href = `/shop/${shopType}/result/${code}${query}`;
   return true;
 };
 
@@ -65,10 +66,13 @@ buttons.forEach((button) => {
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ variant_id: Number(variantId) }),
+        body: JSON.stringify({
+          variant_id: Number(variantId),
+          shop_type: getShopType(),
+        }),
       });
       const payload = await response.json();
-      if (payload.code && redirectToResult(payload.code)) {
+      if (payload.code && redirectToResult(payload.code, payload.order_ids)) {
         return;
       }
       if (!payload.ok) {
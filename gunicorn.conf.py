@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+# Every worker keeps its own metrics and load-shedding state. LOAD_LIMITS
+# apply to each worker, so the server admits workers x those limits; the
+# waiting room splits its rate between workers instead. Workers dump their
+# metrics here and /metrics reports the sum over all of them.
+os.environ.setdefault(
+    "METRICS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), f"app-metrics-{os.getpid()}"),
+)
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app once in the master so workers share its memory
+# copy-on-write and start instantly.
+preload_app = True
+# On SIGTERM workers stop accepting connections and get this long to finish
+# in-flight requests (redeems included) before they are killed.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(server):
+    # Runs once in the master after the app is preloaded and before any
+    # worker is forked, so schema changes and seeding never race.
+    from app.core.bootstrap import bootstrap_db
+    from app.core.database import dispose_engines
+    from app.core.metrics import worker_snapshots
+    from app.core.templates import warm_templates
+    from app.services.waiting_room import waiting_room
+
+    bootstrap_db()
+    worker_snapshots.clear()
+    dispose_engines()
+    warm_templates()
+    waiting_room.workers = server.cfg.workers
+
+
+def post_fork(server, worker):
+    from app.core.database import dispose_engines
+
+    dispose_engines(close=False)
@@ -0,0 +1,113 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# The app reads its configuration at import time, so the scratch database
+# and admin password are set before anything from app/ is imported.
+os.environ["DATABASE_URL"] = (
+    f"sqlite:///{tempfile.mkdtemp(prefix='shop-tests-')}/app.db"
+)
+os.environ["ADMIN_PASSWORD"] = "test-admin"
+os.environ["LOAD_SHEDDING_ENABLED"] = "0"
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from app.core.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Product, ProductVariant  # noqa: E402
+
+pytest_plugins = ["tools.pytest_query_budget"]
+
+PASSWORD = "secret1"
+BUYERS = ("alice", "bob", "carol")
+
+
+def _seed_catalog(admin: TestClient) -> None:
+    now = datetime.now()
+    for shop_type in ("regular", "premium"):
+        admin.post("/admin/settings/set", data={
+            "shop_type": shop_type,
+            "opens_at": (now - timedelta(days=1)).isoformat(
+                timespec="minutes"
+            ),
+            "closes_at": (now + timedelta(days=1)).isoformat(
+                timespec="minutes"
+            ),
+        })
+    for position in range(12):
+        admin.post("/admin/product/add", data={
+            "shop_type": "premium" if position % 4 == 0 else "regular",
+            "title": f"Товар {position}",
+            "description": "Описание",
+            "variants_raw": "S | 5 | 500\nM | 7\nL | 9 | 500",
+            "position": position,
+            "active": "on",
+        })
+    admin.post("/admin/product/add", data={
+        "shop_type": "regular", "title": "Подарочный код",
+        "variants_raw": "Номинал 100 | 3", "position": 20, "active": "on",
+    })
+
+
+def _catalog() -> dict:
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(ProductVariant.id, Product.id, Product.shop_type)
+            .join(Product, ProductVariant.product_id == Product.id)
+            .order_by(ProductVariant.id)
+        ).all()
+    regular = [variant_id for variant_id, _, shop in rows if shop == "regular"]
+    return {
+        "regular_product": next(
+            product_id for _, product_id, shop in rows if shop == "regular"
+        ),
+        "variants": regular[:-1],
+        "code_variant": regular[-1],
+    }
+
+
+@pytest.fixture(scope="session")
+def shop():
+    # A catalog of a dozen products over both shops, a code-pool variant,
+    # three allowlisted buyers with pending ledger credits and some order
+    # history. Seeding happens outside the test call, so it is not
+    # counted against any budget.
+    with TestClient(app) as admin:
+        response = admin.post(
+            "/admin/login", data={"password": "test-admin"},
+            follow_redirects=False,
+        )
+        assert response.status_code == 303
+        _seed_catalog(admin)
+        catalog = _catalog()
+        admin.post("/admin/variant/codes", data={
+            "variant_id": catalog["code_variant"],
+            "codes_raw": "\n".join(f"GIFT-{n:04d}" for n in range(200)),
+        })
+        buyers = {}
+        for username in BUYERS:
+            buyer = TestClient(app)
+            response = buyer.post("/register", data={
+                "tg_username": username, "password": PASSWORD,
+                "password_confirm": PASSWORD,
+            }, follow_redirects=False)
+            assert response.status_code == 303
+            admin.post("/admin/points/set", data={
+                "tg_username": username, "points": 5000,
+            })
+            admin.post("/admin/allowlist/add", data={
+                "shop_type": "regular", "tg_username": username,
+            })
+            buyers[username] = buyer
+        for buyer in buyers.values():
+            for variant_id in catalog["variants"][:5]:
+                assert buyer.post(
+                    "/api/redeem", json={"variant_id": variant_id},
+                ).json()["ok"]
+        admin.post("/admin/points/credit", data={
+            "usernames_raw": "\n".join(f"@{name}" for name in BUYERS),
+            "amount": 10, "reason": "бонус",
+        })
+        yield {"admin": admin, "buyers": buyers, **catalog}
@@ -0,0 +1,76 @@
+# Every request below is checked against ROUTE_QUERY_BUDGETS by the
+# tools.pytest_query_budget plugin, loaded in conftest.py.
+import pytest
+
+from tools.pytest_query_budget import ROUTE_QUERY_BUDGETS
+
+
+def _ok(response) -> dict:
+    assert response.status_code == 200, response.text
+    payload = response.json()
+    assert payload["ok"], payload
+    return payload
+
+
+def test_browse_pages(shop):
+    alice = shop["buyers"]["alice"]
+    assert alice.get("/shops").status_code == 200
+    assert alice.get("/shop/regular").status_code == 200
+    product = alice.get(f"/shop/regular/product/{shop['regular_product']}")
+    assert product.status_code == 200
+
+
+def test_order_history(shop):
+    alice = shop["buyers"]["alice"]
+    assert alice.get("/orders").status_code == 200
+    assert len(_ok(alice.get("/api/orders"))["orders"]) >= 5
+
+
+def test_redeem(shop):
+    bob = shop["buyers"]["bob"]
+    _ok(bob.post("/api/redeem", json={"variant_id": shop["variants"][0]}))
+    _ok(bob.post("/api/redeem", json={"variant_id": shop["variants"][1]}))
+
+
+def test_redeem_code(shop):
+    payload = _ok(shop["buyers"]["bob"].post(
+        "/api/redeem", json={"variant_id": shop["code_variant"]},
+    ))
+    assert len(payload["vouchers"]) == 1
+
+
+@pytest.mark.parametrize("lines,qty", [(1, 1), (2, 1), (5, 1), (5, 3)])
+def test_checkout(shop, lines, qty):
+    items = [
+        {"variant_id": variant_id, "qty": qty}
+        for variant_id in shop["variants"][:lines]
+    ]
+    payload = _ok(shop["buyers"]["carol"].post(
+        "/api/checkout", json={"items": items},
+    ))
+    assert len(payload["order_ids"]) == lines * qty
+
+
+def test_checkout_with_codes(shop):
+    items = [{"variant_id": variant_id, "qty": 2}
+             for variant_id in shop["variants"][:4]]
+    items.append({"variant_id": shop["code_variant"], "qty": 3})
+    payload = _ok(shop["buyers"]["alice"].post(
+        "/api/checkout", json={"items": items},
+    ))
+    assert len(payload["vouchers"]) == 3
+
+
+def test_admin_pages(shop):
+    admin = shop["admin"]
+    assert admin.get("/admin").status_code == 200
+    assert admin.get("/admin/search?q=ali").status_code == 200
+    assert admin.get("/admin/orders/export").status_code == 200
+
+
+# The plugin itself must fail a test whose request goes over budget.
+@pytest.mark.xfail(strict=True, reason="budget of zero queries")
+@pytest.mark.query_budget({"/shop/{shop_type}": 0})
+def test_budget_is_enforced(shop):
+    assert "/shop/{shop_type}" in ROUTE_QUERY_BUDGETS
+    assert shop["buyers"]["alice"].get("/shop/regular").status_code == 200
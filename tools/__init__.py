@@ -0,0 +1 @@
+"""Development tooling: profiling helpers, load tests and benchmarks."""
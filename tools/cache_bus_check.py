@@ -0,0 +1,132 @@
+"""Check that cache-bus events reach every worker process, and how fast.
+
+Starts ``--workers`` separate processes that each run the cache bus the way
+an app worker does, publishes ``--events`` changes from the parent and
+reports the publish -> callback latency seen by each worker. Exits non-zero
+if any worker missed the final version of a topic.
+
+    python -m tools.cache_bus_check --workers 4 --events 20
+    python -m tools.cache_bus_check \\
+        --database-url postgresql+psycopg2://user:pw@localhost/bus
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+
+from tools.stats import percentile
+
+
+def worker(index: int, events, ready) -> None:
+    from app.core.cache_bus import TOPICS, cache_bus
+
+    for topic in TOPICS:
+        cache_bus.subscribe(
+            topic,
+            lambda topic=topic: events.put(
+                (index, topic, cache_bus.version(topic), time.time())
+            ),
+        )
+    cache_bus.start()
+    ready.put(index)
+    while True:
+        time.sleep(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--events", type=int, default=12)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        args.database_url = (
+            f"sqlite:///{tempfile.mkdtemp(prefix='cache-bus-')}/app.db"
+        )
+    os.environ["DATABASE_URL"] = args.database_url
+    from app.core.cache_bus import TOPICS, cache_bus
+    from app.core.database import WriteSessionLocal, init_db
+
+    init_db()
+    with WriteSessionLocal() as db:
+        cache_bus.ensure_topics(db)
+        db.commit()
+
+    # Spawned, not forked, so each worker starts clean like a real process.
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    ready = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(index, events, ready), daemon=True)
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=60)
+
+    published: dict[tuple[str, int], float] = {}
+    final: dict[str, int] = {}
+    cache_bus.refresh()
+    for number in range(args.events):
+        topic = TOPICS[number % len(TOPICS)]
+        with WriteSessionLocal() as db:
+            cache_bus.publish(db, topic)
+            db.commit()
+        committed = time.time()
+        cache_bus.refresh()
+        final[topic] = cache_bus.version(topic)
+        published[(topic, final[topic])] = committed
+        time.sleep(args.interval)
+
+    seen: dict[int, dict[str, int]] = {
+        index: {} for index in range(args.workers)
+    }
+    latencies = []
+    deadline = time.time() + args.timeout
+    while time.time() < deadline and any(
+        seen[index].get(topic) != version
+        for index in seen
+        for topic, version in final.items()
+    ):
+        try:
+            index, topic, version, observed = events.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        seen[index][topic] = version
+        started = published.get((topic, version))
+        if started is not None:
+            latencies.append((observed - started) * 1000)
+
+    for process in processes:
+        process.terminate()
+
+    missing = [
+        f"worker {index}: {topic} at {seen[index].get(topic)} != {version}"
+        for index in seen
+        for topic, version in final.items()
+        if seen[index].get(topic) != version
+    ]
+    print(
+        f"{args.workers} workers, {args.events} events, "
+        f"{len(latencies)} deliveries on "
+        f"{args.database_url.split('://')[0]}"
+    )
+    if latencies:
+        print(
+            f"latency ms: p50={percentile(latencies, 50):.1f} "
+            f"p95={percentile(latencies, 95):.1f} max={max(latencies):.1f}"
+        )
+    if missing:
+        print("\n".join(missing))
+        raise SystemExit(1)
+    print("all workers converged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Compare the CPU cost of response compression with the bytes it saves.
+
+Builds representative payloads (the admin page with 500 products, the shop
+page, a 20k-row order export and an orders JSON feed), compresses each with
+every available encoder setting and prints time per response, throughput,
+ratio and bytes saved. The export is also compressed the way the middleware
+streams it: 64 KiB chunks, each followed by a sync flush.
+
+    python -m tools.compression
+    python -m tools.compression --levels 1,6,9 --brotli 4,11 --output comp.json
+"""
+import argparse
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+
+from app.core.compression import BrotliEncoder, GzipEncoder, brotli
+
+CHUNK_BYTES = 64 * 1024
+
+
+def payloads() -> dict[str, bytes]:
+    from app.core.config import ORDER_STATUS_LABELS, ORDER_STATUSES
+    from tools.microbench import bench_render_admin, bench_render_shop
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(
+        [
+            "order_id", "created_at", "tg_username", "shop_type",
+            "product_title", "variant_label", "points_spent", "status",
+        ]
+    )
+    created = datetime(2024, 1, 1)
+    feed = []
+    for index in range(20_000):
+        status = ORDER_STATUSES[index % len(ORDER_STATUSES)]
+        row = [
+            index + 1,
+            (created + timedelta(seconds=index * 7)).isoformat(),
+            f"@user_{index % 3000}",
+            "regular" if index % 4 else "premium",
+            f"Товар {index % 500} — худи с принтом",
+            ("S", "M", "L", "XL")[index % 4],
+            10 + index % 490,
+            ORDER_STATUS_LABELS[status],
+        ]
+        writer.writerow(row)
+        if index < 200:
+            feed.append(
+                dict(
+                    zip(
+                        ("id", "created_at", "tg_username", "shop_type",
+                         "product_title", "variant_label", "points_spent",
+                         "status_label"),
+                        row,
+                    ),
+                    status=status,
+                )
+            )
+    return {
+        "admin.html": bench_render_admin()().encode("utf-8"),
+        "shop.html": bench_render_shop()().encode("utf-8"),
+        "orders.csv": output.getvalue().encode("utf-8"),
+        "feed.json": json.dumps(
+            {"orders": feed, "last_id": 200}, ensure_ascii=False
+        ).encode("utf-8"),
+    }
+
+
+def encoders(levels: list[int], qualities: list[int]) -> dict:
+    available = {
+        f"gzip-{level}": (lambda level=level: GzipEncoder(level))
+        for level in levels
+    }
+    if brotli is not None:
+        for quality in qualities:
+            available[f"br-{quality}"] = (
+                lambda quality=quality: BrotliEncoder(quality)
+            )
+    return available
+
+
+def compress(factory, data: bytes, chunked: bool) -> bytes:
+    encoder = factory()
+    if not chunked:
+        return encoder.compress(data, True)
+    parts = []
+    for offset in range(0, len(data), CHUNK_BYTES):
+        chunk = data[offset:offset + CHUNK_BYTES]
+        parts.append(
+            encoder.compress(chunk, offset + CHUNK_BYTES >= len(data))
+        )
+    return b"".join(parts)
+
+
+def measure(factory, data: bytes, chunked: bool, min_time: float) -> dict:
+    output = compress(factory, data, chunked)
+    loops = 0
+    started = time.process_time()
+    elapsed = 0.0
+    while elapsed < min_time or loops < 3:
+        compress(factory, data, chunked)
+        loops += 1
+        elapsed = time.process_time() - started
+    seconds = elapsed / loops
+    return {
+        "raw_bytes": len(data),
+        "sent_bytes": len(output),
+        "saved_bytes": len(data) - len(output),
+        "ratio": round(len(data) / len(output), 2),
+        "cpu_ms": round(seconds * 1000, 3),
+        "mb_per_s": round(len(data) / seconds / 1e6, 1),
+        # CPU spent per kilobyte kept off the wire.
+        "us_per_saved_kb": round(
+            seconds * 1e6 / max(1, (len(data) - len(output)) / 1024), 2
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", default="1,6,9", help="gzip levels")
+    parser.add_argument(
+        "--brotli", default="4,11", help="brotli qualities, if installed"
+    )
+    parser.add_argument("--min-time", type=float, default=0.3)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    available = encoders(
+        [int(level) for level in args.levels.split(",") if level],
+        [int(quality) for quality in args.brotli.split(",") if quality],
+    )
+    if brotli is None:
+        print("brotli is not installed, gzip only\n")
+    results = []
+    print(
+        f"{'payload':<18} {'encoder':<10} {'raw KB':>8} {'sent KB':>8} "
+        f"{'ratio':>6} {'cpu ms':>8} {'MB/s':>7} {'us/saved KB':>12}"
+    )
+    for name, data in payloads().items():
+        modes = [False, True] if name.endswith(".csv") else [False]
+        for encoder_name, factory in available.items():
+            for chunked in modes:
+                row = measure(factory, data, chunked, args.min_time)
+                label = f"{name}{' stream' if chunked else ''}"
+                results.append({"payload": label, "encoder": encoder_name, **row})
+                print(
+                    f"{label:<18} {encoder_name:<10} "
+                    f"{row['raw_bytes'] / 1024:>8.1f} "
+                    f"{row['sent_bytes'] / 1024:>8.1f} {row['ratio']:>6.2f} "
+                    f"{row['cpu_ms']:>8.3f} {row['mb_per_s']:>7.1f} "
+                    f"{row['us_per_saved_kb']:>12.2f}"
+                )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+"""Hammer the redeem/checkout transactions directly and check invariants.
+
+Drives ``place_single_order`` / ``place_cart_order`` from threads or
+processes against a scratch database, sweeping the number of concurrent
+workers for each contention scenario:
+
+* ``hot-variant``  - distinct users, one variant with limited stock;
+* ``spread``       - distinct users, one variant per worker;
+* ``double-click`` - one user with points for a few items, many workers;
+* ``cart``         - distinct users buying overlapping multi-item carts;
+* ``codes``        - distinct users on one code-pool variant whose pool
+  (``--codes``, default a quarter of the attempts) runs out mid-run.
+
+Every run asserts that stock never goes negative, that sold units match the
+stock taken and that no user spends more points than they had. ``codes``
+also asserts that no code was handed to two orders, that every handed-out
+code is claimed by the order that received it and that every order holds
+exactly one.
+
+    python -m tools.contention --workers 1,2,4,8,16,32 --output results/
+    python -m tools.contention --mode process \\
+        --database-url postgresql+psycopg2://user:pw@localhost/contention
+    python -m tools.contention --scenarios codes --workers 8,32
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from tools.stats import summarize
+
+SCENARIOS = ("hot-variant", "spread", "double-click", "cart", "codes")
+USER_PREFIX = "@ct_"
+
+
+def build_fixture(args, scenario: str, workers: int, tag: str) -> dict:
+    from app.core.database import SessionLocal
+    from app.models import Product, ProductVariant, User, VariantCode
+
+    user_count = 1 if scenario == "double-click" else workers
+    variant_count = {
+        "hot-variant": 1, "spread": workers, "double-click": 1, "cart": 4,
+        "codes": 1,
+    }[scenario]
+    # The double-click user can afford exactly --affordable items, so any
+    # extra order would be a double spend.
+    points = (
+        args.cost * args.affordable if scenario == "double-click"
+        else args.cost * args.ops * 4
+    )
+    stock = None if scenario in ("double-click", "codes") else args.stock
+    # The pool, not stock, limits the codes scenario.
+    code_count = (
+        args.codes or max(1, workers * args.ops // 4)
+        if scenario == "codes" else 0
+    )
+    with SessionLocal() as db:
+        users = [
+            User(tg_username=f"{USER_PREFIX}{tag}_{index}", points=points)
+            for index in range(user_count)
+        ]
+        product = Product(shop_type="regular", title=f"Contention {tag}")
+        db.add_all(users)
+        db.add(product)
+        db.flush()
+        variants = [
+            ProductVariant(
+                product_id=product.id,
+                label=f"V{index}",
+                points_cost=args.cost,
+                stock=stock,
+                position=index,
+                code_pool=bool(code_count),
+            )
+            for index in range(variant_count)
+        ]
+        db.add_all(variants)
+        db.flush()
+        db.add_all(
+            VariantCode(variant_id=variants[0].id, code=f"{tag}-{index:06d}")
+            for index in range(code_count)
+        )
+        db.commit()
+        return {
+            "user_ids": [user.id for user in users],
+            "variant_ids": [variant.id for variant in variants],
+            "points": points,
+            "stock": stock,
+            "codes": code_count,
+        }
+
+
+def worker(scenario: str, index: int, fixture: dict, ops: int,
+           start_at: float, seed: int) -> dict:
+    from sqlalchemy.exc import DBAPIError
+
+    from app.core.database import WriteSessionLocal
+    from app.models import User
+    from app.services.checkout import (RedeemError, place_cart_order,
+                                       place_single_order)
+
+    rng = random.Random(seed * 1000 + index)
+    user_ids = fixture["user_ids"]
+    variant_ids = fixture["variant_ids"]
+    user_id = user_ids[index % len(user_ids)]
+    outcomes = {"ok": 0, "rejected": 0, "errors": 0}
+    latencies = []
+    # (order id, code) for every code handed to a buyer in a committed
+    # transaction.
+    issued = []
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    for _ in range(ops):
+        started = time.perf_counter()
+        with WriteSessionLocal() as db:
+            try:
+                user = db.get(User, user_id)
+                if scenario == "cart":
+                    picked = rng.sample(variant_ids, 2)
+                    result = place_cart_order(
+                        db, user, {vid: 1 for vid in picked}
+                    )
+                elif scenario == "spread":
+                    result = place_single_order(
+                        db, user, variant_ids[index % len(variant_ids)]
+                    )
+                else:
+                    result = place_single_order(db, user, variant_ids[0])
+                db.commit()
+                outcomes["ok"] += 1
+                if scenario == "codes":
+                    issued.extend(zip(result.order_ids, result.vouchers))
+            except RedeemError:
+                db.rollback()
+                outcomes["rejected"] += 1
+            except DBAPIError:
+                # Lock timeouts, deadlocks and "database is locked" - the
+                # transaction is lost, but it must not have changed anything.
+                db.rollback()
+                outcomes["errors"] += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {"outcomes": outcomes, "latencies": latencies, "issued": issued}
+
+
+def check_invariants(fixture: dict, issued: list) -> list[str]:
+    from sqlalchemy import func, select
+
+    from app.core.database import SessionLocal
+    from app.models import Order, ProductVariant, User
+
+    violations = []
+    with SessionLocal() as db:
+        users = db.execute(
+            select(User.id, User.tg_username, User.points)
+            .where(User.id.in_(fixture["user_ids"]))
+        ).all()
+        spent = dict(
+            db.execute(
+                select(Order.tg_username, func.sum(Order.points_spent))
+                .where(
+                    Order.tg_username.in_([user.tg_username for user in users])
+                )
+                .group_by(Order.tg_username)
+            ).all()
+        )
+        for user in users:
+            used = spent.get(user.tg_username) or 0
+            if user.points < 0:
+                violations.append(f"{user.tg_username}: negative points")
+            if user.points + used != fixture["points"]:
+                violations.append(
+                    f"{user.tg_username}: double spend "
+                    f"({user.points} left + {used} spent != {fixture['points']})"
+                )
+        sold = dict(
+            db.execute(
+                select(Order.product_variant_id, func.count(Order.id))
+                .where(Order.product_variant_id.in_(fixture["variant_ids"]))
+                .group_by(Order.product_variant_id)
+            ).all()
+        )
+        stocks = db.execute(
+            select(ProductVariant.id, ProductVariant.stock)
+            .where(ProductVariant.id.in_(fixture["variant_ids"]))
+        ).all()
+        for variant_id, stock in stocks:
+            if stock is None:
+                continue
+            if stock < 0:
+                violations.append(f"variant {variant_id}: negative stock")
+            if stock + sold.get(variant_id, 0) != fixture["stock"]:
+                violations.append(
+                    f"variant {variant_id}: oversold ({stock} left + "
+                    f"{sold.get(variant_id, 0)} sold != {fixture['stock']})"
+                )
+        if fixture["codes"]:
+            violations.extend(_code_violations(db, fixture, sold, issued))
+    return violations
+
+
+def _code_violations(db, fixture: dict, sold: dict, issued: list) -> list[str]:
+    from sqlalchemy import func, select
+
+    from app.models import Order, VariantCode
+
+    violations = []
+    pool = db.execute(
+        select(VariantCode.id, VariantCode.code, VariantCode.order_id).where(
+            VariantCode.variant_id.in_(fixture["variant_ids"])
+        )
+    ).all()
+    row_ids = {row.code: row.id for row in pool}
+    claimed = {row.id: row.order_id for row in pool if row.order_id}
+    if len(claimed) > fixture["codes"]:
+        violations.append(
+            f"{len(claimed)} codes issued from a pool of {fixture['codes']}"
+        )
+    # A code row goes to one order only: no row may have been handed to two
+    # buyers, and every buyer who got a code must be the order its row
+    # points at.
+    handed: dict[int, set] = {}
+    for order_id, code in issued:
+        handed.setdefault(row_ids.get(code), set()).add(order_id)
+    for row_id, order_ids in sorted(handed.items(), key=str):
+        if len(order_ids) > 1:
+            violations.append(
+                f"code row {row_id} handed to orders {sorted(order_ids)}"
+            )
+        if claimed.get(row_id) not in order_ids:
+            violations.append(
+                f"code row {row_id} handed to {sorted(order_ids)} but "
+                f"claimed by {claimed.get(row_id)}"
+            )
+    order_ids = set(
+        db.execute(
+            select(Order.id).where(
+                Order.product_variant_id.in_(fixture["variant_ids"])
+            )
+        ).scalars()
+    )
+    for row_id, order_id in sorted(claimed.items()):
+        if order_id not in order_ids:
+            violations.append(
+                f"code row {row_id} claimed by missing order {order_id}"
+            )
+    # ... and every code-pool order holds exactly one claimed row.
+    per_order = db.execute(
+        select(Order.id, func.count(VariantCode.id))
+        .join(VariantCode, VariantCode.order_id == Order.id, isouter=True)
+        .where(Order.product_variant_id.in_(fixture["variant_ids"]))
+        .group_by(Order.id)
+    ).all()
+    for order_id, count in per_order:
+        if count != 1:
+            violations.append(f"order {order_id}: {count} codes")
+    if sum(sold.values()) != len(claimed):
+        violations.append(
+            f"{sum(sold.values())} orders but {len(claimed)} codes claimed"
+        )
+    return violations
+
+
+def run_case(args, scenario: str, workers: int, tag: str) -> dict:
+    fixture = build_fixture(args, scenario, workers, tag)
+    start_at = time.time() + 0.5
+    executor_class = (
+        ProcessPoolExecutor if args.mode == "process" else ThreadPoolExecutor
+    )
+    with executor_class(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                worker, scenario, index, fixture, args.ops, start_at,
+                args.seed,
+            )
+            for index in range(workers)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.time() - start_at
+    totals = {"ok": 0, "rejected": 0, "errors": 0}
+    latencies = []
+    issued = []
+    for result in results:
+        for key, value in result["outcomes"].items():
+            totals[key] += value
+        latencies.extend(result["latencies"])
+        issued.extend(result["issued"])
+    violations = check_invariants(fixture, issued)
+    latency = summarize(latencies, totals["errors"])
+    return {
+        "scenario": scenario,
+        "workers": workers,
+        "attempts": len(latencies),
+        **totals,
+        "seconds": round(elapsed, 3),
+        "attempts_per_sec": round(len(latencies) / elapsed, 2),
+        "orders_per_sec": round(totals["ok"] / elapsed, 2),
+        "p50_ms": latency["p50_ms"],
+        "p95_ms": latency["p95_ms"],
+        "p99_ms": latency["p99_ms"],
+        "violations": violations,
+    }
+
+
+def compare_rows(rows: list[dict], baseline_rows: list[dict]) -> str:
+    baseline = {
+        (row["scenario"], row["workers"]): row for row in baseline_rows
+    }
+    lines = [
+        f"{'scenario':<13} {'workers':>7} {'base tx/s':>10} {'tx/s':>10} "
+        f"{'change':>8} {'base err':>8} {'err':>5}"
+    ]
+    for row in rows:
+        base = baseline.get((row["scenario"], row["workers"]))
+        if base is None:
+            continue
+        change = (
+            row["attempts_per_sec"] / base["attempts_per_sec"] - 1
+            if base["attempts_per_sec"] else 0
+        )
+        lines.append(
+            f"{row['scenario']:<13} {row['workers']:>7} "
+            f"{base['attempts_per_sec']:>10.1f} {row['attempts_per_sec']:>10.1f} "
+            f"{change:>+8.1%} {base['errors']:>8} {row['errors']:>5}"
+        )
+    return "\n".join(lines)
+
+
+def ascii_chart(rows: list[dict]) -> str:
+    peak = max((row["attempts_per_sec"] for row in rows), default=0) or 1
+    lines = []
+    for scenario in SCENARIOS:
+        scenario_rows = [row for row in rows if row["scenario"] == scenario]
+        if not scenario_rows:
+            continue
+        lines.append(f"{scenario} (attempts/sec)")
+        for row in scenario_rows:
+            bar = "#" * max(1, round(row["attempts_per_sec"] / peak * 50))
+            lines.append(
+                f"  {row['workers']:>4} {bar} {row['attempts_per_sec']:.0f}"
+            )
+    return "\n".join(lines)
+
+
+def plot(rows: list[dict], path: str) -> bool:
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return False
+    figure, axis = plt.subplots(figsize=(8, 5))
+    for scenario in SCENARIOS:
+        scenario_rows = [row for row in rows if row["scenario"] == scenario]
+        if scenario_rows:
+            axis.plot(
+                [row["workers"] for row in scenario_rows],
+                [row["attempts_per_sec"] for row in scenario_rows],
+                marker="o",
+                label=scenario,
+            )
+    axis.set_xscale("log", base=2)
+    axis.set_xlabel("concurrent workers")
+    axis.set_ylabel("transactions / sec")
+    axis.legend()
+    figure.savefig(path, dpi=120, bbox_inches="tight")
+    plt.close(figure)
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--workers", default="1,2,4,8,16")
+    parser.add_argument("--mode", choices=("thread", "process"),
+                        default="thread")
+    parser.add_argument("--ops", type=int, default=20,
+                        help="attempts per worker")
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--cost", type=int, default=10)
+    parser.add_argument("--affordable", type=int, default=3,
+                        help="items the double-click user can pay for")
+    parser.add_argument("--codes", type=int, default=0,
+                        help="code pool size for the codes scenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="directory for JSON/CSV/PNG results")
+    parser.add_argument(
+        "--baseline", help="earlier contention.json to compare throughput with"
+    )
+    args = parser.parse_args()
+
+    if not args.database_url:
+        args.database_url = (
+            f"sqlite:///{tempfile.mkdtemp(prefix='contention-')}/app.db"
+        )
+    os.environ["DATABASE_URL"] = args.database_url
+    from app.core.config import SQLITE_TUNED
+    from app.core.database import engine, init_db, write_engine
+
+    init_db()
+    # Forked workers must not reuse the parent's pooled connections.
+    engine.dispose()
+    write_engine.dispose()
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    run_id = datetime.utcnow().strftime("%m%d%H%M%S")
+    rows = []
+    for scenario in scenarios:
+        for workers in [int(value) for value in args.workers.split(",")]:
+            tag = f"{run_id}_{scenario}_{workers}"
+            row = run_case(args, scenario, workers, tag)
+            engine.dispose()
+            write_engine.dispose()
+            rows.append(row)
+            status = "ok" if not row["violations"] else "VIOLATION"
+            print(
+                f"{scenario:<13} workers={workers:<4} "
+                f"ok={row['ok']:<5} rejected={row['rejected']:<5} "
+                f"errors={row['errors']:<4} "
+                f"{row['attempts_per_sec']:>8.1f} tx/s "
+                f"p95={row['p95_ms']:.1f}ms {status}"
+            )
+            for violation in row["violations"][:5]:
+                print(f"    {violation}")
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        with open(
+            os.path.join(args.output, "contention.json"), "w", encoding="utf-8"
+        ) as handle:
+            json.dump(
+                {
+                    "database": args.database_url.split("://")[0],
+                    "sqlite_tuned": SQLITE_TUNED,
+                    "mode": args.mode,
+                    "ops": args.ops,
+                    "rows": rows,
+                },
+                handle,
+                ensure_ascii=False,
+                indent=2,
+            )
+        fields = [key for key in rows[0] if key != "violations"] if rows else []
+        with open(
+            os.path.join(args.output, "contention.csv"), "w", newline="",
+            encoding="utf-8",
+        ) as handle:
+            writer = csv.DictWriter(handle, fields + ["violations"])
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({**row, "violations": len(row["violations"])})
+        png = os.path.join(args.output, "contention.png")
+        if plot(rows, png):
+            print(f"\nplot written to {png}")
+        else:
+            print("\n" + ascii_chart(rows))
+    else:
+        print("\n" + ascii_chart(rows))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            print("\n" + compare_rows(rows, json.load(handle)["rows"]))
+
+    if any(row["violations"] for row in rows):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""Simulate a shop opening end to end and check stock/points invariants.
+
+Seeds N users (with points, passwords and allowlist entries) and M products
+with limited stock into the target database, starts a local uvicorn unless
+``--base-url`` is given, then runs login -> /shops -> /shop/{type} and, from
+``opens_at`` on, /api/redeem with many concurrent clients.
+
+    python -m tools.loadtest --users 500 --products 20 --stock 30 \\
+        --output results/sqlite.json
+    python -m tools.loadtest \\
+        --database-url postgresql+psycopg2://user:pw@localhost/loadtest \\
+        --output results/postgres.json
+
+``--waiting-room`` turns on the shop's queue at ``--queue-rate`` R and runs
+two openings: an uncontended one with R users, then one with
+``--overload`` x R users arriving at once. Queued users poll /shop until
+they are admitted; the report compares the p99 of admitted users' requests
+(/shop and /api/redeem after admission) between the two.
+
+    python -m tools.loadtest --waiting-room --queue-rate 20 --overload 10
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import httpx
+
+from tools.stats import format_table, summarize
+
+USER_PREFIX = "@lt_"
+PRODUCT_PREFIX = "LT "
+
+
+def seed(args, run_id: str) -> dict:
+    from sqlalchemy import select
+
+    from app.core.cache_bus import cache_bus
+    from app.core.database import SessionLocal, init_db
+    from app.core.security import hash_password
+    from app.core.time import local_now
+    from app.models import (AllowlistEntry, Product, ProductVariant,
+                            ShopSettings, User)
+
+    init_db()
+    password_hash = hash_password(args.password)
+    usernames = [
+        f"{USER_PREFIX}{run_id}_{index}" for index in range(args.users)
+    ]
+    with SessionLocal() as db:
+        db.add_all(
+            User(
+                tg_username=username,
+                points=args.points,
+                password_hash=password_hash,
+            )
+            for username in usernames
+        )
+        db.add_all(
+            AllowlistEntry(tg_username=username, shop_type=args.shop)
+            for username in usernames
+        )
+        variant_ids = []
+        for index in range(args.products):
+            product = Product(
+                shop_type=args.shop,
+                title=f"{PRODUCT_PREFIX}{run_id} #{index}",
+                position=index,
+                active=True,
+            )
+            db.add(product)
+            db.flush()
+            for position in range(args.variants):
+                variant = ProductVariant(
+                    product_id=product.id,
+                    label=f"V{position}",
+                    points_cost=args.cost,
+                    stock=args.stock,
+                    position=position,
+                    active=True,
+                )
+                db.add(variant)
+                db.flush()
+                variant_ids.append(variant.id)
+        opens_at = local_now() + timedelta(seconds=args.opens_in)
+        settings = db.execute(
+            select(ShopSettings).where(ShopSettings.shop_type == args.shop)
+        ).scalar_one_or_none()
+        if settings is None:
+            settings = ShopSettings(shop_type=args.shop)
+            db.add(settings)
+        settings.opens_at = opens_at.replace(microsecond=0)
+        settings.closes_at = opens_at + timedelta(hours=1)
+        settings.queue_enabled = args.waiting_room
+        settings.queue_rate = args.queue_rate if args.waiting_room else None
+        # A fresh window gives the server a fresh queue.
+        cache_bus.publish(db, "settings")
+        db.commit()
+    return {
+        "usernames": usernames,
+        "variant_ids": variant_ids,
+        "opens_at_monotonic": time.monotonic() + args.opens_in,
+    }
+
+
+def check_invariants(args, seeded: dict) -> dict:
+    from sqlalchemy import func, select
+
+    from app.core.database import SessionLocal
+    from app.models import Order, ProductVariant, User
+
+    violations = []
+    with SessionLocal() as db:
+        users = db.execute(
+            select(User.tg_username, User.points)
+            .where(User.tg_username.in_(seeded["usernames"]))
+        ).all()
+        spent = dict(
+            db.execute(
+                select(Order.tg_username, func.sum(Order.points_spent))
+                .where(Order.tg_username.in_(seeded["usernames"]))
+                .group_by(Order.tg_username)
+            ).all()
+        )
+        for username, points in users:
+            if points < 0:
+                violations.append(f"{username}: negative points {points}")
+            if points + (spent.get(username) or 0) != args.points:
+                violations.append(
+                    f"{username}: points {points} + spent "
+                    f"{spent.get(username) or 0} != {args.points}"
+                )
+        stocks = dict(
+            db.execute(
+                select(ProductVariant.id, ProductVariant.stock)
+                .where(ProductVariant.id.in_(seeded["variant_ids"]))
+            ).all()
+        )
+        sold = dict(
+            db.execute(
+                select(Order.product_variant_id, func.count(Order.id))
+                .where(Order.product_variant_id.in_(seeded["variant_ids"]))
+                .group_by(Order.product_variant_id)
+            ).all()
+        )
+        for variant_id, stock in stocks.items():
+            if stock is not None and stock < 0:
+                violations.append(f"variant {variant_id}: negative stock")
+            if stock is not None and stock + sold.get(variant_id, 0) != (
+                args.stock
+            ):
+                violations.append(
+                    f"variant {variant_id}: stock {stock} + sold "
+                    f"{sold.get(variant_id, 0)} != {args.stock}"
+                )
+        orders = sum(sold.values())
+    return {
+        "ok": not violations,
+        "orders": orders,
+        "violations": violations[:50],
+        "violation_count": len(violations),
+    }
+
+
+class LoadRun:
+    def __init__(self, args, seeded: dict) -> None:
+        self.args = args
+        self.seeded = seeded
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.outcomes: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _request(self, client: httpx.Client, method: str, url: str,
+                 **kwargs):
+        started = time.perf_counter()
+        try:
+            response = client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        return response, (time.perf_counter() - started) * 1000
+
+    def _record(self, step: str, response, elapsed_ms: float) -> None:
+        with self._lock:
+            self.latencies[step].append(elapsed_ms)
+            if response is None or response.status_code >= 500:
+                self.errors[step] += 1
+
+    def _timed(self, step: str, client: httpx.Client, method: str, url: str,
+               **kwargs):
+        response, elapsed_ms = self._request(client, method, url, **kwargs)
+        self._record(step, response, elapsed_ms)
+        return response
+
+    def _wait_in_queue(self, client: httpx.Client) -> bool:
+        # Polls /shop until admitted. Waiting pages are recorded as "queue",
+        # the admitted page as "shop".
+        deadline = time.monotonic() + self.args.queue_timeout
+        while time.monotonic() < deadline:
+            response, elapsed_ms = self._request(
+                client, "GET", f"/shop/{self.args.shop}"
+            )
+            # Only the waiting page sets Refresh; a shed 503 is an error.
+            if response is None or "Refresh" not in response.headers:
+                self._record("shop", response, elapsed_ms)
+                return response is not None and response.status_code == 200
+            with self._lock:
+                self.latencies["queue"].append(elapsed_ms)
+            try:
+                retry_after = float(response.headers.get("Retry-After", 1))
+            except ValueError:
+                retry_after = 1.0
+            time.sleep(min(retry_after, self.args.queue_poll))
+        with self._lock:
+            self.outcomes["queue-timeout"] += 1
+        return False
+
+    def user_flow(self, username: str, start_event: threading.Event) -> None:
+        rng = random.Random(username)
+        with httpx.Client(
+            base_url=self.args.base_url,
+            timeout=self.args.timeout,
+            follow_redirects=False,
+        ) as client:
+            self._timed(
+                "login", client, "POST", "/login",
+                data={"tg_username": username, "password": self.args.password},
+            )
+            self._timed("shops", client, "GET", "/shops")
+            start_event.wait()
+            if self.args.waiting_room:
+                if not self._wait_in_queue(client):
+                    return
+            else:
+                self._timed("shop", client, "GET", f"/shop/{self.args.shop}")
+            for _ in range(self.args.redeems):
+                variant_id = rng.choice(self.seeded["variant_ids"])
+                response = self._timed(
+                    "redeem", client, "POST", "/api/redeem",
+                    json={"variant_id": variant_id,
+                          "shop_type": self.args.shop},
+                )
+                outcome = "error"
+                if response is not None:
+                    try:
+                        payload = response.json()
+                        outcome = "ok" if payload.get("ok") else (
+                            payload.get("code") or f"http-{response.status_code}"
+                        )
+                    except ValueError:
+                        outcome = f"http-{response.status_code}"
+                with self._lock:
+                    self.outcomes[outcome] += 1
+
+    def run(self) -> float:
+        start_event = threading.Event()
+        workers = self.args.concurrency or len(self.seeded["usernames"])
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(self.user_flow, username, start_event)
+                for username in self.seeded["usernames"]
+            ]
+            delay = self.seeded["opens_at_monotonic"] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            opened = time.perf_counter()
+            start_event.set()
+            for future in futures:
+                future.result()
+        return time.perf_counter() - opened
+
+
+def start_server(args, env: dict) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(args.port),
+            "--log-level", "warning",
+        ],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{args.base_url}/login", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("server did not start")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url")
+    parser.add_argument("--base-url")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--variants", type=int, default=1)
+    parser.add_argument("--stock", type=int, default=20)
+    parser.add_argument("--points", type=int, default=1000)
+    parser.add_argument("--cost", type=int, default=100)
+    parser.add_argument("--redeems", type=int, default=3)
+    parser.add_argument("--shop", default="regular")
+    parser.add_argument("--opens-in", type=float, default=5.0)
+    parser.add_argument(
+        "--concurrency", type=int, default=0,
+        help="client threads; 0 gives every user its own client",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument(
+        "--waiting-room", action="store_true",
+        help="compare admitted-user latency without and with overload",
+    )
+    parser.add_argument("--queue-rate", type=int, default=20,
+                        help="admissions per second with --waiting-room")
+    parser.add_argument("--overload", type=int, default=10,
+                        help="arrivals as a multiple of --queue-rate")
+    parser.add_argument("--queue-poll", type=float, default=1.0,
+                        help="longest wait between queue polls, seconds")
+    parser.add_argument("--queue-timeout", type=float, default=180.0)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        args.database_url = (
+            f"sqlite:///{tempfile.mkdtemp(prefix='loadtest-')}/app.db"
+        )
+    os.environ["DATABASE_URL"] = args.database_url
+    env = dict(os.environ)
+    server = None
+    if not args.base_url:
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args, env)
+
+    phases = {"open": args.users}
+    if args.waiting_room:
+        phases = {
+            "uncontended": args.queue_rate,
+            "overload": args.queue_rate * args.overload,
+        }
+    runs = {}
+    try:
+        for phase, users in phases.items():
+            phase_args = copy.copy(args)
+            phase_args.users = users
+            run_id = datetime.utcnow().strftime("%m%d%H%M%S") + phase[0]
+            seeded = seed(phase_args, run_id)
+            load = LoadRun(phase_args, seeded)
+            wall = load.run()
+            runs[phase] = (phase_args, seeded, load, wall)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    results = {
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "database": args.database_url.split("://")[0],
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in {"password", "database_url"}
+        },
+        "phases": {},
+    }
+    failed = False
+    for phase, (phase_args, seeded, load, wall) in runs.items():
+        invariants = check_invariants(phase_args, seeded)
+        failed = failed or not invariants["ok"]
+        steps = {
+            step: summarize(load.latencies[step], load.errors[step])
+            for step in ("login", "shops", "queue", "shop", "redeem")
+            if step in load.latencies
+        }
+        admitted = load.latencies["shop"] + load.latencies["redeem"]
+        results["phases"][phase] = {
+            "users": phase_args.users,
+            "steps": steps,
+            "admitted": summarize(admitted),
+            "redeem_outcomes": dict(load.outcomes),
+            "open_phase_seconds": round(wall, 3),
+            "orders_per_sec": (
+                round(load.outcomes["ok"] / wall, 2) if wall else 0
+            ),
+            "invariants": invariants,
+        }
+        print(f"\n[{phase}] {phase_args.users} users")
+        print(format_table(steps, title="step"))
+        print(f"redeem outcomes: {dict(load.outcomes)}")
+        print(f"orders/sec: {results['phases'][phase]['orders_per_sec']}")
+        print(
+            "invariants: "
+            + ("ok" if invariants["ok"] else f"{invariants['violation_count']} "
+               "violations")
+        )
+    if args.waiting_room:
+        base = results["phases"]["uncontended"]["admitted"]["p99_ms"]
+        loaded = results["phases"]["overload"]["admitted"]["p99_ms"]
+        ratio = round(loaded / base, 2) if base else None
+        results["admitted_p99"] = {
+            "uncontended_ms": base, "overload_ms": loaded, "ratio": ratio,
+        }
+        print(
+            f"\nadmitted p99: uncontended {base:.1f} ms, "
+            f"{args.overload}x overload {loaded:.1f} ms (x{ratio})"
+        )
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, ensure_ascii=False, indent=2)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
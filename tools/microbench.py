@@ -0,0 +1,393 @@
+"""Micro-benchmarks for CPU-bound helpers and template rendering.
+
+Each benchmark builds its input once (realistic in-memory ORM objects, no
+database) and is then timed with ``timeit``. Results can be saved as a
+baseline and later runs compared against it; ``--compare`` exits non-zero
+when any benchmark got slower than ``--threshold``.
+
+    python -m tools.microbench --save bench/baseline.json
+    python -m tools.microbench --compare bench/baseline.json --threshold 0.15
+    python -m tools.microbench -k render
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+from datetime import datetime, timedelta
+from typing import Callable
+
+BENCHMARKS: dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup: Callable[[], Callable[[], object]]):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def make_products(count: int, shop_type: str, variants_per_product: int = 3):
+    from app.models import Product, ProductVariant
+
+    rng = random.Random(count)
+    created = datetime(2024, 1, 1)
+    products = []
+    variant_id = 1
+    for index in range(count):
+        product = Product(
+            id=index + 1,
+            shop_type=shop_type,
+            title=f"Товар {index} — худи с принтом",
+            description="Плотный хлопок, оверсайз. " * rng.randint(1, 6),
+            image_url=f"/static/uploads/{index}.jpg" if index % 3 else None,
+            active=index % 17 != 0,
+            position=index,
+            created_at=created + timedelta(minutes=index),
+        )
+        product.variants = [
+            ProductVariant(
+                id=variant_id + offset,
+                product_id=product.id,
+                label=size,
+                points_cost=rng.randint(10, 500),
+                stock=rng.choice([None, 0, 5, 50]),
+                active=True,
+                position=offset,
+                code_pool=False,
+            )
+            for offset, size in enumerate(("S", "M", "L", "XL")[
+                :variants_per_product
+            ])
+        ]
+        variant_id += variants_per_product
+        products.append(product)
+    return products
+
+
+def make_allowlist(count: int, shop_types) -> list:
+    from app.models import AllowlistEntry
+
+    created = datetime(2024, 1, 1)
+    return [
+        AllowlistEntry(
+            id=index + 1,
+            tg_username=f"@user_{index}",
+            shop_type=shop_types[index % len(shop_types)],
+            created_at=created + timedelta(seconds=index),
+        )
+        for index in range(count)
+    ]
+
+
+def shop_settings(shop_type: str):
+    from app.models import ShopSettings
+
+    return ShopSettings(
+        shop_type=shop_type,
+        opens_at=datetime(2024, 1, 1, 12),
+        closes_at=datetime(2030, 1, 1, 12),
+        queue_enabled=False,
+        queue_rate=None,
+    )
+
+
+def sales_fixture(products) -> dict:
+    rng = random.Random(7)
+    first_day = datetime(2024, 1, 1).date()
+    return {
+        "by_shop": [
+            {"shop_type": shop_type, "orders": 1200, "points": 96000,
+             "cancelled": 40}
+            for shop_type in ("regular", "premium")
+        ],
+        "by_product": [
+            {
+                "product_id": product.id,
+                "title": product.title,
+                "orders": 60,
+                "points": 4800,
+                "cancelled": 2,
+                "variants": [
+                    {"variant_id": variant.id, "label": variant.label,
+                     "orders": 20, "points": 1600, "cancelled": 0}
+                    for variant in product.variants
+                ],
+            }
+            for product in products[:20]
+        ],
+        "by_day": [
+            {"day": first_day + timedelta(days=offset),
+             "orders": rng.randint(0, 200), "points": rng.randint(0, 16000)}
+            for offset in range(14)
+        ],
+    }
+
+
+def render(name: str, context: dict) -> Callable[[], str]:
+    from app.core.templates import templates
+
+    template = templates.env.get_template(name)
+    context = {"request": None, **context}
+    return lambda: template.render(context)
+
+
+@benchmark("normalize_tg_username")
+def bench_normalize_tg_username():
+    from app.services.auth import normalize_tg_username
+
+    raws = [
+        "  Alice_Smith ", "@bob", "", "   ", "@VeryLongTelegramName_2024",
+        "carol",
+    ] * 100
+
+    def run():
+        for raw in raws:
+            normalize_tg_username(raw)
+
+    return run
+
+
+@benchmark("parse_variants_raw")
+def bench_parse_variants_raw():
+    from app.services.products import parse_variants_raw
+
+    lines = []
+    for index in range(200):
+        lines.append(f"Размер {index} | {10 + index} | {index % 7 or ''}")
+        if index % 10 == 0:
+            lines.append("broken line")
+        if index % 25 == 0:
+            lines.append(f"Вариант {index}; not-a-number; 5")
+    raw = "\n".join(lines)
+    return lambda: parse_variants_raw(raw)
+
+
+@benchmark("build_order_filters")
+def bench_build_order_filters():
+    from app.services.orders import build_order_filters
+
+    cases = [
+        (None, None, None),
+        ("new", "2024-01-01", "2024-01-31"),
+        ("done", "2024-02-01T10:00", None),
+        ("bogus", "not-a-date", "2024-03-01"),
+    ] * 50
+
+    def run():
+        for status, date_from, date_to in cases:
+            build_order_filters(status, date_from, date_to)
+
+    return run
+
+
+@benchmark("render_admin_500_products_10k_allowlist")
+def bench_render_admin(catalog_version=None):
+    from app.core.config import (ORDER_STATUS_LABELS,
+                                 ORDER_STATUS_TRANSITIONS, ORDER_STATUSES,
+                                 SHOP_TYPES)
+    from app.models import Order, User
+
+    products = make_products(500, SHOP_TYPES[0])
+    for product in products[250:]:
+        product.shop_type = SHOP_TYPES[-1]
+    allowlist_by_shop = {shop_type: [] for shop_type in SHOP_TYPES}
+    for entry in make_allowlist(10_000, SHOP_TYPES):
+        allowlist_by_shop[entry.shop_type].append(entry)
+    variants = [variant for product in products for variant in product.variants]
+    orders = [
+        {
+            "order": Order(
+                id=60 - index,
+                tg_username=f"@user_{index}",
+                product_variant_id=variants[index].id,
+                points_spent=variants[index].points_cost,
+                status=ORDER_STATUSES[index % len(ORDER_STATUSES)],
+                created_at=datetime(2024, 1, 1) + timedelta(minutes=index),
+            ),
+            "variant_label": variants[index].label,
+            "product_title": products[index // 3].title,
+            "shop_type": products[index // 3].shop_type,
+        }
+        for index in range(60)
+    ]
+    users = [
+        User(id=index, tg_username=f"@user_{index}", points=1000 - index)
+        for index in range(50)
+    ]
+    return render(
+        "admin.html",
+        {
+            "allowlist_by_shop": allowlist_by_shop,
+            "settings_by_shop": {
+                shop_type: shop_settings(shop_type) for shop_type in SHOP_TYPES
+            },
+            "products_by_shop": {
+                shop_type: [
+                    product for product in products
+                    if product.shop_type == shop_type
+                ]
+                for shop_type in SHOP_TYPES
+            },
+            "code_stock": {},
+            "catalog_version": catalog_version,
+            "stock_key": 0,
+            "users": users,
+            "users_page": 1,
+            "users_pages_total": 20,
+            "users_has_prev": False,
+            "users_has_next": True,
+            "orders": orders,
+            "sales": sales_fixture(products),
+            "order_statuses": ORDER_STATUSES,
+            "order_status_labels": ORDER_STATUS_LABELS,
+            "order_transitions": ORDER_STATUS_TRANSITIONS,
+            "status_filter": "",
+            "date_from": "",
+            "date_to": "",
+            "export_url": "/admin/orders/export",
+            "orders_live": True,
+            "orders_last_id": 60,
+        },
+    )
+
+
+@benchmark("render_shop_200_products")
+def bench_render_shop(catalog_version=None):
+    from app.models import User
+
+    products = [
+        product for product in make_products(200, "regular")
+        if product.active
+    ]
+    return render(
+        "shop.html",
+        {
+            "user": User(id=1, tg_username="@alice", points=1000),
+            "shop_type": "regular",
+            "allowed": True,
+            "open_now": True,
+            "settings": shop_settings("regular"),
+            "products": products,
+            "code_stock": {},
+            "catalog_version": catalog_version,
+            "stock_key": 0,
+        },
+    )
+
+
+@benchmark("render_admin_fragment_cached")
+def bench_render_admin_cached():
+    return bench_render_admin(catalog_version=1)
+
+
+@benchmark("render_shop_fragment_cached")
+def bench_render_shop_cached():
+    return bench_render_shop(catalog_version=1)
+
+
+@benchmark("gzip_shop_html")
+def bench_gzip_shop():
+    from app.core.compression import GzipEncoder
+
+    body = bench_render_shop()().encode("utf-8")
+    return lambda: GzipEncoder().compress(body, True)
+
+
+def measure(run: Callable[[], object], repeat: int,
+            min_time: float) -> dict:
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    timings = [total / number for total in timer.repeat(repeat, number)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_ms": round(min(timings) * 1000, 4),
+        "median_ms": round(statistics.median(timings) * 1000, 4),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f"\n{'benchmark':<44} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, row in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            print(f"{name:<44} {'-':>10} {row['min_ms']:>10.3f} {'new':>8}")
+            continue
+        change = row["min_ms"] / base["min_ms"] - 1 if base["min_ms"] else 0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:<44} {base['min_ms']:>10.3f} {row['min_ms']:>10.3f} "
+            f"{change:>+8.1%}{flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", dest="pattern", help="run matching benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--min-time", type=float, default=0.2,
+        help="approximate seconds per repeat",
+    )
+    parser.add_argument("--save", help="write results as a baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10,
+        help="allowed slowdown as a fraction of the baseline",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'benchmark':<44} {'min ms':>10} {'median ms':>10} {'loops':>7}")
+    for name, setup in BENCHMARKS.items():
+        if args.pattern and args.pattern not in name:
+            continue
+        row = measure(setup(), args.repeat, args.min_time)
+        results[name] = row
+        print(
+            f"{name:<44} {row['min_ms']:>10.3f} {row['median_ms']:>10.3f} "
+            f"{row['number']:>7}"
+        )
+
+    if args.save:
+        directory = os.path.dirname(args.save)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as handle:
+            json.dump(
+                {
+                    "created_at": datetime.utcnow().isoformat(
+                        timespec="seconds"
+                    ),
+                    "python": sys.version.split()[0],
+                    "machine": platform.machine(),
+                    "benchmarks": results,
+                },
+                handle,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                f"\n{len(regressions)} benchmark(s) slower than "
+                f"{args.threshold:.0%}: {', '.join(regressions)}"
+            )
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Fail tests whose requests exceed a per-route SQL query budget.
+
+Enable with ``pytest -p tools.pytest_query_budget``; tests/conftest.py loads
+it for the test suite. Budgets can be widened for a single test with
+``@pytest.mark.query_budget({"/admin": 20})``.
+"""
+import pytest
+
+from app.core.profiling import profiler
+
+ROUTE_QUERY_BUDGETS = {
+    # The user row comes with its pending ledger credits in one query.
+    "/shops": 5,
+    # Code-pool variants add the count of free codes.
+    "/shop/{shop_type}": 6,
+    "/shop/{shop_type}/product/{product_id}": 6,
+    # Measured on SQLite: validation on the pooled session, then BEGIN
+    # IMMEDIATE, the ledger fold, the spend, the stock update, one
+    # multi-row order INSERT, the sales_daily upsert, the ledger debits and
+    # one code claim, whatever the size of the cart. Postgres swaps BEGIN
+    # IMMEDIATE for the user row lock.
+    "/api/redeem": 12,
+    "/api/checkout": 13,
+    "/orders": 2,
+    "/api/orders": 1,
+    # Three grouped sales_daily reads for the sales summary, plus pending
+    # credits and the recent ledger rows.
+    "/admin": 15,
+    "/admin/orders/export": 2,
+    "/admin/search": 4,
+}
+
+
+def pytest_configure(config) -> None:
+    config.addinivalue_line(
+        "markers",
+        "query_budget(budgets): override per-route SQL query budgets, "
+        "e.g. query_budget({'/admin': 20})",
+    )
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    budgets = dict(ROUTE_QUERY_BUDGETS)
+    marker = item.get_closest_marker("query_budget")
+    if marker is not None:
+        budgets.update(marker.args[0] if marker.args else marker.kwargs)
+    summaries: list[dict] = []
+    listener = summaries.append
+    was_enabled = profiler.enabled
+    profiler.enabled = True
+    profiler.listeners.append(listener)
+    try:
+        result = yield
+    finally:
+        profiler.listeners.remove(listener)
+        profiler.enabled = was_enabled
+    over = [
+        summary for summary in summaries
+        if summary["route"] in budgets
+        and summary["queries"] > budgets[summary["route"]]
+    ]
+    if over:
+        lines = [
+            f"{summary['method']} {summary['route']}: {summary['queries']} "
+            f"queries (budget {budgets[summary['route']]})"
+            for summary in over
+        ]
+        pytest.fail("Query budget exceeded:\n" + "\n".join(lines))
+    return result
@@ -0,0 +1,243 @@
+"""Replay a recorded traffic trace against a running instance.
+
+Traces are written by the app when ``TRAFFIC_RECORD_PATH`` is set. Every
+recorded session identity is mapped to a synthetic ``@replay_<n>`` user; run
+with ``--seed`` once to create those users (plus allowlist entries) in the
+database the target instance uses.
+
+    python -m tools.replay traffic.jsonl --base-url http://127.0.0.1:8000 \\
+        --speed 4 --seed --report replay.json
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from tools.stats import format_table, summarize
+
+AUTH_PATHS = {"/login", "/register", "/logout", "/admin/login", "/admin/logout"}
+STR_SHAPE = re.compile(r"^<str:(\d+)>$")
+
+
+def materialize(shape):
+    if isinstance(shape, str):
+        match = STR_SHAPE.match(shape)
+        if match:
+            return "x" * int(match.group(1))
+        if shape == "<num>":
+            return 1
+        return shape
+    if isinstance(shape, list):
+        return [materialize(item) for item in shape]
+    if isinstance(shape, dict):
+        return {key: materialize(value) for key, value in shape.items()}
+    return shape
+
+
+def load_trace(path: str) -> list[dict]:
+    records = []
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def identity_usernames(records: list[dict], prefix: str) -> dict[str, str]:
+    usernames = {}
+    for record in records:
+        identity = record.get("identity")
+        if identity and identity != "admin" and identity not in usernames:
+            usernames[identity] = f"@{prefix}_{len(usernames) + 1}"
+    return usernames
+
+
+def seed_users(usernames, password: str, points: int) -> None:
+    from sqlalchemy import select
+
+    from app.core.config import SHOP_TYPES
+    from app.core.database import SessionLocal, init_db
+    from app.core.security import hash_password
+    from app.models import AllowlistEntry, User
+
+    init_db()
+    password_hash = hash_password(password)
+    with SessionLocal() as db:
+        existing = set(
+            db.execute(
+                select(User.tg_username).where(User.tg_username.in_(usernames))
+            ).scalars()
+        )
+        allowed = set(
+            db.execute(
+                select(AllowlistEntry.tg_username, AllowlistEntry.shop_type)
+                .where(AllowlistEntry.tg_username.in_(usernames))
+            ).all()
+        )
+        for username in usernames:
+            if username not in existing:
+                db.add(
+                    User(
+                        tg_username=username,
+                        points=points,
+                        password_hash=password_hash,
+                    )
+                )
+            for shop_type in SHOP_TYPES:
+                if (username, shop_type) not in allowed:
+                    db.add(
+                        AllowlistEntry(tg_username=username, shop_type=shop_type)
+                    )
+        db.commit()
+
+
+class Replayer:
+    def __init__(self, args, usernames: dict[str, str]) -> None:
+        self.args = args
+        self.usernames = usernames
+        self.clients: dict[str, httpx.Client] = {}
+        self.client_locks: dict[str, threading.Lock] = defaultdict(
+            threading.Lock
+        )
+        self.results: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def _client(self, identity) -> httpx.Client:
+        key = identity or "anonymous"
+        with self.client_locks[key]:
+            client = self.clients.get(key)
+            if client is not None:
+                return client
+            client = httpx.Client(
+                base_url=self.args.base_url,
+                timeout=self.args.timeout,
+                follow_redirects=False,
+            )
+            if identity == "admin":
+                client.post(
+                    "/admin/login",
+                    data={"password": self.args.admin_password},
+                )
+            elif identity:
+                client.post(
+                    "/login",
+                    data={
+                        "tg_username": self.usernames[identity],
+                        "password": self.args.password,
+                    },
+                )
+            self.clients[key] = client
+            return client
+
+    def send(self, record: dict) -> None:
+        route = f"{record['method']} {record['route']}"
+        client = self._client(record.get("identity"))
+        body = record.get("body")
+        kwargs = {"params": materialize(record.get("query") or {})}
+        if isinstance(body, (dict, list)):
+            if record.get("content_type") == "application/json":
+                kwargs["json"] = materialize(body)
+            else:
+                kwargs["data"] = materialize(body)
+        started = time.perf_counter()
+        try:
+            response = client.request(record["method"], record["path"], **kwargs)
+            failed = response.status_code >= 500
+        except httpx.HTTPError:
+            failed = True
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.results[route].append(elapsed_ms)
+            if failed:
+                self.errors[route] += 1
+
+    def run(self, records: list[dict]) -> float:
+        replayable = [
+            record for record in records
+            if record["path"] not in AUTH_PATHS
+            and not str(record.get("body") or "").startswith("<multipart")
+        ]
+        self.skipped = len(records) - len(replayable)
+        if not replayable:
+            return 0.0
+        first_ts = replayable[0]["ts"]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for record in replayable:
+                if self.args.speed > 0:
+                    due = (record["ts"] - first_ts) / self.args.speed
+                    delay = due - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                pool.submit(self.send, record)
+        wall = time.perf_counter() - started
+        for client in self.clients.values():
+            client.close()
+        return wall
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--speed", type=float, default=1.0,
+        help="inter-arrival speed-up factor; 0 replays as fast as possible",
+    )
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--password", default="replay-password")
+    parser.add_argument("--admin-password", default="change-me")
+    parser.add_argument("--user-prefix", default="replay")
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--seed-points", type=int, default=100000)
+    parser.add_argument("--report", help="write the summary as JSON here")
+    args = parser.parse_args()
+
+    records = load_trace(args.trace)
+    usernames = identity_usernames(records, args.user_prefix)
+    if args.seed:
+        seed_users(list(usernames.values()), args.password, args.seed_points)
+
+    replayer = Replayer(args, usernames)
+    wall = replayer.run(records)
+    per_route = {
+        route: summarize(latencies, replayer.errors[route])
+        for route, latencies in sorted(replayer.results.items())
+    }
+    total = sum(row["count"] for row in per_route.values())
+    print(format_table(per_route))
+    print(
+        f"\n{total} requests in {wall:.1f}s "
+        f"({total / wall if wall else 0:.1f} req/s), "
+        f"{replayer.skipped} auth/multipart records skipped"
+    )
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as handle:
+            json.dump(
+                {
+                    "trace": args.trace,
+                    "base_url": args.base_url,
+                    "speed": args.speed,
+                    "wall_seconds": round(wall, 3),
+                    "requests": total,
+                    "throughput_rps": round(total / wall, 2) if wall else 0,
+                    "routes": per_route,
+                },
+                handle,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import math
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies_ms: list[float], errors: int = 0) -> dict:
+    return {
+        "count": len(latencies_ms),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2),
+        "max_ms": round(max(latencies_ms), 2) if latencies_ms else 0.0,
+    }
+
+
+def format_table(rows: dict[str, dict], title: str = "route") -> str:
+    header = (
+        f"{title:<44} {'count':>7} {'err':>5} {'p50':>8} {'p95':>8} "
+        f"{'p99':>8}"
+    )
+    lines = [header, "-" * len(header)]
+    for name, row in rows.items():
+        lines.append(
+            f"{name:<44} {row['count']:>7} {row['errors']:>5} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+        )
+    return "\n".join(lines)